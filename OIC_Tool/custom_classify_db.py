@@ -4,33 +4,60 @@ This is a custom version of the classify database. Queries the classify database
 Note that you might need to change the database credentials below if they ever get updated.
 """
 
-import oracledb as odb
 import pandas as pd
-from sqlalchemy import create_engine
 import numpy as np
 import sys, os
 sys.path.append(os.getcwd())
 sys.path.append(f"{os.getcwd()}/main_automation_programs")
+from oracle_pool import get_engine, read_arrow, describe, numeric_awb_query #imported from the same path as classify_db, so both modules share the same classify pool
+from query_metrics import read_timed
+import db_retry
+from typing import Dict
 
 un = 'classify_query_app'
 pw = 'ppa_yreuq_yfissalc'
 cs = 'ldap://eusoud.prod.fedex.com/CLASFY_PRD_01_CLASSIFY_S1'
 
-def execute_query(query: str):
+def execute_query(query: str, arrow: bool = False, schema: Dict[str, str] | None = None, params: Dict[str, object] | None = None, numeric_awbs: bool = False):
+    """
+    Executes given query in Classify, for the OIC task.\n
+    arrow, schema, params, numeric_awbs: same as for classify_db.execute_query.
+    """
 
-    #Initializing oracledb
-    from main_automation_programs.tools import find_OLD, get_envvar
-    odb.init_oracle_client(lib_dir=get_envvar('oracle_install_path'))
+    if numeric_awbs:
+        query = numeric_awb_query(query, db_retry.call('classify', lambda: describe('classify', query, user=un, password=pw, params=params, dsn=cs)))
+
+    return db_retry.call('classify', lambda: fetch(query, arrow, schema, params))
+
+def fetch(query: str, arrow: bool = False, schema: Dict[str, str] | None = None, params: Dict[str, object] | None = None) -> pd.DataFrame:
+    """
+    Runs the given (final) query in Classify, without any retries. See execute_query.
+    """
+
+    from main_automation_programs.tools import find_OLD
+
+    if arrow:
+        import pyarrow as pa #only needed for this fetch path
+        data = read_arrow('classify', query, user=un, password=pw, dsn=cs, casts={} if schema else {'awb_nbr': 'int64', 'billacc': 'int64', 'cad_val': 'float64'}, schema=schema, params=params)
+        if data['awb_nbr'].dtype == pd.ArrowDtype(pa.int64()):
+            return data
+        #finding faulty lines, awbs could not be cast
+        data = data.drop(labels = find_OLD(data), inplace=False)
+        return data.astype({'awb_nbr': pd.ArrowDtype(pa.int64())})
+
+    engine = get_engine('classify', user=un, password=pw, dsn=cs) #borrows a warm session from the shared classify pool
+    if schema:
+        data = read_timed(engine, query, schema=schema, params=params)
+        print(f"Dropping {data['awb_nbr'].isna().sum()} faulty awbs")
+        return data.dropna(subset=['awb_nbr'], inplace=False).astype({'awb_nbr': np.int64})
 
-    connection = odb.connect(user=un, password=pw, dsn=cs)
-    engine = create_engine('oracle+oracledb://', creator=lambda: connection) #using sqlalchemy for better compatibility
     data: pd.DataFrame = pd.DataFrame()
     try:
-        data = pd.read_sql(sql= query, con= engine, parse_dates=['entry_dt'], dtype={'awb_nbr': np.int64, 'billacc': np.int64, 'cad_val': np.float64})
+        data = pd.read_sql(sql= query, con= engine, params=params, parse_dates=['entry_dt'], dtype={'awb_nbr': np.int64, 'billacc': np.int64, 'cad_val': np.float64})
     except ValueError as e:
         print(f"Ecountered error during normal read: {e}")
         #finding faulty lines
-        data = pd.read_sql(sql= query, con= engine, parse_dates=['entry_dt'], dtype={'billacc': np.int64, 'cad_val': np.float64})
+        data = pd.read_sql(sql= query, con= engine, params=params, parse_dates=['entry_dt'], dtype={'billacc': np.int64, 'cad_val': np.float64})
         data = data.drop(labels = find_OLD(data), inplace=False)
 
         #fixing datatype
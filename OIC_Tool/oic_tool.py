@@ -10,6 +10,8 @@ import pandas as pd
 from typing import List, Dict, Set
 import win32com
 from main_automation_programs.tools import send_email, get_query
+from main_automation_programs.query_schemas import schema_for
+from main_automation_programs.query_registry import bind
 import datetime
 import json
 import time
@@ -24,7 +26,8 @@ class Fetch:
     sheet: object
     excelfilename: str
     def __init__(self):
-        self._query = get_query(r"main_automation_programs\support-files\queries\oic_task.sql")
+        self._query_path = r"main_automation_programs\support-files\queries\oic_task.sql"
+        self._query = get_query(self._query_path)
         self._validcoe = ['US', 'MX', 'PR']
         self._monthdict = {
             1: 'January',
@@ -90,9 +93,9 @@ class Fetch:
                 start, end = self.get_defaultdates(days= days)
         else:
             start, end = self.get_defaultdates(None)
-        qry = self._query.format(start_date= start, end_date = end)
+        qry, params = bind(self._query, 'named', start_date= start, end_date = end) #dates as bind parameters, Oracle reuses the parsed statement
         print("Waiting on query results")
-        self.queryresults = custom_classify_db.execute_query(query= qry)
+        self.queryresults = custom_classify_db.execute_query(query= qry, schema=schema_for(self._query_path), params=params, numeric_awbs=True) #OLD awbs filtered by Classify
         self.pivot()
 
     def get_defaultdates(self, days: int | None) -> tuple[str, str]:
@@ -4,37 +4,88 @@ Used for querying the Classify database from python.
 Please note that you might need to change the credentials below if they ever get updated (you will probably receive an email warning you that the credentials are changing)
 """
 
-import oracledb as odb
 import pandas as pd
-from sqlalchemy import create_engine
 import numpy as np
 import time
 import sys, os
 sys.path.append(os.getcwd())
 sys.path.append(f"{os.getcwd()}/main_automation_programs")
+from oracle_pool import get_engine, read_arrow, iter_batches, read_with_lookup, describe, numeric_awb_query
+from query_cache import cached, key_for_values
+import query_metrics
+import query_registry
+import standin_db
+import db_retry
+from typing import Dict, Iterator
 
 un = 'classify_query_app'
 pw = 'ppa_yreuq_yfissalc'
 cs = 'ldap://eusoud.prod.fedex.com/CLASFY_PRD_01_CLASSIFY_S1'
+lookup_table = 'awb_lookup_gtt' #global temporary table used for big awb lookups (see lookup_query and anti_join_query)
 
 
-def execute_query(query: str, starting: str = '', ending: str = ''):
-
-    #initialize the oracle client, needed to run the queries
-    from tools import get_envvar
-    odb.init_oracle_client(lib_dir=get_envvar('oracle_install_path'))   
+def execute_query(query: str, starting: str = '', ending: str = '', arrow: bool = False, cache_ttl: float = 0, force_refresh: bool = False,
+                  schema: Dict[str, str] | None = None, params: Dict[str, object] | None = None, numeric_awbs: bool = False):
+    """
+    Executes given query in Classify.\n
+    arrow: fetches straight into an Arrow-backed dataframe instead of going through pd.read_sql.\n
+    cache_ttl, force_refresh: reuses locally cached results for cache_ttl secs (see query_cache), unless forced to fetch again.\n
+    schema: column types to build the results with (see query_schemas.schema_for). Without one, only the awb col is converted to ints.\n
+    params: bind parameters for the query (see query_registry.bind); the dates are bound as ':starting' and ':ending'.\n
+    numeric_awbs: only returns rows with numeric awbs, cast to integers by Classify (see normalize_awbs).
+    """
 
     t = time.time()
     print(f"Fetching '{cs}' with query '{query[:min(len(query), 200)].replace('\n', ' ')}' (complete query may not be shown)")
-    connection = odb.connect(user=un, password=pw, dsn=cs)
-    engine = create_engine('oracle+oracledb://', creator=lambda: connection) #using sqlalchemy for better compatibility
     #Checking dates
+    params = dict(params or {})
     if starting != '' and ending != '':
         print(f"Fetching for dates {starting} to {ending}")
-        query = query.format(starting = starting, ending = ending)
+        query, dates = query_registry.bind(query, 'named', starting = starting, ending = ending)
+        params.update(dates)
+    if numeric_awbs:
+        query = normalize_awbs(query, params)
+    query = query_registry.limit(query, 'oracle') #only the rows the query's row_limit keeps, if it has one (see query_registry.limit)
 
     #Fetching
-    data = pd.read_sql(sql= query, con= engine)
+    timings: Dict[str, float] = dict() #filled in while fetching, see query_metrics
+    if cache_ttl > 0:
+        data = cached('classify', query, lambda: db_retry.call('classify', lambda: fetch(query, arrow, timings, schema, params)), ttl=cache_ttl,
+                      params={'arrow': arrow, 'schema': schema, 'binds': params}, force_refresh=force_refresh, arrow=arrow)
+    else:
+        data = db_retry.call('classify', lambda: fetch(query, arrow, timings, schema, params)) #transient errors are retried with a backoff, see db_retry
+    print(f"Time taken to run Classify query: {time.time()-t} secs\n{data}")
+    query_metrics.record('classify', query, data, timings, time.time()-t, arrow=arrow)
+    return data
+
+def normalize_awbs(query: str, params: Dict[str, object] | None = None, variable: str = 'awb_nbr', described: str | None = None) -> str:
+    """
+    Returns the given (bound) query wrapped so Classify drops non numeric awbs and casts the rest to integers (see oracle_pool.numeric_awb_query).\n
+    described: query to read the columns from instead, when it has the same columns (e.g before it was wrapped in an anti-join).
+    """
+    described = query if described is None else described
+    if standin_db.enabled():
+        cols = standin_db.describe('classify', described, params)
+    else:
+        cols = db_retry.call('classify', lambda: describe('classify', described, user=un, password=pw, params=params, dsn=cs))
+    return numeric_awb_query(query, cols, variable)
+
+def fetch(query: str, arrow: bool = False, timings: Dict[str, float] | None = None, schema: Dict[str, str] | None = None,
+          params: Dict[str, object] | None = None) -> pd.DataFrame:
+    """
+    Runs the given (final) query in Classify (or the stand-in, see standin_db), without any caching. See execute_query.
+    """
+    if standin_db.enabled():
+        data = standin_db.read_sql('classify', query, timings, arrow=arrow, schema=schema, params=params)
+        return data if arrow or schema else data.astype(dtype={'awb_nbr': np.int64}, errors='ignore')
+
+    if arrow:
+        return read_arrow('classify', query, user=un, password=pw, dsn=cs, casts={} if schema else {'awb_nbr': 'int64'}, timings=timings, schema=schema, params=params) #awb cast is done in Arrow, no second copy
+
+    engine = get_engine('classify', user=un, password=pw, dsn=cs) #borrows a warm session from the shared classify pool
+    data = query_metrics.read_timed(engine, query, timings, schema, params)
+    if schema:
+        return data #already typed while built
     try:
         # data = pd.read_sql(sql= query, con= engine, dtype={'awb_nbr': np.int64, 'bill_to_acc': np.int64})
         data = data.astype(dtype={'awb_nbr': np.int64})
@@ -42,5 +93,91 @@ def execute_query(query: str, starting: str = '', ending: str = ''):
         print("Failed to automatically convert awb col to ints, returning default fetch")
     else:
         print("Successfully converted awb col to ints")
-    print(f"Time taken to run Classify query: {time.time()-t} secs\n{data}")
-    return data
\ No newline at end of file
+    return data
+
+def iter_query(query: str, batch_rows: int = 50000, starting: str = '', ending: str = '', schema: Dict[str, str] | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Streaming version of execute_query: yields the results in dataframes of at most batch_rows rows, as they arrive from Classify.
+    """
+
+    t = time.time()
+    print(f"Streaming '{cs}' in batches of {batch_rows} rows with query '{query[:min(len(query), 200)].replace('\n', ' ')}' (complete query may not be shown)")
+    params: Dict[str, object] = dict()
+    if starting != '' and ending != '':
+        print(f"Fetching for dates {starting} to {ending}")
+        query, params = query_registry.bind(query, 'named', starting = starting, ending = ending)
+    query = query_registry.limit(query, 'oracle')
+
+    rows: int = 0
+    if standin_db.enabled():
+        batches = standin_db.iter_batches('classify', query, batch_rows=batch_rows, schema=schema, params=params)
+    else:
+        batches = iter_batches('classify', query, user=un, password=pw, dsn=cs, batch_rows=batch_rows, schema=schema, params=params)
+    for batch in batches:
+        if not schema: #typed batches are already built with their types
+            try:
+                batch = batch.astype(dtype={'awb_nbr': np.int64})
+            except:
+                print("Failed to automatically convert awb col to ints for batch, returning default fetch")
+        rows += batch.shape[0]
+        yield batch
+    print(f"Time taken to stream Classify query: {time.time()-t} secs ({rows} rows)")
+
+def lookup_query(query: str, awbs: list, variable: str = 'AWB_NBR', placeholder: str = 'awbs_to_search', schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Runs a lookup query for the given awbs through the lookup temp table (see README), instead of pasting them in as IN lists.\n
+    variable: name of the awb column to filter on, its placeholder (e.g '{awbs_to_search}') becomes 'IN (SELECT val FROM awb_lookup_gtt)'.
+    """
+
+    t = time.time()
+    query = query.format(**{placeholder: f"{variable} IN (SELECT val FROM {lookup_table})"})
+    print(f"Looking up {len(awbs)} awbs in '{cs}' through temp table '{lookup_table}'")
+    if standin_db.enabled():
+        data = standin_db.read_with_lookup('classify', query, awbs, lookup_table, schema=schema)
+    else:
+        data = db_retry.call('classify', lambda: read_with_lookup('classify', query, awbs, lookup_table, user=un, password=pw, dsn=cs, schema=schema))
+    if not schema:
+        try:
+            data = data.astype(dtype={'awb_nbr': np.int64})
+        except:
+            print("Failed to automatically convert awb col to ints, returning default fetch")
+    print(f"Time taken to run Classify lookup: {time.time()-t} secs\n{data}")
+    return data
+
+def anti_join_query(query: str, awbs: list, starting: str = '', ending: str = '', variable: str = 'awb_nbr', cache_ttl: float = 0, force_refresh: bool = False,
+                    schema: Dict[str, str] | None = None, numeric_awbs: bool = False) -> pd.DataFrame:
+    """
+    Runs the given query in Classify, only returning the rows whose awb is NOT in the given awbs (e.g Classify volume missing from Gail's LVS files).\n
+    The difference is taken by Oracle on the raw awbs, against the lookup temp table; with numeric_awbs they are cast afterwards.\n
+    variable: name of the awb column in the query's results. Other arguments are the same as for execute_query.
+    """
+
+    t = time.time()
+    params: Dict[str, object] = dict()
+    if starting != '' and ending != '':
+        print(f"Fetching for dates {starting} to {ending}")
+        query, params = query_registry.bind(query, 'named', starting = starting, ending = ending)
+    raw: str = query
+    query = f"SELECT * FROM (\n{raw}\n) q WHERE NOT EXISTS (SELECT 1 FROM {lookup_table} l WHERE l.val = q.{variable})" #raw awb strings on both sides
+    if numeric_awbs: #only once the difference is taken, the cast never becomes a join key
+        query = normalize_awbs(query, params, variable, described=raw)
+    print(f"Fetching '{cs}' rows missing from {len(awbs)} awbs through temp table '{lookup_table}'")
+
+    timings: Dict[str, float] = dict() #filled in while fetching, see query_metrics
+    def fetch() -> pd.DataFrame:
+        if standin_db.enabled():
+            return standin_db.read_with_lookup('classify', query, awbs, lookup_table, timings, schema=schema, params=params)
+        return read_with_lookup('classify', query, awbs, lookup_table, user=un, password=pw, dsn=cs, schema=schema, params=params, timings=timings)
+
+    if cache_ttl > 0:
+        data = cached('classify', query, lambda: db_retry.call('classify', fetch), ttl=cache_ttl, params={'awbs': key_for_values(awbs), 'schema': schema, 'binds': params}, force_refresh=force_refresh)
+    else:
+        data = db_retry.call('classify', fetch)
+    if not schema:
+        try:
+            data = data.astype(dtype={variable: np.int64})
+        except:
+            print("Failed to automatically convert awb col to ints, returning default fetch")
+    print(f"Time taken to run Classify anti-join: {time.time()-t} secs\n{data}")
+    query_metrics.record('classify', query, data, timings, time.time()-t, lookup=len(awbs))
+    return data
@@ -0,0 +1,201 @@
+"""
+Shared retry policy for the database modules (classify_db, misa_db and wfm_db).
+
+Errors are classified first (see classify): 'network' and 'spool' errors are retried with a jittered backoff, 'auth' (logon failures) and 'syntax' (query errors) never are.
+Each database also has a circuit breaker (see Breaker) that fails calls straight away for a while after too many failures in a row, or right away on an auth error.
+Attempts, waits and breaker settings can be changed in your .env file (see README).
+"""
+
+from typing import Callable, Dict, Sequence, TypeVar
+import threading
+import random
+import time
+import re
+
+T = TypeVar('T')
+kinds: Sequence[str] = ('network', 'spool', 'auth', 'syntax', 'other')
+transient: Sequence[str] = ('network', 'spool') #kinds worth retrying
+
+#Error codes and messages for each kind of error, Teradata ([Error 2646]), Oracle (ORA-01652), python-oracledb (DPY-4011) and the DuckDB stand-in
+patterns: Dict[str, re.Pattern] = {
+    'auth': re.compile(r"\[Error (?:8017|3032)\]|ORA-(?:01017|28000|28001)\b|DPY-4001", re.IGNORECASE), #logon failures only
+    'spool': re.compile(r"\[Error (?:2646|2644|3130)\]|ORA-(?:01652|01555|30036|04031)\b|spool space|unable to extend temp", re.IGNORECASE),
+    'syntax': re.compile(r"\[Error (?:3706|3707|3802|3807|3810|3822|5628|2620|2666|3535|3523|3524)\]|ORA-(?:009\d\d|01722|01843|01861|01858|00001|01031)\b|DPY-40(?:08|10)|"
+                         r"syntax error|ParserException|CatalogException|BinderException|ConversionException", re.IGNORECASE),
+    'network': re.compile(r"\[Error (?:2631|8024|8055)\]|ORA-(?:03113|03114|03135|12152|12170|12514|12505|12537|12541|12543|12547|25408)\b|"
+                          r"DPY-(?:4011|6005|6000)|DPI-1080|connection (?:reset|refused|aborted|closed|timed out)|timed? ?out|broken pipe|socket|"
+                          r"network|unreachable|no route to host|hostname lookup|failed to connect|session .*(?:dropped|aborted)|deadlock", re.IGNORECASE),
+}
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a database whose circuit breaker is open (see Breaker).
+    """
+
+def classify(e: BaseException) -> str:
+    """
+    Returns the kind of the given database error: 'network', 'spool', 'auth', 'syntax' or 'other'. Wrapped and chained errors are checked as well.
+    """
+    if isinstance(e, CircuitOpenError):
+        return 'other'
+    messages: list = list()
+    seen: set = set()
+    error: BaseException | None = e
+    while error is not None and id(error) not in seen: #walking wrapped/chained errors
+        seen.add(id(error))
+        messages.append(f"{type(error).__name__}: {error}")
+        error = getattr(error, 'orig', None) or error.__cause__ or error.__context__
+    message: str = '\n'.join(messages)
+
+    for kind in ['auth', 'spool', 'syntax', 'network']: #most specific first, e.g a logon timeout is still an auth error
+        if patterns[kind].search(message):
+            return kind
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return 'network'
+    return 'other'
+
+def backoff(attempt: int) -> float:
+    """
+    Returns how many secs to wait before the given retry (1 for the first one), with jitter:
+    a random wait between half of and the whole of 'db_retry_base_secs' * 2^(attempt-1), capped at 'db_retry_max_secs'.
+    """
+    from tools import get_setting
+
+    base: float = get_setting('db_retry_base_secs', 2.0)
+    cap: float = get_setting('db_retry_max_secs', 120.0)
+    ceiling: float = min(cap, base * 2**max(attempt-1, 0))
+    return random.uniform(ceiling/2, ceiling)
+
+class Breaker:
+    """
+    Circuit breaker for one database, shared by every thread of the job.\n
+    check() raises a CircuitOpenError while it is open; success() and failure(kind) record the outcome of each call.
+    Once the cooldown passed, a single trial call is let through (half open): the breaker closes if it works, and opens again if it fails.
+    """
+
+    def __init__(self, database: str, failures: int, cooldown: float) -> None:
+        self.database = database
+        self.failures = failures #failed attempts in a row that open the breaker
+        self.cooldown = cooldown #secs the breaker stays open
+        self.consecutive: int = 0
+        self.opened: float = 0 #when the breaker was opened, 0 while closed
+        self.reason: str = ''
+        self.trial: int | None = None #thread holding the half open breaker's trial slot
+        self.trial_started: float = 0
+        self._lock = threading.Lock()
+
+    def _refused(self, now: float) -> bool:
+        """
+        Checks if the calling thread's calls are currently refused: the breaker is open, or half open with the trial slot held by another thread. Call with the lock held.
+        """
+        if self.opened == 0:
+            return False
+        if now - self.opened < self.cooldown:
+            return True
+        return self.trial not in (None, threading.get_ident()) and now - self.trial_started < self.cooldown
+
+    def is_open(self) -> bool:
+        """
+        Checks if calls to the database from the calling thread are currently refused (open, or half open with another thread's trial call in flight).
+        """
+        with self._lock:
+            return self._refused(time.time())
+
+    def check(self) -> None:
+        """
+        Raises a CircuitOpenError if the breaker is open, or half open with another thread's trial call in flight. Otherwise claims the trial slot when half open.
+        """
+        with self._lock:
+            now: float = time.time()
+            if self.opened > 0 and now - self.opened < self.cooldown:
+                raise CircuitOpenError(f"Not calling '{self.database}', its circuit breaker opened {now-self.opened:.0f} secs ago ({self.reason}). "
+                                       f"Calls resume after {self.cooldown:.0f} secs.")
+            if self._refused(now):
+                raise CircuitOpenError(f"Not calling '{self.database}', its circuit breaker is half open and a trial call is checking if it is back ({self.reason}).")
+            if self.opened > 0 and self.trial != threading.get_ident(): #half open, this call is the trial
+                print(f"'{self.database}' circuit breaker is half open, letting one trial call through")
+                self.trial = threading.get_ident()
+                self.trial_started = now
+
+        return None
+
+    def success(self) -> None:
+        """
+        Records a successful call, closing the breaker.
+        """
+        with self._lock:
+            if self.opened > 0:
+                print(f"'{self.database}' answered again, closing its circuit breaker")
+            self.consecutive = 0
+            self.opened = 0
+            self.reason = ''
+            self.trial = None
+
+        return None
+
+    def failure(self, kind: str, e: BaseException | None = None) -> None:
+        """
+        Records a failed attempt of the given kind (see classify). Auth errors open the breaker right away, transient ones once they failed too many times in a row.
+        Query errors (syntax, other) do not say anything about the database, and are not counted; a trial call failing with one frees the trial slot for another call.
+        """
+        if kind not in ('auth', *transient):
+            with self._lock:
+                if self.trial == threading.get_ident():
+                    self.trial = None
+            return None
+
+        with self._lock:
+            self.consecutive += 1
+            if kind == 'auth' or self.consecutive >= self.failures or self.opened > 0: #a failed call while half open opens it again
+                self.opened = time.time()
+                self.trial = None
+                self.reason = f"{kind} error: {str(e).splitlines()[0] if e is not None and str(e) else kind}"
+                print(f"Opening '{self.database}' circuit breaker for {self.cooldown:.0f} secs after {self.consecutive} failed attempt(s) in a row ({self.reason})")
+
+        return None
+
+_breakers: Dict[str, Breaker] = dict()
+_breakers_lock = threading.Lock()
+
+def breaker(database: str) -> Breaker:
+    """
+    Returns the given database's circuit breaker, creating it on first use.
+    """
+    from tools import get_setting
+
+    with _breakers_lock:
+        if database not in _breakers:
+            _breakers[database] = Breaker(database, get_setting('db_breaker_failures', 5), get_setting('db_breaker_cooldown', 300.0))
+        return _breakers[database]
+
+def call(database: str, fetch: Callable[[], T], retry_on: Sequence[str] = transient, attempts: int | None = None) -> T:
+    """
+    Runs the given fetch for the given database, retrying it with a jittered backoff when it fails with a transient error.\n
+    retry_on: kinds of error that are retried, any other error is raised straight away.\n
+    attempts: tries at most, defaults to the 'db_retry_attempts' .env variable.
+    """
+    from tools import get_setting
+
+    circuit: Breaker = breaker(database)
+    attempts = attempts or get_setting('db_retry_attempts', 4)
+    for attempt in range(1, attempts+1):
+        circuit.check()
+        try:
+            result = fetch()
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            kind: str = classify(e)
+            circuit.failure(kind, e)
+            if kind not in retry_on or attempt == attempts or circuit.is_open():
+                print(f"'{database}' call failed with a{'n' if kind[0] in 'aeiou' else ''} {kind} error, not retrying. Exception: {type(e).__name__}")
+                raise
+            wait: float = backoff(attempt)
+            print(f"'{database}' call failed with a {kind} error (attempt {attempt} of {attempts}), retrying in {wait:.1f} secs. Exception: {str(e).splitlines()[0] if str(e) else type(e).__name__}")
+            time.sleep(wait)
+            continue
+
+        circuit.success()
+        return result
+
+    raise RuntimeError(f"No attempts made for '{database}'") #only reached when attempts is 0
@@ -0,0 +1,119 @@
+"""
+Fetch size tuning for the Oracle queries (Classify, WFM): how many rows come back per network round trip.
+
+arraysize is set to fill about 'fetch_buffer_kb' (.env variable) per round trip given the row width, capped by the rows seen on past runs (see query_metrics).
+Small results are prefetched along with the execute. A .sql file can override both with comments, e.g '-- arraysize: 20000'.
+"""
+
+from typing import Dict, Sequence
+import threading
+import math
+import re
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+import query_metrics
+
+default_prefetchrows: int = 2 #python-oracledb default
+min_arraysize: int = 100
+max_arraysize: int = 100000
+default_row_width: int = 256 #bytes, assumed when nothing is known about the query yet
+headroom: float = 1.25 #results may grow a bit from one run to the next (e.g later in the month)
+
+_lock = threading.Lock()
+_profiles: Dict[str, Dict[str, float]] | None = None #maps a query fingerprint to its past rows and row width, read once per run
+
+def overrides(query: str) -> Dict[str, int]:
+    """
+    Returns the fetch sizes set by hand in the query's comments (e.g '-- arraysize: 20000').
+    """
+    return {name: int(value) for name, value in re.findall(r"--\s*(arraysize|prefetchrows)\s*[:=]\s*(\d+)", query, flags=re.IGNORECASE)}
+
+def profiles() -> Dict[str, Dict[str, float]]:
+    """
+    Returns the profile of every query recorded in the metrics log (see query_metrics): the most rows returned over its last runs, and its (approximate) bytes per row.
+    Read once per run; only runs against the current backend that were not served from the local cache are used.
+    """
+    global _profiles
+
+    with _lock:
+        if _profiles is not None:
+            return _profiles
+
+        _profiles = dict()
+        try:
+            metrics = query_metrics.load(days=90)
+        except Exception as e: #tuning is best effort, a broken log only means default sizes
+            print(f"Unable to read query metrics for fetch tuning, using default sizes. Exception: {e}")
+            return _profiles
+        if metrics.empty:
+            return _profiles
+
+        metrics = metrics[~metrics['cached']]
+        if 'backend' in metrics.columns:
+            metrics = metrics[metrics['backend'].fillna('production') == query_metrics.backend()] #stand-in runs do not size production fetches
+        for fingerprint, runs in metrics.sort_values('ts').groupby('fingerprint'):
+            runs = runs.iloc[-5:] #only the last runs, sizes drift over time
+            rows = runs['rows'].max()
+            _profiles[fingerprint] = {
+                'rows': float(rows),
+                'row_width': float(runs['bytes'].sum()/runs['rows'].sum()) if runs['rows'].sum() else 0
+            }
+
+    return _profiles
+
+def row_width(description: Sequence[Sequence] | None) -> int:
+    """
+    Returns the size of one fetched row in bytes, from the cursor's description (the buffers oracledb allocates per row).
+    """
+    if not description:
+        return 0
+
+    width: int = 0
+    for col in description:
+        internal_size = col[3] if len(col) > 3 else None
+        width += internal_size if isinstance(internal_size, int) and 0 < internal_size < 32768 else 32 #LOBs and unknown sizes count as a pointer sized value
+    return width
+
+def tune(query: str, description: Sequence[Sequence] | None = None) -> Dict[str, int]:
+    """
+    Returns the arraysize and prefetchrows to use for the given query.\n
+    description: the cursor's description, to size rows from their columns. Past runs are used without it.
+    """
+    from tools import get_setting
+
+    profile = profiles().get(query_metrics.fingerprint(query), dict())
+    width: float = row_width(description) or profile.get('row_width') or default_row_width
+    buffer_rows: int = int(get_setting('fetch_buffer_kb', 1024)*1024 // max(width, 1))
+    arraysize: int = min(max(buffer_rows, min_arraysize), max_arraysize)
+    prefetchrows: int = default_prefetchrows
+
+    if 'rows' in profile: #sizing to what this query returned before
+        expected: int = math.ceil(profile['rows']*headroom) + 1
+        arraysize = max(min(arraysize, expected), min_arraysize)
+        prefetchrows = expected if expected <= arraysize else arraysize #small results come back with the execute
+
+    sizes = {'arraysize': arraysize, 'prefetchrows': prefetchrows}
+    sizes.update(overrides(query))
+    return sizes
+
+def apply(cursor, query: str, executed: bool = False) -> Dict[str, int]:
+    """
+    Sets the tuned sizes on the given oracledb cursor, and returns them. Once executed, arraysize is set again from the cursor's columns.
+    """
+    sizes = tune(query, cursor.description if executed else None)
+    cursor.arraysize = sizes['arraysize']
+    if not executed:
+        cursor.prefetchrows = sizes['prefetchrows']
+    return sizes
+
+def clear() -> None:
+    """
+    Forgets the profiles read from the metrics log, so they are read again on next use (e.g after a long running job).
+    """
+    global _profiles
+
+    with _lock:
+        _profiles = None
+
+    return None
@@ -3,6 +3,7 @@ from tkinter import filedialog
 import pandas as pd
 from tools import merge_files, get_classify
 from tools import get_query
+from query_schemas import schema_for
 import json, os
 from pathlib import Path
 import time
@@ -26,9 +27,10 @@ def run() -> None:
     print(f"Volume data:\n{lvs_data}")
 
     #Getting classify data
-    classify_query: str = get_query(r"main_automation_programs\support-files\queries\classify_COE_Bill-to-acc.sql") #reading saved query
+    query_path: str = r"main_automation_programs\support-files\queries\classify_COE_Bill-to-acc.sql"
+    classify_query: str = get_query(query_path) #reading saved query
     awbs = list(lvs_data['Tracking Number'])
-    classify_data = get_classify(awbs, classify_query) #adding awbs to query, getting data
+    classify_data = get_classify(awbs, classify_query, schema=schema_for(query_path)) #adding awbs to query, getting data
     print(f"Classify data:\n{classify_data}")
 
     #Merging data
@@ -8,13 +8,17 @@ For each FTA correction, their query is run and fed into the FTA corrections mac
 The results are emailed out.
 
 Run on Mondays, Wednesdays, and Fridays.
+
+The queries run in parallel MISA sessions (see run_queries), or as one shared scan with 'fta_extraction' set to 'single_scan' (see run_single_scan).
 """
 
-from typing import List, Dict
-from misa_db import execute_query
+from typing import List, Dict, Tuple
+from misa_db import execute_query, volatile_query, stage_table
 import datetime
 from datetime import datetime, timedelta
-from tools import get_query, get_envvar, send_email, get_password
+from tools import get_query, get_envvar, get_setting, send_email, get_password, excel_values
+from query_schemas import schema_for, layout_for, layouts
+import query_registry
 from pandas import DataFrame
 import dotenv, os
 from pathlib import Path
@@ -22,6 +26,7 @@ import shutil
 import xlwings as xw
 import time
 from numpy import nan
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 
 def get_month() -> str:
     """
@@ -66,147 +71,124 @@ def fix_headings(data: DataFrame, index: str) -> DataFrame:
     Drops all unnecessary columns, for each dataframe.
 
     Adds any necessary, empty, new columns to match fixed cols requirements.
+
+    The columns of each sheet are kept in query_schemas.layouts; results already fetched in that order are returned as they are.
     """
 
-    #Dict showing the correct order for headers
-    fixed_cols: Dict[str, List[str]] = {
-        'CUSMA_40': [
-            'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
-            'ORDER_IN_COUNCIL_DOC_NBR',
-            'TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
-            'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',# used to be -> '(((SALES_TAX_AMT+PROVINCIAL_SALES_TAX_AMT)+SPCL_IMPT_MEAS_ACT_TAX_AMT)+DUTY_AMT)' MIGH NEED TO CHANGE, review calculations of tax,
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM',
-            'CONTACT_NM', # We don't do this one anymore 
-            'CITY_NM',
-            'STATE_CD', 'STATE_PROVINCE_NM',
-            'POSTAL_CD',
-            'REFERENCE_NOTES_DESC'
-            ],
-
-        '0017_non_CUSMA': [
-            'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
-            'MANUF_ORIGIN_COUNTRY_CD', #this one is different from CUSMA_40; replaced OIC with COM
-            'TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
-            'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC'
-            ],
-
-        '0017_150+': [ #identical to CUSMA_40
-            'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
-            'ORDER_IN_COUNCIL_DOC_NBR','TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
-            'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC'
-        ],
-
-        'ROW_20': [ #identical to CUSMA_40
-            'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
-            'ORDER_IN_COUNCIL_DOC_NBR','TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
-            'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC'
-        ],
-
-        'CUKTA_CAS': [ #identical to CUSMA_40
-            'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
-            'ORDER_IN_COUNCIL_DOC_NBR','TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
-            'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC'
-        ],
-
-        'CUKTA_NR': [ #No reference on header, but I am assuming it should be identical to CUSMA_40
-            'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
-            'ORDER_IN_COUNCIL_DOC_NBR','TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
-            'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC'
-        ],
-
-        'CETA_CAS': [
-            'AWB_NBR', 'COMMODITY_LINE_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'MANUF_ORIGIN_COUNTRY_CD', 'TARIFF_TREATMENT_CD',
-            'SHIPMENT_VALUE_FLG', 'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC', 'DUTY_BILL_TO_ACCT_NBR'
-        ],
-
-        'CETA_NR': [ #identical to CETA_CAS
-            'AWB_NBR', 'COMMODITY_LINE_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'MANUF_ORIGIN_COUNTRY_CD', 'TARIFF_TREATMENT_CD',
-            'SHIPMENT_VALUE_FLG', 'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC', 'DUTY_BILL_TO_ACCT_NBR'
-        ],
-
-        'CPTPP_CAS': [ #identical to CETA_CAS
-            'AWB_NBR', 'COMMODITY_LINE_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'MANUF_ORIGIN_COUNTRY_CD', 'TARIFF_TREATMENT_CD',
-            'SHIPMENT_VALUE_FLG', 'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
-            'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
-            'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
-            'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
-            'TOTAL_VALUE_DUTY_AMT',
-            'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
-            'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
-            'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
-            'REFERENCE_NOTES_DESC', 'DUTY_BILL_TO_ACCT_NBR'
-        ]
-    }
+    fixed_cols: List[str] = layouts[f'FTA/{index}'] #correct order for headers
+    if list(data.columns) == fixed_cols:
+        return data #already fetched in the final layout
 
     #Adding any applicable missing columns (adds with all empty numpy NaN values.)
-    new_data: DataFrame = data.copy(deep=True)
-    for header in fixed_cols[index]:
+    for header in fixed_cols:
         if header not in data.columns: #checking if header is missing from existing data
             data[header] = nan #for headers missing, create new col with empty values
-    
-    new_data = data[fixed_cols[index]]
-    return new_data #only return cols in the given list, in the given order; gets list from fixed_cols dictionary
+
+    return data[fixed_cols] #only return cols in the given list, in the given order
+
+def run_queries(queries_path: Path, start: str, end: str, max_sessions: int | None = None) -> Dict[str, DataFrame]:
+    """
+    Runs every query in the given folder for the given dates at the same time, on up to max_sessions MISA sessions ('fta_sessions' .env variable, defaults to 4).
+    Returns a dict mapping each query's name to its results; a query that fails is reported and left out.
+    """
+    max_sessions = max(1, get_setting('fta_sessions', 4) if max_sessions is None else max_sessions)
+    pw: str = get_envvar('pw')
+
+    def run_query(name: str, query: str, schema: Dict[str, str], columns: List[str] | None) -> Tuple[DataFrame, float]:
+        t = time.time()
+        print(f"Querying for '{name}'")
+        data = execute_query(query=query, pw=pw, starting=start, ending=end, max_sessions=max_sessions, schema=schema, columns=columns)
+        return data, time.time()-t
+
+    results: Dict[str, DataFrame] = dict()
+    failed: Dict[str, Exception] = dict()
+    timings: Dict[str, float] = dict()
+    t = time.time()
+    with ThreadPoolExecutor(max_workers=max_sessions) as executor:
+        running: Dict[Future, str] = {
+            executor.submit(run_query, query.split('.')[0], get_query(str(queries_path/query)), schema_for(queries_path/query), layout_for(queries_path/query)): query.split('.')[0] #reading queries up front, keyed by name
+            for query in os.listdir(queries_path)
+        }
+        for future in as_completed(running):
+            name = running[future]
+            try:
+                results[name], timings[name] = future.result()
+            except Exception as e: #isolating failures, the other queries keep going
+                failed[name] = e
+                print(f"Query for '{name}' failed, skipping it. Exception: {e}\n")
+                continue
+            print(f"Query for '{name}' fetched successfully in {timings[name]:.2f} secs ({results[name].shape[0]} rows).\n")
+            print(results[name])
+
+    print(f"Ran {len(running)} queries on up to {max_sessions} sessions in {time.time()-t:.2f} secs (sum of query times: {sum(timings.values()):.2f} secs)")
+    for name, timing in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+        print(f"\t'{name}': {timing:.2f} secs")
+    if failed:
+        print(f"Failed queries: {', '.join(failed)}")
+
+    return results
+
+def split_query(table: str, limits: Dict[str, Tuple[int | None, str]]) -> str:
+    """
+    Returns the query reading the single scan's rows back from the given volatile table (see run_single_scan).
+    limits maps each sheet to its row limit and order; only the rows of each sheet's first order values are read back.
+    """
+    firsts: List[str] = list()
+    ranks: List[str] = list()
+    keep: List[str] = list()
+    for sheet, (rows, order) in limits.items():
+        if rows is None:
+            keep.append(f'"IN_{sheet}" = 1')
+            continue
+        firsts.append(f'CASE WHEN "IN_{sheet}" = 1 AND SUM("IN_{sheet}") OVER (PARTITION BY {order} ORDER BY {order} ROWS UNBOUNDED PRECEDING) = 1 THEN 1 ELSE 0 END AS "FIRST_{sheet}"') #one row per order value
+        ranks.append(f'SUM("FIRST_{sheet}") OVER (ORDER BY {order} ROWS UNBOUNDED PRECEDING) AS "RANK_{sheet}"') #position of the row's order value among the sheet's
+        keep.append(f'("IN_{sheet}" = 1 AND "RANK_{sheet}" <= {rows})')
+
+    flagged: str = f"SELECT s.*{''.join(f', {first}' for first in firsts)} FROM {table} s"
+    ranked: str = f"SELECT f.*{''.join(f', {rank}' for rank in ranks)} FROM ({flagged}) f"
+    return f"SELECT * FROM ({ranked}) r WHERE {' OR '.join(keep) or '1 = 1'}"
+
+def run_single_scan(queries_path: Path, start: str, end: str,
+                    scan_path: Path = Path(r"main_automation_programs\support-files\queries\fta_single_scan.sql")) -> Dict[str, DataFrame]:
+    """
+    Single scan version of run_queries, returning the same dict: MISA runs fta_single_scan.sql once into a volatile table, and the rows are split into each sheet locally.
+    Raises a ValueError if the scan query has no IN_<sheet> col for one of the queries in the folder.
+    """
+    pw: str = get_envvar('pw')
+    queries: Dict[str, str] = {query.split('.')[0]: get_query(str(queries_path/query)) for query in os.listdir(queries_path)} #keyed by name
+    limits: Dict[str, Tuple[int | None, str]] = {name: query_registry.row_limit(query) for name, query in queries.items()}
+    columns: Dict[str, List[str] | None] = {name: query_registry.columns(query) for name, query in queries.items()}
+    unreadable: List[str] = [name for name, cols in columns.items() if cols is None]
+    if unreadable:
+        raise ValueError(f"Unable to read the select list of quer(ies) {', '.join(unreadable)}, the single scan cannot be split for them")
+
+    t = time.time()
+    rows: DataFrame = volatile_query(get_query(str(scan_path)), split_query(stage_table, limits), pw, primary_index='AWB_NBR',
+                                     starting=start, ending=end, schema=schema_for(scan_path))
+    available: Dict[str, str] = {str(col).lower(): col for col in rows.columns} #the database may report the cols in another case
+
+    results: Dict[str, DataFrame] = dict()
+    for name, query in queries.items():
+        cols: List[str] = columns[name]
+        tag: str = f"IN_{name}".lower()
+        if tag not in available or any(col.lower() not in available for col in cols):
+            raise ValueError(f"'{scan_path}' does not cover query '{name}' (missing its IN_{name} col, or some of its cols)")
+
+        data: DataFrame = rows.loc[rows[available[tag]] == 1, [available[col.lower()] for col in cols]]
+        data.columns = cols #named as the query names them
+        data = data.drop_duplicates() #each query selects DISTINCT rows of its own cols
+        limit, order = limits[name]
+        named: Dict[str, str] = {col.lower(): col for col in cols}
+        order_cols: List[str] = [named[col.strip().lower()] for col in order.split(',') if col.strip().lower() in named]
+        if order_cols:
+            data = data.sort_values(order_cols, kind='stable')
+        if limit is not None:
+            data = data.head(limit) #cut only once deduplicated
+        results[name] = data.reset_index(drop=True)
+        print(f"'{name}': {results[name].shape[0]} rows")
+
+    print(f"Split the single scan ({rows.shape[0]} rows) into {len(results)} sheets in {time.time()-t:.2f} secs")
+    return results
 
 def run_corrections() -> None:
     """
@@ -216,22 +198,15 @@ def run_corrections() -> None:
     start: str = get_month() #getting month to use for queries. For example, if current month is November 2024, will get '2024-10-01' -> Fetches everything for all of last month
     end: str = (datetime.today() - timedelta(days=1)).strftime("'%Y-%m-%d'") #day to use as upper limit of query (day before the queries are ran)
     queries_path = Path(r"main_automation_programs\support-files\queries\FTA") #general path for FTA queries
-    results: Dict[str, DataFrame] = dict() #keep results in this directory; maps a query name to its results
-
-    for query in os.listdir(queries_path): #getting results for each query
-
-        #Get results for current query.
-        name: str = query.split('.')[0]
-        print(f"Querying for '{name}'")
-        results[name] = execute_query(
-                                        query=get_query(str(queries_path/query)), #getting query path for current query
-                                        pw = get_envvar('pw'),
-                                        starting= start,
-                                        ending= end
-                                    )
-        
-        print(f"Query for '{name}' fetched successfully.\n")
-        print(results[name])
+    extraction: str = get_setting('fta_extraction', 'queries').strip().lower()
+    if extraction == 'single_scan':
+        try:
+            results: Dict[str, DataFrame] = run_single_scan(queries_path, start, end) #maps a query name to its results
+        except Exception as e: #the separate queries still work when the single scan does not
+            print(f"Single scan failed, running the FTA queries separately. Exception: {e}")
+            results = run_queries(queries_path, start, end)
+    else:
+        results = run_queries(queries_path, start, end) #maps a query name to its results
 
     #fixing order of cols in results
     for index, dataframe in results.items():
@@ -261,7 +236,7 @@ def run_corrections() -> None:
                 continue
 
             curr_sheet: xw.Sheet = fta_wb.sheets[sheet] #creating new sheet object for current sheet
-            values = results[sheet].values.tolist()
+            values = excel_values(results[sheet]) #typed cols (categories, nullable ints, dates) as plain values
             curr_sheet.range('D2').value =  values #pasting values into sheet
 
         #Running main macro
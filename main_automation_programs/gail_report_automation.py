@@ -2,12 +2,14 @@ from typing import List, Dict
 from tkinter import filedialog
 import pandas as pd
 from pandas import DataFrame
-from tools import get_query, find_OLD, merge_files, sql_able_list, get_password, drop_cols
+from tools import get_query, merge_files, get_password, drop_cols, get_classify, get_misa
 from pathlib import Path
 from datetime import datetime, timedelta
 import numpy as np
-from classify_db import execute_query
-from misa_db import execute_query as misa_query
+from classify_db import execute_query, anti_join_query
+from snapshots import incremental as incremental_extract
+from query_schemas import schema_for
+import query_registry
 import os
 from datetime import datetime
 
@@ -28,11 +30,23 @@ cols_to_keep: List[str] = ['awb_nbr', 'importernme', 'entry_dt', 'billacc', 'cad
 def run(
         ending: str = ((datetime.today().replace(day=1)) - timedelta(days=1)).strftime("'%d-%b-%y'"), #getting last day of last month
         starting: str = (((datetime.today().replace(day=1)) - timedelta(days=1)).replace(day=1)).strftime("'%d-%b-%y'"), #getting first day of last month
-        awb_col: str = 'Tracking Number'
+        awb_col: str = 'Tracking Number',
+        arrow: bool = False,
+        cache_ttl: float = 6*60*60,
+        force_refresh: bool = False,
+        incremental: bool = False,
+        server_diff: bool = False,
+        single_pass: bool = False
     ) -> None:
     """
     The starting date defaults to the first day of last month, and the ending date defaults to the last day of last month, based on the date when you run the program.
     E.g -> If you run this program during May 2025, starting will return '01-Apr-25', and ending returns '30-Apr-25'.
+
+    arrow: fetches the Classify data straight into Arrow (see oracle_pool.read_arrow).
+    cache_ttl, force_refresh: reuses cached Classify/MISA results for cache_ttl secs (0 to disable), unless forced to fetch everything again.
+    incremental: only fetches the Classify shipments modified since the last run (see snapshots.incremental). Party changes are missed, so run once without it before sending the report.
+    server_diff: lets Oracle find the month's shipments missing from the LVS awbs, and only fetches those (see classify_db.anti_join_query).
+    single_pass: uses gail_report_classify_single_pass.sql, which reads Classify's shipment parties once instead of four times.
     """
 
     #Getting lvs vol files to process (Gail's Report lvs files)
@@ -48,19 +62,40 @@ def run(
 
     #Getting classify data
     print("Now fetching Classify data")
-    classify_query: str = get_query(r"main_automation_programs\support-files\queries\gail_report_classify.sql") #reading saved query
-    classify_data: DataFrame = execute_query(classify_query, ending=ending, starting=starting) #adding awbs to query, getting data
-    classify_data = classify_data.drop(find_OLD(classify_data), inplace=False) #dropping OLD awbs
-    classify_data = classify_data.astype({'awb_nbr': np.int64}) #converting awbs to int now that OLD was dropped
+    classify_query_path: str = r"main_automation_programs\support-files\queries\gail_report_classify_single_pass.sql" if single_pass else r"main_automation_programs\support-files\queries\gail_report_classify.sql"
+    classify_query: str = get_query(classify_query_path) #reading saved query
+    classify_schema: Dict[str, str] = schema_for(classify_query_path) #typed while fetched: int awbs (OLD ones empty), categorical codes, parsed dates
+    if server_diff: #difference computed in Classify, only the shipments missing from Gail's Report come back
+        classify_data: DataFrame = anti_join_query(classify_query, lvs_data[awb_col].to_list(), starting=starting, ending=ending,
+                                                   cache_ttl=cache_ttl, force_refresh=force_refresh, schema=classify_schema, numeric_awbs=True)
+    elif incremental:
+        bound_query, params = query_registry.bind(classify_query, 'named', starting=starting, ending=ending) #dates as bind parameters
+        classify_data: DataFrame = incremental_extract('gail_classify', bound_query, params=params,
+                                                       fetch=lambda query, params: execute_query(query, arrow=arrow, schema=classify_schema, params=params, numeric_awbs=True), key_col='awb_nbr', watermark_col='last_modified_tmstp',
+                                                       full_refresh=force_refresh) #only fetching what changed since the last run
+    else:
+        classify_data: DataFrame = execute_query(classify_query, ending=ending, starting=starting, arrow=arrow, cache_ttl=cache_ttl, force_refresh=force_refresh, schema=classify_schema,
+                                                 numeric_awbs=True) #adding awbs to query, getting data
+    classify_data = classify_data.drop(columns=['last_modified_tmstp'], inplace=False) #only needed for the snapshot watermark
+    classify_data = classify_data.dropna(subset=['awb_nbr'], inplace=False) #OLD awbs are filtered out by Classify, only snapshots from older runs may still hold them (as empty awbs)
+    classify_data = classify_data.astype({'awb_nbr': np.int64}) #already integers, only dropping the nullable type
     print("Dropping duplicate awbs from Classify volume")
     classify_data = classify_data.drop_duplicates(subset=['awb_nbr'], inplace= False, ignore_index=True) #dropping dups
     classify_data = classify_data.set_index(keys='awb_nbr', drop=False) #setting awb as index to prepare for awb drop
     print(f"Classify data:\n{classify_data}")
 
     #Finding classify data not in Gail's Report
-    missing_volume: set = set(classify_data['awb_nbr']) - set(lvs_data[awb_col]) #getting all awbs missing from gail's report
-    awbs_to_drop: set = set(classify_data['awb_nbr']) - missing_volume #getting all awbs to drop so that only the missing awbs are kept
-    remaining_classify_data: DataFrame = classify_data.drop(awbs_to_drop, inplace= False)
+    if server_diff: #already done by Classify
+        remaining_classify_data: DataFrame = classify_data
+    else:
+        missing_volume: set = set(classify_data['awb_nbr']) - set(lvs_data[awb_col]) #getting all awbs missing from gail's report
+        awbs_to_drop: set = set(classify_data['awb_nbr']) - missing_volume #getting all awbs to drop so that only the missing awbs are kept
+        remaining_classify_data: DataFrame = classify_data.drop(awbs_to_drop, inplace= False)
+    if incremental and not server_diff and len(remaining_classify_data.index) != 0: #snapshot rows may have gotten a CAD since they were fetched
+        cad_check_path: str = r"main_automation_programs\support-files\queries\gail_report_cad_check.sql"
+        cad_data: DataFrame = get_classify(remaining_classify_data['awb_nbr'].to_list(), get_query(cad_check_path), schema=schema_for(cad_check_path))
+        print(f"Dropping {len(cad_data.index)} shipments that got a CAD since the snapshot was taken")
+        remaining_classify_data = remaining_classify_data.drop(cad_data.index.astype(np.int64).to_list(), inplace=False, errors='ignore')
     #Fixing date col
     remaining_classify_data['entry_dt'] = pd.to_datetime(remaining_classify_data['entry_dt'], format="%Y-%m-%d") #reading date in
     remaining_classify_data['entry_dt'] = remaining_classify_data['entry_dt'].dt.strftime("%d-%b-%Y") #formatting date to '05-May-25' format
@@ -72,10 +107,10 @@ def run(
 
     #Checking movements on remaining shipments
     print("Checking for Canada movements")
-    movements_query: str = get_query(r"main_automation_programs\support-files\queries\CA_Delivery.sql").format(
-        awbs = sql_able_list(remaining_classify_data['awb_nbr'].to_list(), logic='IN', variable='AL1.shp_trk_nbr')
-        ) #formatting query to contain awbs we want to search for
-    movements_data: DataFrame = misa_query(movements_query, pw=get_password(), date_query=False).astype({'shp_trk_nbr': np.int64}) #fetching misa, converting awbs to ints
+    movements_query_path: str = r"main_automation_programs\support-files\queries\CA_Delivery.sql"
+    movements_query: str = get_query(movements_query_path)
+    movements_data: DataFrame = get_misa(remaining_classify_data['awb_nbr'].to_list(), movements_query, variable='AL1.shp_trk_nbr', pw=get_password(),
+                                         cache_ttl=cache_ttl, force_refresh=force_refresh, schema=schema_for(movements_query_path)).astype({'shp_trk_nbr': np.int64}) #fetching misa (awbs joined from a volatile table), converting awbs to ints
     print(f"Canada movements data: \n {movements_data}") #all theses awbs have movement
 
     #Checking CRNs
@@ -83,20 +118,18 @@ def run(
     check_crns: set = set(remaining_classify_data['awb_nbr']) - set(movements_data['shp_trk_nbr']) #getting awbs with no movement, so we can find CRNs for them
     print(f"Checking {len(check_crns)} awbs for CRNs")
     crns_data: DataFrame = DataFrame()
-    crns_query: str = get_query(r"main_automation_programs\support-files\queries\Find_CRN.sql")
+    crns_query_path: str = r"main_automation_programs\support-files\queries\Find_CRN.sql"
+    crns_query: str = get_query(crns_query_path)
     if len(check_crns) != 0: #if there are crns to check for movement (not all shipments had movement)
-        crns_query = crns_query.format(awbs = sql_able_list(list(check_crns), logic='IN', variable='AL1.AWB_NBR'))
-        crns_data = misa_query(crns_query, pw = get_password(), date_query=False)
+        crns_data = get_misa(list(check_crns), crns_query, variable='AL1.AWB_NBR', pw=get_password(), cache_ttl=cache_ttl, force_refresh=force_refresh, schema=schema_for(crns_query_path))
         crns_data = crns_data.drop_duplicates(['TRACKING_NBR'], inplace=False).astype({'TRACKING_NBR': np.int64}) #dropping crn dups
         crns_data = crns_data.set_index('TRACKING_NBR', drop=False, inplace=False) #setting crn tracking as index
         print(f"Whole CRNs data: \n{crns_data}")
     
     #Checking CRNs movement
     if len(crns_data.index) != 0: #looking for movements when crns were found
-        crns_movement_query: str = get_query(r"main_automation_programs\support-files\queries\CA_Delivery.sql").format(
-            awbs = sql_able_list(crns_data['TRACKING_NBR'].to_list(), logic='IN', variable='AL1.shp_trk_nbr')
-        )
-        crns_movement_data: DataFrame = misa_query(crns_movement_query, pw = get_password(), date_query=False).astype({'shp_trk_nbr': np.int64}) #getting crns movements, transforming results to ints
+        crns_movement_data: DataFrame = get_misa(crns_data['TRACKING_NBR'].to_list(), movements_query, variable='AL1.shp_trk_nbr', pw=get_password(),
+                                                 cache_ttl=cache_ttl, force_refresh=force_refresh, schema=schema_for(movements_query_path)).astype({'shp_trk_nbr': np.int64}) #getting crns movements, transforming results to ints
         crns_movement_data = crns_movement_data.drop_duplicates('shp_trk_nbr', inplace=False, ignore_index=True) #dropping dups
         #Now have a list of all CRNs with movement
         print(f"CRNs movement data: \n{crns_movement_data}")
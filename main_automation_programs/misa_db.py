@@ -4,44 +4,150 @@ Used for queying the MISA database from python.
 Please note that you might need to change the credentials below if they ever get updated (you will probably receive an email warning you that the credentials are changing)
 """
 
-import oracledb as odb
 import pandas as pd
-from sqlalchemy import create_engine
 import time
+from typing import Dict, Iterator, List, Tuple
 import sys, os
 sys.path.append(os.getcwd())
 sys.path.append(f"{os.getcwd()}/main_automation_programs")
-import teradatasql
+from teradata_sessions import get_manager
+from query_cache import cached, key_for_values
+import query_metrics
+import query_registry
+import standin_db
+import db_retry
 
-def execute_query(query: str, pw: str, dates: str = '', starting: str = '', ending: str = '', date_query: bool = True):
+cs = 'edwmiscop1.prod.fedex.com'
+lookup_table = 'awb_lookup_vt' #volatile table used for big awb lookups (see lookup_query)
+stage_table = 'stage_vt' #volatile table a shared scan is kept in (see volatile_query)
+
+def format_query(query: str, dates: str = '', starting: str = '', ending: str = '', date_query: bool = True) -> Tuple[str, List[object]]:
+    """
+    Binds the given dates to the query as '?' parameters (see query_registry.bind). Returns the query along with its params.
     """
-    Executes given query in MISA DB.
+    if date_query and starting != '' and ending != '':
+        print(f"Fetching for dates {starting} to {ending}")
+        return query_registry.bind(query, 'qmark', starting = starting, ending = ending)
+    elif date_query:
+        print(f"Fetching for dates {dates}")
+        return query_registry.bind(query, 'qmark', dates = dates)
 
-    Note that you may pass a single date, or a starting and ending, but not both.
+    print(f"Fetching MISA")
+    return query, list()
 
-    Defaults to starting and ending being empty.
+def execute_query(query: str, pw: str, dates: str = '', starting: str = '', ending: str = '', date_query: bool = True,
+                  cache_ttl: float = 0, force_refresh: bool = False, max_sessions: int = 1, schema: Dict[str, str] | None = None,
+                  columns: List[str] | None = None):
+    """
+    Executes given query in MISA DB.\n
+    Note that you may pass a single date, or a starting and ending, but not both.\n
+    Defaults to starting and ending being empty.\n
+    cache_ttl, force_refresh: reuses locally cached results for cache_ttl secs (see query_cache), unless forced to fetch again.\n
+    max_sessions: how many MISA sessions may be open at once, raise it when calling this from several threads.\n
+    schema: column types to build the results with (see query_schemas.schema_for).\n
+    columns: only fetches these columns, in this order (see query_registry.project).
     """
-    #Initializing oracledb
     from tools import get_envvar
-    odb.init_oracle_client(lib_dir=get_envvar('oracle_install_path'))
 
     t = time.time()
     un = get_envvar('misa-username')
-    cs = 'edwmiscop1.prod.fedex.com'
     print(f"Fetching '{cs}' with query '{query[:min(len(query), 200)].replace('\n', ' ')}' (complete query may not be shown)")
 
-    #fetching
-    with teradatasql.connect(host=cs, user=un, password=pw) as connection:
-        engine = create_engine('teradatasql://', creator=lambda: connection) #using sqlalchemy for better compatibility
-        if date_query and starting != '' and ending != '':
-            print(f"Fetching for dates {starting} to {ending}")
-            curr_qry: str = query.format(starting = starting, ending = ending)
-        elif date_query:
-            print(f"Fetching for dates {dates}")
-            curr_qry: str = query.format(dates = dates)
-        else:
-            print(f"Fetching MISA")
-            curr_qry: str = query
-        data = pd.read_sql_query(sql=curr_qry, con=engine)
+    #fetching, reusing the job's open MISA session (only logs in on the first query)
+    curr_qry, params = format_query(query, dates, starting, ending, date_query)
+    if columns:
+        curr_qry = query_registry.project(curr_qry, columns) #only the columns the caller keeps
+    curr_qry = query_registry.limit(curr_qry, 'teradata') #only the rows the query's row_limit keeps, if it has one
+    timings: Dict[str, float] = dict() #filled in by the session manager, see query_metrics
+    def fetch() -> pd.DataFrame:
+        if standin_db.enabled(): #local stand-in, see standin_db
+            return standin_db.read_sql('misa', curr_qry, timings, schema=schema, params=params)
+        return get_manager(cs, un, pw, max_sessions).read_sql(curr_qry, timings=timings, schema=schema, params=params)
+
+    if cache_ttl > 0:
+        data = cached('misa', curr_qry, lambda: db_retry.call('misa', fetch), ttl=cache_ttl, params={'schema': schema, 'binds': params}, force_refresh=force_refresh)
+    else:
+        data = db_retry.call('misa', fetch) #transient errors are retried with a backoff, see db_retry
     print(f"Time taken to run MISA query: {time.time()-t} secs")
-    return data
\ No newline at end of file
+    query_metrics.record('misa', curr_qry, data, timings, time.time()-t)
+    return data
+
+def volatile_query(stage: str, query: str, pw: str, table: str = stage_table, primary_index: str | None = None, dates: str = '', starting: str = '',
+                   ending: str = '', date_query: bool = True, max_sessions: int = 1, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Runs the stage query once into a volatile table, then runs the query (reading from the table) on the same MISA session, e.g for fta_corrections.run_single_scan.\n
+    primary_index: col to distribute the table's rows on (e.g 'AWB_NBR').
+    """
+    from tools import get_envvar
+
+    t = time.time()
+    un = get_envvar('misa-username')
+    print(f"Staging '{cs}' scan into volatile table '{table}' with query '{stage[:min(len(stage), 200)].replace('\n', ' ')}' (complete query may not be shown)")
+
+    curr_stage, params = format_query(stage, dates, starting, ending, date_query)
+    definition: str = stage #dates written in, only used to create the empty table
+    for name, value in {'dates': dates, 'starting': starting, 'ending': ending}.items():
+        if value != '':
+            definition = definition.replace(f"{{{name}}}", value)
+
+    timings: Dict[str, float] = dict() #filled in while fetching, see query_metrics
+    def fetch() -> pd.DataFrame:
+        if standin_db.enabled(): #local stand-in, see standin_db
+            return standin_db.read_with_volatile('misa', query, table, curr_stage, timings, schema=schema, params=params)
+        return get_manager(cs, un, pw, max_sessions).read_with_volatile(query, table, curr_stage, definition, params=params, primary_index=primary_index,
+                                                                        timings=timings, schema=schema)
+
+    data = db_retry.call('misa', fetch) #transient errors are retried with a backoff, see db_retry
+    print(f"Time taken to run staged MISA query: {time.time()-t} secs")
+    query_metrics.record('misa', curr_stage, data, timings, time.time()-t)
+    return data
+
+def iter_query(query: str, pw: str, batch_rows: int = 50000, dates: str = '', starting: str = '', ending: str = '', date_query: bool = True,
+               schema: Dict[str, str] | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Streaming version of execute_query: yields the results in dataframes of at most batch_rows rows, as they arrive from MISA.
+    """
+    from tools import get_envvar
+
+    t = time.time()
+    un = get_envvar('misa-username')
+    print(f"Streaming '{cs}' in batches of {batch_rows} rows with query '{query[:min(len(query), 200)].replace('\n', ' ')}' (complete query may not be shown)")
+
+    curr_qry, params = format_query(query, dates, starting, ending, date_query)
+    curr_qry = query_registry.limit(curr_qry, 'teradata')
+    rows: int = 0
+    if standin_db.enabled():
+        batches = standin_db.iter_batches('misa', curr_qry, batch_rows=batch_rows, schema=schema, params=params)
+    else:
+        batches = get_manager(cs, un, pw).iter_batches(curr_qry, batch_rows=batch_rows, schema=schema, params=params)
+    for batch in batches:
+        rows += batch.shape[0]
+        yield batch
+    print(f"Time taken to stream MISA query: {time.time()-t} secs ({rows} rows)")
+
+def lookup_query(query: str, awbs: list, pw: str, variable: str = 'AL1.shp_trk_nbr', placeholder: str = 'awbs',
+                 cache_ttl: float = 0, force_refresh: bool = False, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Runs a lookup query for the given awbs through a volatile table, instead of pasting them in as IN lists.\n
+    variable: name of the awb column to filter on, its placeholder (e.g '{awbs}') becomes 'IN (SELECT val FROM awb_lookup_vt)'.
+    """
+    from tools import get_envvar
+
+    t = time.time()
+    un = get_envvar('misa-username')
+    curr_qry: str = query.format(**{placeholder: f"{variable} IN (SELECT val FROM {lookup_table})"})
+    print(f"Looking up {len(awbs)} awbs in '{cs}' through volatile table '{lookup_table}'")
+
+    timings: Dict[str, float] = dict() #filled in while fetching, see query_metrics
+    def fetch() -> pd.DataFrame:
+        if standin_db.enabled(): #local stand-in, see standin_db
+            return standin_db.read_with_lookup('misa', curr_qry, awbs, lookup_table, timings, schema=schema)
+        return get_manager(cs, un, pw).read_with_lookup(curr_qry, awbs, lookup_table, timings=timings, schema=schema)
+
+    if cache_ttl > 0:
+        data = cached('misa', curr_qry, lambda: db_retry.call('misa', fetch), ttl=cache_ttl, params={'awbs': key_for_values(awbs), 'schema': schema}, force_refresh=force_refresh)
+    else:
+        data = db_retry.call('misa', fetch)
+    print(f"Time taken to run MISA lookup: {time.time()-t} secs")
+    query_metrics.record('misa', curr_qry, data, timings, time.time()-t, lookup=len(awbs))
+    return data
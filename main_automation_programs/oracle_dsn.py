@@ -0,0 +1,149 @@
+"""
+Resolves LDAP connect strings (e.g Classify's) into Oracle connect descriptors with ldap3, and keeps them cached locally for 'oracle_dsn_ttl' secs (.env variable, defaults to a week).
+New connections skip the directory lookup, and cached descriptors let python-oracledb connect in thin mode (see oracle_pool). An expired descriptor is still used if the directory can't be reached.
+
+To see (and refresh) the descriptor of a connect string, run:
+python main_automation_programs/oracle_dsn.py ldap://eusoud.prod.fedex.com/CLASFY_PRD_01_CLASSIFY_S1
+"""
+
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import urlparse
+import threading
+import json
+import time
+import re
+
+_lock = threading.Lock()
+_resolved: Dict[str, str] = dict() #maps a connect string to its descriptor, once resolved in this process
+
+def cache_path() -> Path:
+    """
+    Returns the file the resolved descriptors are kept in.
+    """
+    from tools import get_setting
+
+    return Path(get_setting('oracle_dsn_cache', str(Path('main_automation_programs')/'support-files'/'cache'/'oracle_dsn.json')))
+
+def ttl() -> float:
+    """
+    Returns for how many secs a resolved descriptor is reused before it is looked up again ('oracle_dsn_ttl' .env variable, defaults to a week).
+    """
+    from tools import get_setting
+
+    return get_setting('oracle_dsn_ttl', 7*24*3600.0)
+
+def is_ldap(dsn: str) -> bool:
+    """
+    Checks if the given connect string is an LDAP one (e.g 'ldap://host/SERVICE').
+    """
+    return dsn.lower().startswith(('ldap://', 'ldaps://'))
+
+def _read_cache() -> Dict[str, Dict[str, object]]:
+    """
+    Returns the cached descriptors, mapping each connect string to its descriptor and when it was resolved. Empty if there is no (readable) cache yet.
+    """
+    try:
+        with open(cache_path(), 'r') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return dict()
+
+def _write_cache(cache: Dict[str, Dict[str, object]]) -> None:
+    """
+    Saves the given descriptors to the cache file.
+    """
+    path = cache_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as cache_file:
+        json.dump(cache, cache_file, indent=1)
+
+    return None
+
+def lookup(dsn: str, timeout: float = 10) -> str:
+    """
+    Asks the directory server of the given LDAP connect string for its connect descriptor (net service name or full dn after the host).
+    Raises a LookupError if no descriptor is found.
+    """
+    import ldap3 #only needed to resolve descriptors, cached ones do not need it
+
+    url = urlparse(dsn)
+    name: str = url.path.strip('/')
+    server = ldap3.Server(url.hostname, port=url.port, use_ssl=url.scheme.lower() == 'ldaps', get_info=ldap3.DSA, connect_timeout=timeout)
+    attributes: List[str] = ['orclNetDescString', 'aliasedObjectName']
+
+    with ldap3.Connection(server, auto_bind=True, receive_timeout=timeout) as connection:
+        for _ in range(5): #following at most a few aliases
+            if '=' in name: #full dn of the entry
+                connection.search(name, '(objectClass=*)', search_scope=ldap3.BASE, attributes=attributes)
+            else: #net service name, searching every naming context (the client's default admin context is one of them)
+                contexts = list(server.info.naming_contexts or []) if server.info else []
+                for context in contexts or ['']:
+                    connection.search(context, f"(&(cn={ldap3.utils.conv.escape_filter_chars(name)})(|(objectClass=orclNetService)(objectClass=orclNetServiceAlias)))",
+                                      search_scope=ldap3.SUBTREE, attributes=attributes)
+                    if connection.entries:
+                        break
+            if not connection.entries:
+                break
+
+            entry = connection.entries[0].entry_attributes_as_dict
+            if entry.get('orclNetDescString'):
+                descriptor = entry['orclNetDescString'][0]
+                return descriptor.decode() if isinstance(descriptor, bytes) else str(descriptor)
+            if not entry.get('aliasedObjectName'):
+                break
+            name = str(entry['aliasedObjectName'][0])
+
+    raise LookupError(f"No connect descriptor found for '{dsn}' on '{url.hostname}'")
+
+def resolve(dsn: str, force_refresh: bool = False) -> str:
+    """
+    Returns the connect descriptor for the given connect string, from the cache when it is fresh enough. Non LDAP connect strings are returned as they are.\n
+    force_refresh: looks the descriptor up again even if the cached one is still fresh.
+    """
+    if not is_ldap(dsn):
+        return dsn
+
+    with _lock:
+        if dsn in _resolved and not force_refresh:
+            return _resolved[dsn]
+
+        cache = _read_cache()
+        cached = cache.get(dsn, dict())
+        if cached and not force_refresh and time.time() - float(cached.get('resolved', 0)) < ttl():
+            _resolved[dsn] = str(cached['descriptor'])
+            return _resolved[dsn]
+
+        t = time.time()
+        try:
+            descriptor = lookup(dsn)
+        except Exception as e:
+            if not cached:
+                raise
+            print(f"Unable to look '{dsn}' up, using the descriptor cached on {time.ctime(float(cached.get('resolved', 0)))}. Exception: {e}")
+            _resolved[dsn] = str(cached['descriptor'])
+            return _resolved[dsn]
+
+        print(f"Resolved '{dsn}' in {time.time()-t} secs")
+        cache[dsn] = {'descriptor': re.sub(r"\s+", ' ', descriptor).strip(), 'resolved': time.time()}
+        _write_cache(cache)
+        _resolved[dsn] = str(cache[dsn]['descriptor'])
+
+    return _resolved[dsn]
+
+def clear() -> None:
+    """
+    Forgets every cached descriptor, so they are looked up again on next use.
+    """
+    with _lock:
+        _resolved.clear()
+        cache_path().unlink(missing_ok=True)
+
+    return None
+
+if __name__ == "__main__":
+    import sys, os
+    sys.path.append(os.getcwd())
+    sys.path.append(f"{os.getcwd()}/main_automation_programs")
+    for connect_string in sys.argv[1:]:
+        print(f"{connect_string}: {resolve(connect_string, force_refresh=True)}")
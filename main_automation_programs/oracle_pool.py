@@ -0,0 +1,333 @@
+"""
+Shared Oracle connection pools, used by the Oracle query modules (classify_db, wfm_db and OIC_Tool/custom_classify_db).
+
+The oracle client is initialized once per process ('oracle_mode' .env variable picks 'thick' or 'thin'), and one pool is kept per database so queries reuse warm sessions.
+Pool sizes and the statement cache can be changed in your .env file (see README).
+"""
+
+import oracledb as odb
+import pandas as pd
+from sqlalchemy import create_engine, event, Engine
+from sqlalchemy.pool import NullPool
+from typing import Dict, Iterator, List
+import threading
+import time
+import re
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+import query_schemas
+import fetch_tuning
+from query_metrics import add_time
+import oracle_dsn
+
+_client_initialized: bool = False
+_pools: Dict[str, odb.ConnectionPool] = dict() #maps a database name ('classify', 'wfm', etc.) to its pool
+_engines: Dict[str, Engine] = dict() #maps a database name to the sqlalchemy engine built on top of its pool
+_described: Dict[tuple, List[str]] = dict() #maps a (database name, query) pair to the query's column names, see describe
+_lock = threading.Lock()
+
+def oracle_mode() -> str:
+    """
+    Returns how python-oracledb should connect, 'thick' or 'thin' (see module docstring).
+    """
+    from tools import get_envvar
+
+    try:
+        mode: str = get_envvar('oracle_mode').strip().lower()
+    except KeyError:
+        try:
+            get_envvar('oracle_install_path')
+        except KeyError:
+            return 'thin'
+        return 'thick'
+
+    if mode not in ('thick', 'thin'):
+        raise ValueError(f"'oracle_mode' should be 'thick' or 'thin', got '{mode}'")
+    return mode
+
+def init_client() -> None:
+    """
+    Initializes the oracle client (thick mode), needed to run the queries. Nothing to initialize in thin mode.
+    Only does so the first time it is called; any later calls do nothing.
+    """
+    global _client_initialized
+
+    with _lock:
+        if _client_initialized:
+            return None
+
+        if oracle_mode() == 'thin':
+            _client_initialized = True
+            print("Using python-oracledb thin mode, no Oracle client needed")
+            return None
+
+        from tools import get_envvar
+        t = time.time()
+        odb.init_oracle_client(lib_dir=get_envvar('oracle_install_path'))
+        _client_initialized = True
+        print(f"Oracle client initialized in {time.time()-t} secs")
+
+    return None
+
+def resolve_dsn(dsn: str) -> str:
+    """
+    Returns the connect descriptor to use for the given connect string: LDAP ones are resolved through the local cache (see oracle_dsn).
+    In thick mode, the LDAP connect string is kept when it cannot be resolved, and the client looks it up itself; thin mode cannot do without it.
+    """
+    if not oracle_dsn.is_ldap(dsn):
+        return dsn
+
+    try:
+        return oracle_dsn.resolve(dsn)
+    except Exception as e:
+        if oracle_mode() == 'thin':
+            raise RuntimeError(f"Unable to resolve '{dsn}', thin mode needs its connect descriptor (install ldap3, or set oracle_mode = 'thick'). Exception: {e}") from e
+        print(f"Unable to resolve '{dsn}', letting the Oracle client look it up. Exception: {e}")
+        return dsn
+
+def get_pool(name: str, user: str, password: str, min_size: int | None = None, max_size: int | None = None, **connect_args) -> odb.ConnectionPool:
+    """
+    Returns the connection pool for the given database name, creating it on first use.\n
+    name: key to keep the pool under (e.g 'classify'), modules querying the same database should use the same name.\n
+    min_size, max_size: sessions to keep open, defaults to the 'oracle_pool_min' and 'oracle_pool_max' .env variables.\n
+    connect_args: any other arguments for the connection (e.g dsn). LDAP dsns are resolved first (see oracle_dsn).
+    """
+    from tools import get_setting
+
+    init_client()
+
+    with _lock:
+        if name not in _pools and 'dsn' in connect_args:
+            connect_args = {**connect_args, 'dsn': resolve_dsn(connect_args['dsn'])}
+        if name not in _pools:
+            min_size = get_setting('oracle_pool_min', 1) if min_size is None else min_size
+            max_size = get_setting('oracle_pool_max', 4) if max_size is None else max_size
+            t = time.time()
+            _pools[name] = odb.create_pool(user=user, password=password,
+                                          min=min_size, max=max(min_size, max_size), increment=1,
+                                          ping_interval=get_setting('oracle_pool_ping', 60),
+                                          stmtcachesize=get_setting('oracle_stmt_cache', 50),
+                                          getmode=odb.POOL_GETMODE_WAIT,
+                                          **connect_args)
+            print(f"Created '{name}' pool with {min_size} to {max(min_size, max_size)} sessions in {time.time()-t} secs")
+
+    return _pools[name]
+
+def get_engine(name: str, user: str, password: str, **pool_args) -> Engine:
+    """
+    Returns a sqlalchemy engine that borrows its connections from the given database's pool (same arguments as get_pool).
+    """
+    pool = get_pool(name, user, password, **pool_args)
+
+    with _lock:
+        if name not in _engines:
+            #NullPool so that sqlalchemy does not keep its own pool on top of the oracle pool
+            _engines[name] = create_engine('oracle+oracledb://', creator=pool.acquire, poolclass=NullPool) #using sqlalchemy for better compatibility
+            event.listen(_engines[name], 'before_cursor_execute', tune_cursor)
+            event.listen(_engines[name], 'after_cursor_execute', tune_cursor)
+
+    return _engines[name]
+
+def tune_cursor(conn, cursor, statement: str, parameters, context, executemany: bool) -> None:
+    """
+    Sets the fetch sizes of the given sqlalchemy cursor before and after its query is executed (see fetch_tuning.apply).
+    """
+    if executemany:
+        return None
+    try:
+        fetch_tuning.apply(cursor, statement, executed=cursor.description is not None)
+    except Exception as e: #tuning is best effort, the query runs with default sizes
+        print(f"Unable to tune fetch sizes, using defaults. Exception: {e}")
+
+    return None
+
+def read_arrow(name: str, query: str, user: str, password: str, casts: Dict[str, str] = {}, timings: Dict[str, float] | None = None,
+               schema: Dict[str, str] | None = None, params: Dict[str, object] | None = None, **pool_args) -> pd.DataFrame:
+    """
+    Runs the given query on the given database's pool, fetching the results straight into Arrow instead of python objects, and returns an Arrow-backed dataframe.\n
+    casts: maps a column name to the arrow type to cast it to (e.g {'awb_nbr': 'int64'}), columns that can't be cast are left as they are.\n
+    timings, schema, params: see query_metrics.read_timed.
+    """
+    import pyarrow as pa #only needed for this fetch path
+    import pyarrow.compute as pc
+
+    timings = dict() if timings is None else timings
+    pool = get_pool(name, user, password, **pool_args)
+    t = time.time()
+    with pool.acquire() as connection:
+        t = add_time(timings, 'connect', t)
+        table: pa.Table = pa.table(connection.fetch_df_all(statement=query, parameters=params, arraysize=fetch_tuning.tune(query)['arraysize']))
+        add_time(timings, 'fetch', t)
+
+    t = time.time()
+
+    table = table.rename_columns([col.lower() if col.isupper() else col for col in table.column_names])
+
+    for col, arrow_type in casts.items():
+        if col not in table.column_names:
+            continue
+        try:
+            table = table.set_column(table.column_names.index(col), col, pc.cast(table[col], arrow_type))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            print(f"Failed to convert '{col}' col to {arrow_type}, returning default fetch for it. Exception: {e}")
+        else:
+            print(f"Successfully converted '{col}' col to {arrow_type}")
+
+    data = query_schemas.build_arrow(table, schema)
+    add_time(timings, 'build', t)
+    return data
+
+def iter_batches(name: str, query: str, user: str, password: str, batch_rows: int = 50000, schema: Dict[str, str] | None = None,
+                 params: Dict[str, object] | None = None, **pool_args) -> Iterator[pd.DataFrame]:
+    """
+    Runs the given query on the given database's pool and yields its results as dataframes of at most batch_rows rows, one batch in memory at a time.\n
+    schema, params: see query_metrics.read_timed.
+    """
+    pool = get_pool(name, user, password, **pool_args)
+    with pool.acquire() as connection:
+        cursor = connection.cursor()
+        cursor.arraysize = batch_rows #fetching each batch in a single round trip
+        cursor.execute(query, params or {})
+        cols = column_names(cursor)
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            yield query_schemas.build(rows, cols, schema)
+        cursor.close()
+
+    return None
+
+def column_names(cursor: odb.Cursor) -> List[str]:
+    """
+    Returns the names of the columns of the cursor's last query, lowercased the same way sqlalchemy does it (only when fully uppercase).
+    """
+    return [col[0].lower() if col[0].isupper() else col[0] for col in cursor.description]
+
+def describe(name: str, query: str, user: str, password: str, params: Dict[str, object] | None = None, **pool_args) -> List[str]:
+    """
+    Returns the names of the given query's columns, as the database returns them (e.g 'AWB_NBR'), without fetching any rows.
+    """
+    with _lock:
+        if (name, query) in _described:
+            return _described[(name, query)]
+
+    pool = get_pool(name, user, password, **pool_args)
+    with pool.acquire() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT * FROM (\n{query}\n) WHERE 1 = 0", params or {})
+            cols = [col[0] for col in cursor.description]
+
+    with _lock:
+        _described[(name, query)] = cols
+    return cols
+
+def numeric_awb_query(query: str, cols: List[str], variable: str = 'awb_nbr') -> str:
+    """
+    Wraps the given query so only rows with all digit awbs come back, with the awb cast to NUMBER(18) by the database.\n
+    cols: the query's columns (see describe).\n
+    variable: name of the awb column, raises a ValueError if the query has no such column.
+    """
+    matches = [col for col in cols if col.lower() == variable.lower()]
+    if not matches:
+        raise ValueError(f"The query has no '{variable}' column to normalize, its columns are {cols}")
+
+    select = ', '.join(f'CAST(q."{col}" AS NUMBER(18) DEFAULT NULL ON CONVERSION ERROR) AS "{col}"' if col == matches[0] else f'q."{col}"' for col in cols) #Oracle may cast before filtering
+    return f"""SELECT {select} FROM (\n{query}\n) q WHERE REGEXP_LIKE(q."{matches[0]}" || '', '^[0-9]+$')"""
+
+class LookupTableMissing(RuntimeError):
+    """
+    Raised when the lookup global temporary table does not exist (or cannot be read). It is created once by a DBA, see README.
+    """
+
+def check_lookup_table(cursor: odb.Cursor, table: str) -> None:
+    """
+    Raises a LookupTableMissing error if the given global temporary table does not exist or cannot be read. No DDL is run here, the app's account cannot create tables.
+    It is a query error for db_retry: not retried, and not counted by Classify's circuit breaker, so callers can fall back to IN lists.
+    """
+    try:
+        cursor.execute(f"SELECT 1 FROM {table} WHERE 1=0")
+    except odb.DatabaseError as e:
+        if not re.search(r"ORA-(?:00942|01031)\b", str(e)): #e.g a dropped session, left to db_retry
+            raise
+        raise LookupTableMissing(f"Lookup table '{table}' is missing or cannot be read, ask a DBA to create it (see README)") from e
+
+    return None
+
+def read_with_lookup(name: str, query: str, values: list, table: str, user: str, password: str, batch_rows: int = 50000,
+                     schema: Dict[str, str] | None = None, params: Dict[str, object] | None = None, timings: Dict[str, float] | None = None,
+                     **pool_args) -> pd.DataFrame:
+    """
+    Loads the given values into the given global temporary table (see check_lookup_table), then runs the query on the same session.\n
+    The query should filter on the table instead of literal IN lists, e.g 'WHERE AWB_NBR IN (SELECT val FROM {table})'.\n
+    schema, params, timings: see query_metrics.read_timed.
+    """
+    timings = dict() if timings is None else timings
+    pool = get_pool(name, user, password, **pool_args)
+    t = time.time()
+    with pool.acquire() as connection:
+        add_time(timings, 'connect', t)
+        cursor = connection.cursor()
+        check_lookup_table(cursor, table)
+        cursor.execute(f"DELETE FROM {table}") #only clears this session's rows
+
+        t = time.time()
+        rows = [(str(val),) for val in values]
+        for i in range(0, len(rows), batch_rows):
+            cursor.executemany(f"INSERT INTO {table} (val) VALUES (:1)", rows[i:i+batch_rows])
+        print(f"Loaded {len(rows)} values into '{table}' in {time.time()-t} secs")
+
+        try:
+            fetch_tuning.apply(cursor, query)
+            cursor.execute(query, params or {})
+            fetch_tuning.apply(cursor, query, executed=True)
+            t = add_time(timings, 'execute', t)
+            fetched = cursor.fetchall()
+            t = add_time(timings, 'fetch', t)
+            data = query_schemas.build(fetched, column_names(cursor), schema)
+            add_time(timings, 'build', t)
+        finally:
+            cursor.execute(f"DELETE FROM {table}")
+            connection.commit()
+            cursor.close()
+
+    return data
+
+def health_check(name: str) -> bool:
+    """
+    Checks that the pool for the given database can hand out a live session.
+
+    Returns True if a session could be acquired and pinged, False otherwise (or if the pool was never created).
+    """
+    if name not in _pools:
+        print(f"No pool has been created for '{name}'")
+        return False
+
+    pool = _pools[name]
+    try:
+        with pool.acquire() as connection:
+            connection.ping()
+            print(f"'{name}' pool is healthy. Db version: {connection.version}, open sessions: {pool.opened}, busy sessions: {pool.busy}")
+    except odb.Error as e:
+        print(f"'{name}' pool failed its health check. Exception: {e}")
+        return False
+
+    return True
+
+def close_pools() -> None:
+    """
+    Closes all open pools (and their sessions). Pools are created again on next use.
+    """
+    with _lock:
+        for name, pool in _pools.items():
+            try:
+                pool.close(force=True)
+            except odb.Error as e:
+                print(f"Unable to close '{name}' pool cleanly. Exception: {e}")
+        _pools.clear()
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+    return None
@@ -0,0 +1,156 @@
+"""
+Local cache for database query results, kept as Parquet files.
+
+Results are keyed by the target database, the final SQL text and any other parameters, so re-running a report reuses them instead of going back to the database.
+Each query has its own time to live, and the cache is capped in size ('query_cache_max_mb' .env variable, least recently used results go first).
+"""
+
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict
+import hashlib
+import threading
+import json
+import time
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+from standin_db import backend
+
+_lock = threading.Lock()
+
+def cache_dir() -> Path:
+    """
+    Returns the folder the cache is kept in, creating it if needed.
+    """
+    from tools import get_setting
+
+    path = Path(get_setting('query_cache_path', str(Path('main_automation_programs')/'support-files'/'cache')))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def cache_key(database: str, query: str, params: Dict[str, object] = {}) -> str:
+    """
+    Returns the key for the given query: a hash of the target database, the final SQL text and the given parameters.
+    Stand-in results (see standin_db) get their own keys, so they are never served to a production run.
+    """
+    content: str = json.dumps({'database': database, 'query': query, 'params': params, **({'backend': 'standin'} if backend() == 'standin' else {})},
+                              sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def key_for_values(values: list) -> str:
+    """
+    Returns a short stand-in for the given values (e.g looked up awbs) in a cache key: a hash of their distinct values, regardless of order.
+    """
+    return hashlib.sha256(','.join(str(value) for value in sorted(set(values), key=str)).encode('utf-8')).hexdigest()
+
+def _read_index(path: Path) -> Dict[str, Dict[str, object]]:
+    """
+    Reads the cache index (maps a key to its entry's info). Returns an empty index if missing or unreadable.
+    """
+    try:
+        with open(path/'index.json', 'r') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return dict()
+
+def _write_index(path: Path, index: Dict[str, Dict[str, object]]) -> None:
+    """
+    Saves the cache index.
+    """
+    with open(path/'index.json', 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+
+    return None
+
+def _evict(path: Path, index: Dict[str, Dict[str, object]]) -> None:
+    """
+    Removes expired entries, then the least recently used ones until the cache fits in its size cap.
+    """
+    from tools import get_setting
+
+    now: float = time.time()
+    max_bytes: float = get_setting('query_cache_max_mb', 2048.0)*1024*1024
+
+    for key in [key for key, entry in index.items() if now - entry['created'] > entry['ttl']]: #expired
+        (path/f'{key}.parquet').unlink(missing_ok=True)
+        del index[key]
+
+    total: int = sum(entry['size'] for entry in index.values())
+    for key in sorted(index, key=lambda key: index[key]['last_used']): #least recently used first
+        if total <= max_bytes:
+            break
+        print(f"Evicting cached results for '{index[key]['database']}' query ({index[key]['size']} bytes)")
+        (path/f'{key}.parquet').unlink(missing_ok=True)
+        total -= index[key]['size']
+        del index[key]
+
+    return None
+
+def cached(database: str, query: str, fetch: Callable[[], pd.DataFrame], ttl: float, params: Dict[str, object] = {},
+           force_refresh: bool = False, arrow: bool = False) -> pd.DataFrame:
+    """
+    Returns the cached results for the given query if they are younger than ttl secs, otherwise calls fetch() and caches its results.\n
+    database: name of the target database (e.g 'classify'), part of the key.\n
+    params: any other values that change the results, part of the key.\n
+    force_refresh: ignores any cached results.\n
+    arrow: reads cached results back as Arrow-backed columns.
+    """
+    path = cache_dir()
+    key: str = cache_key(database, query, params)
+    file_path: Path = path/f'{key}.parquet'
+
+    with _lock:
+        index = _read_index(path)
+        entry = index.get(key)
+        fresh: bool = entry is not None and time.time() - entry['created'] <= ttl and file_path.exists()
+
+    if fresh and not force_refresh:
+        try:
+            data = pd.read_parquet(file_path, dtype_backend='pyarrow') if arrow else pd.read_parquet(file_path)
+        except Exception as e:
+            print(f"Unable to read cached results, fetching again. Exception: {e}")
+        else:
+            print(f"Using cached '{database}' results from {time.ctime(entry['created'])} ({data.shape[0]} rows)")
+            with _lock:
+                index = _read_index(path)
+                if key in index:
+                    index[key]['last_used'] = time.time()
+                    _write_index(path, index)
+            return data
+
+    data = fetch()
+
+    try:
+        data.to_parquet(file_path, compression='zstd')
+    except Exception as e: #caching is best effort, never fail the query because of it
+        print(f"Unable to cache '{database}' results. Exception: {e}")
+        return data
+
+    with _lock:
+        index = _read_index(path)
+        now: float = time.time()
+        index[key] = {
+            'database': database,
+            'query': query[:200],
+            'created': now,
+            'last_used': now,
+            'ttl': ttl,
+            'size': file_path.stat().st_size
+        }
+        _evict(path, index)
+        _write_index(path, index)
+
+    return data
+
+def clear() -> None:
+    """
+    Removes every cached result.
+    """
+    path = cache_dir()
+    with _lock:
+        for file in path.glob('*.parquet'):
+            file.unlink()
+        _write_index(path, dict())
+
+    return None
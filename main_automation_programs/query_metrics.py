@@ -0,0 +1,170 @@
+"""
+Per-query performance metrics for the database modules (classify_db, misa_db and wfm_db).
+
+Every query appends a record (time spent connecting, executing, fetching and building the dataframe, rows, size) to a JSON-lines log ('query_metrics_path' .env variable).
+To see the slowest queries, run: python main_automation_programs/query_metrics.py --top 10 --days 30
+"""
+
+import pandas as pd
+from sqlalchemy import Engine
+from pathlib import Path
+from typing import Dict, List, Sequence
+import argparse
+import hashlib
+import threading
+import json
+import time
+import re
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+from standin_db import backend
+import query_schemas
+
+_lock = threading.Lock()
+phases: List[str] = ['connect', 'execute', 'fetch', 'build']
+
+def metrics_path() -> Path:
+    """
+    Returns the path of the metrics log, creating its folder if needed.
+    """
+    from tools import get_setting
+
+    path = Path(get_setting('query_metrics_path', str(Path('main_automation_programs')/'support-files'/'metrics'/'queries.jsonl')))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+def fingerprint(query: str) -> str:
+    """
+    Returns a short hash identifying the given query regardless of its literals (dates, awbs, IN lists, etc.) and whitespace.
+    """
+    normalized: str = re.sub(r"--[^\n]*", ' ', query) #comments
+    normalized = re.sub(r"'(?:[^']|'')*'", '?', normalized) #string literals
+    normalized = re.sub(r"\b\d+(?:\.\d+)?\b", '?', normalized) #numbers
+    normalized = re.sub(r"\?(?:\s*,\s*\?)+", '?', normalized) #IN lists
+    normalized = re.sub(r"\s+", ' ', normalized).strip().lower()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+def calling_job() -> str:
+    """
+    Returns the name of the job (program) running the queries, e.g 'gail_report_automation'.
+    """
+    return Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else 'interactive'
+
+def add_time(timings: Dict[str, float], phase: str, t: float) -> float:
+    """
+    Adds the time since t to the given phase in timings, and returns the current time (to time the next phase from).
+    """
+    now: float = time.time()
+    timings[phase] = timings.get(phase, 0) + now-t
+    return now
+
+def read_timed(engine: Engine, query: str, timings: Dict[str, float] | None = None, schema: Dict[str, str] | None = None,
+               params: Dict[str, object] | Sequence[object] | None = None) -> pd.DataFrame:
+    """
+    Runs the given query through the given engine and returns its results, as pd.read_sql would.\n
+    timings: the time spent connecting, executing, fetching and building the dataframe is added to it (keys 'connect', 'execute', 'fetch' and 'build').\n
+    schema: column types to build the dataframe with (see query_schemas).\n
+    params: bind parameters for the query (see query_registry.bind).
+    """
+    timings = dict() if timings is None else timings
+
+    t = time.time()
+    with engine.connect() as connection:
+        t = add_time(timings, 'connect', t)
+        result = connection.exec_driver_sql(query, tuple(params) if isinstance(params, list) else params) if params else connection.exec_driver_sql(query)
+        t = add_time(timings, 'execute', t)
+        rows = result.fetchall()
+        cols = list(result.keys())
+        add_time(timings, 'fetch', t)
+
+    t = time.time()
+    data = query_schemas.build(rows, cols, schema)
+    add_time(timings, 'build', t)
+    return data
+
+def record(database: str, query: str, data: pd.DataFrame, timings: Dict[str, float], total: float, **extra) -> None:
+    """
+    Appends a metrics record for the given query and results to the metrics log. Cached results (no timings) are recorded as cached.\n
+    extra: any other values to keep in the record (e.g arrow=True).
+    """
+    entry: Dict[str, object] = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'database': database,
+        'backend': backend(), #stand-in timings are kept apart from production ones
+        'job': calling_job(),
+        'fingerprint': fingerprint(query),
+        'query': re.sub(r"\s+", ' ', query[:200]).strip(),
+        'rows': int(data.shape[0]),
+        'bytes': int(data.memory_usage(index=True, deep=False).sum()), #shallow: deep=True walks every string cell
+        **{phase: round(timings.get(phase, 0), 4) for phase in phases},
+        'total': round(total, 4),
+        'cached': len(timings) == 0,
+        **extra
+    }
+
+    try:
+        with _lock:
+            with open(metrics_path(), 'a') as log:
+                log.write(json.dumps(entry, default=str) + '\n')
+    except Exception as e:
+        print(f"Unable to record query metrics. Exception: {e}")
+
+    return None
+
+def load(days: float | None = None) -> pd.DataFrame:
+    """
+    Reads the metrics log into a dataframe, keeping only the last given days when days is given.
+    """
+    path = metrics_path()
+    if not path.exists() or path.stat().st_size == 0:
+        return pd.DataFrame()
+
+    metrics = pd.read_json(path, lines=True, convert_dates=['ts'])
+    if days is not None:
+        metrics = metrics[metrics['ts'] >= pd.Timestamp.now() - pd.Timedelta(days=days)]
+    return metrics
+
+def summary(top: int = 10, days: float | None = None, job: str | None = None) -> pd.DataFrame:
+    """
+    Prints and returns the slowest queries (by average total time), one row per fingerprint, with the time of their last runs and their trend.
+    """
+    metrics = load(days)
+    if job is not None and not metrics.empty:
+        metrics = metrics[metrics['job'] == job]
+    metrics = metrics[~metrics['cached']] if not metrics.empty else metrics
+    if 'backend' in metrics.columns:
+        metrics = metrics[metrics['backend'].fillna('production') == backend()] #only comparing runs against the same backend
+    if metrics.empty:
+        print("No query metrics recorded yet")
+        return metrics
+
+    rows: List[Dict[str, object]] = list()
+    for query_fingerprint, runs in metrics.sort_values('ts').groupby('fingerprint'):
+        previous = runs['total'].iloc[:-1]
+        rows.append({
+            'fingerprint': query_fingerprint,
+            'database': runs['database'].iloc[-1],
+            'job': runs['job'].iloc[-1],
+            'runs': len(runs),
+            **{phase: runs[phase].mean() for phase in phases},
+            'avg_total': runs['total'].mean(),
+            'max_total': runs['total'].max(),
+            'avg_rows': int(runs['rows'].mean()),
+            'recent': ' '.join(f"{total:.1f}" for total in runs['total'].iloc[-5:]),
+            'trend': f"{(runs['total'].iloc[-1]/previous.mean() - 1)*100:+.0f}%" if len(previous) and previous.mean() > 0 else '',
+            'query': runs['query'].iloc[-1][:80]
+        })
+
+    slowest = pd.DataFrame(rows).sort_values('avg_total', ascending=False).head(top).reset_index(drop=True)
+    with pd.option_context('display.max_columns', None, 'display.width', 250, 'display.float_format', '{:.2f}'.format):
+        print(f"Slowest queries ({metrics.shape[0]} runs since {metrics['ts'].min()}):\n{slowest}")
+    return slowest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows the slowest recorded queries and their trend over time.")
+    parser.add_argument('--top', type=int, default=10, help="how many queries to show")
+    parser.add_argument('--days', type=float, default=None, help="only look at the last given days")
+    parser.add_argument('--job', type=str, default=None, help="only look at queries ran by the given job (e.g gail_report_automation)")
+    args = parser.parse_args()
+    summary(args.top, args.days, args.job)
@@ -0,0 +1,252 @@
+"""
+Captures the EXPLAIN plans of the saved queries (support-files/queries), with sample values, and flags plan regressions.
+
+A plan is flagged when it has new full table scans, more product joins, or a cost over 'plan_cost_jump' percent (.env variable) above the last stored plan.
+Regressed plans are not stored unless accepted, so they keep being flagged. To check every saved query, run:
+python main_automation_programs/query_plans.py [--accept]
+"""
+
+from pathlib import Path
+from datetime import date, timedelta
+from typing import Dict, List
+import argparse
+import json
+import time
+import re
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+import query_registry
+import query_metrics
+import standin_db
+
+#Database each saved query runs on, by file name, then by folder (same lookup as query_schemas)
+#awb filter placeholders map to the awb column they filter on, so they get a small sample IN list
+targets: Dict[str, Dict[str, str]] = {
+    'gail_report_classify': {'database': 'classify'},
+    'gail_report_classify_single_pass': {'database': 'classify'},
+    'gail_report_cad_check': {'database': 'classify', 'awbs_to_search': 'classify.shipment.awb_nbr'},
+    'classify_COE_Bill-to-acc': {'database': 'classify', 'awbs_to_search': 'AWB_NBR'},
+    'oic_task': {'database': 'classify'},
+    'wfm_reserve': {'database': 'wfm'},
+    'CA_Delivery': {'database': 'misa', 'awbs': 'AL1.shp_trk_nbr'},
+    'Find_CRN': {'database': 'misa', 'awbs': 'AL1.AWB_NBR'},
+    'intercept_data': {'database': 'misa'},
+    'intercept_data_old': {'database': 'misa'},
+    'FTA': {'database': 'misa'},
+    'quality_audits': {'database': 'misa'}
+}
+
+def plans_path() -> Path:
+    """
+    Returns the folder plans are kept in (one subfolder per backend, so stand-in plans never mix with production ones).
+    """
+    from tools import get_setting
+
+    return Path(get_setting('query_plans_path', str(Path('main_automation_programs')/'support-files'/'plans')))/standin_db.backend()
+
+def cost_jump() -> float:
+    """
+    Returns how much (percent) the estimated cost may grow from the last stored plan before it is flagged ('plan_cost_jump' .env variable, defaults to 50).
+    """
+    from tools import get_setting
+
+    return get_setting('plan_cost_jump', 50.0)
+
+def target_for(name: str) -> Dict[str, str]:
+    """
+    Returns the target (database and awb columns) of the given saved query (e.g 'FTA/CUSMA_40'), looked up by file name, then by folder.
+    Returns an empty dict for queries that are not registered.
+    """
+    parts: List[str] = name.split('/')
+    if parts[-1] in targets:
+        return targets[parts[-1]]
+    if len(parts) > 1 and parts[-2] in targets:
+        return targets[parts[-2]]
+    return dict()
+
+def sample(query: str, target: Dict[str, str], paramstyle: str | None) -> tuple:
+    """
+    Returns the given saved query with sample values (last month's dates, a two awb IN list), along with its params.
+    Dates are bound when a paramstyle is given ('named' for Oracle), pasted in otherwise.
+    """
+    query = re.sub(r"\{fn [^}]*\}", '', query) #ODBC escapes only matter to the driver
+    last_month = date.today().replace(day=1) - timedelta(days=1)
+    dates: Dict[str, date] = {'starting': last_month.replace(day=1), 'ending': last_month, 'start_date': last_month.replace(day=1), 'end_date': last_month,
+                              'dates': last_month}
+    names = query_registry.placeholders(query)
+    awbs = {name: f"{target.get(name, 'AWB_NBR')} IN ('700000000000', '700000000001')" for name in names if name in query_registry.fragments}
+    query = query.format(**awbs, **{name: f"{{{name}}}" for name in names if name not in awbs}) #only filling the awb filters for now
+
+    if paramstyle:
+        query, params = query_registry.bind(query, paramstyle, **{name: dates[name] for name in names if name in dates})
+    else:
+        query, params = query.format(**{name: f"'{dates[name].strftime('%Y-%m-%d')}'" for name in names if name in dates}), None
+    return query.rstrip().rstrip(';'), params
+
+def normalize(line: str) -> str:
+    """
+    Returns the given plan line without its numbers (spool, step and row estimates) and extra whitespace, so only real plan changes show up.
+    """
+    return re.sub(r"\s+", ' ', re.sub(r"\d+(?:[.,:]\d+)*", '#', line)).strip()
+
+def explain_oracle(cursor, query: str) -> Dict[str, object]:
+    """
+    Runs EXPLAIN PLAN for the given query on the given oracledb cursor, and returns its plan (see explain).
+    Bind parameters are left unbound, the plan is the one Oracle builds for any values.
+    """
+    statement_id: str = f"qp_{os.getpid()}_{int(time.time()*1000)}"
+    cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {query}")
+    try:
+        cursor.execute("SELECT id, depth, operation, options, object_owner, object_name, cost FROM plan_table WHERE statement_id = :id ORDER BY id", {'id': statement_id})
+        steps = cursor.fetchall()
+    finally:
+        cursor.execute("DELETE FROM plan_table WHERE statement_id = :id", {'id': statement_id})
+
+    return {
+        'cost': float(steps[0][6] or 0) if steps else 0,
+        'full_scans': sorted({f"{owner}.{table}" for _, _, operation, options, owner, table, _ in steps if operation == 'TABLE ACCESS' and options == 'FULL'}),
+        'product_joins': sum(1 for step in steps if step[2] == 'MERGE JOIN' and step[3] == 'CARTESIAN'),
+        'plan': [normalize(f"{'  '*depth}{operation} {options or ''} {f'{owner}.{table}' if table else ''}") for _, depth, operation, options, owner, table, _ in steps]
+    }
+
+def explain_teradata(cursor, query: str) -> Dict[str, object]:
+    """
+    Runs EXPLAIN for the given query on the given teradatasql cursor, and returns its plan (see explain). The cost is the total estimated time, in secs.
+    """
+    cursor.execute(f"EXPLAIN {query}")
+    text: str = '\n'.join(row[0] for row in cursor.fetchall())
+    total = re.search(r"total estimated time is (\d+):(\d+):(\d+(?:\.\d+)?)", text, flags=re.IGNORECASE)
+    steps: List[str] = re.split(r"\n\s*(?=\d+\)\s)", text) #one entry per numbered step
+
+    return {
+        'cost': int(total.group(1))*3600 + int(total.group(2))*60 + float(total.group(3)) if total else 0,
+        'full_scans': sorted({table for step in steps if re.search(r"all-rows scan", step, flags=re.IGNORECASE)
+                              for table in re.findall(r"\bfrom ([\w$#]+\.[\w$#]+)", step, flags=re.IGNORECASE)}),
+        'product_joins': len(re.findall(r"product join", text, flags=re.IGNORECASE)),
+        'plan': [normalize(line) for line in text.splitlines() if line.strip()]
+    }
+
+def explain_standin(query: str, params: Dict[str, object] | None = None) -> Dict[str, object]:
+    """
+    Returns the stand-in (DuckDB) plan for the given query (see explain). Every sequential scan is a full scan, and the cost is the estimated rows handled.
+    """
+    query = standin_db.translate(query, params)
+    for name, value in (params or {}).items(): #EXPLAIN cannot take parameters, pasting the sample dates in
+        query = query.replace(f"${name}", f"'{value}'")
+    operators = standin_db.explain(query)
+
+    return {
+        'cost': float(sum(operator['estimated_rows'] for operator in operators)),
+        'full_scans': sorted({operator['table'] for operator in operators if operator['name'] == 'SEQ_SCAN' and operator['table']}),
+        'product_joins': sum(1 for operator in operators if operator['name'] in ('CROSS_PRODUCT', 'NESTED_LOOP_JOIN', 'BLOCKWISE_NL_JOIN')),
+        'plan': [normalize(f"{'  '*operator['depth']}{operator['name']} {operator['table']}") for operator in operators]
+    }
+
+def explain(name: str, query: str) -> Dict[str, object]:
+    """
+    Returns the plan of the given saved query, on the database it runs on: its estimated cost, full table scans, product joins and normalized plan lines.
+    """
+    target = target_for(name)
+    database: str = target.get('database', 'classify')
+
+    if standin_db.enabled():
+        query, params = sample(query, target, 'named' if database in standin_db.oracle_databases else None)
+        return explain_standin(query, params)
+
+    if database == 'misa':
+        import misa_db
+        from tools import get_envvar, get_password
+        from teradata_sessions import get_manager
+
+        query, _ = sample(query, target, None)
+        with get_manager(misa_db.cs, get_envvar('misa-username'), get_password()).session() as (connection, engine):
+            with connection.cursor() as cursor:
+                return explain_teradata(cursor, query)
+
+    from oracle_pool import get_pool
+    if database == 'wfm':
+        import wfm_db
+        pool = get_pool('wfm', user=wfm_db.un, password=wfm_db.pw, host=wfm_db.hostname, port=wfm_db.port, service_name=wfm_db.cs)
+    else:
+        import classify_db
+        pool = get_pool('classify', user=classify_db.un, password=classify_db.pw, dsn=classify_db.cs)
+    query, _ = sample(query, target, 'named')
+    with pool.acquire() as connection:
+        with connection.cursor() as cursor:
+            return explain_oracle(cursor, query)
+
+def regressions(plan: Dict[str, object], last: Dict[str, object]) -> List[str]:
+    """
+    Returns what got worse in the given plan compared with the last stored one (see module docstring). Empty if nothing did.
+    """
+    found: List[str] = list()
+    new_scans = sorted(set(plan['full_scans']) - set(last.get('full_scans', [])))
+    if new_scans:
+        found.append(f"new full table scans on {', '.join(new_scans)}")
+    if plan['product_joins'] > last.get('product_joins', 0):
+        found.append(f"product joins went from {last.get('product_joins', 0)} to {plan['product_joins']}")
+    if last.get('cost') and plan['cost'] > last['cost']*(1 + cost_jump()/100):
+        found.append(f"estimated cost went from {last['cost']:g} to {plan['cost']:g} ({(plan['cost']/last['cost'] - 1)*100:+.0f}%)")
+    return found
+
+def capture(names: List[str] | None = None, databases: List[str] | None = None, save: bool = True, accept: bool = False) -> Dict[str, List[str]]:
+    """
+    Explains the given saved queries (all by default), compares each plan with the last stored one and stores the new ones.
+    Regressed plans are only stored when accept is True. Returns a dict mapping each query with a regression (or that failed to explain) to its problems.
+    """
+    path = plans_path()
+    found: Dict[str, List[str]] = dict()
+    for name, query in query_registry.load().items():
+        if names and name not in names:
+            continue
+        if databases and target_for(name).get('database', 'classify') not in databases:
+            continue
+
+        t = time.time()
+        try:
+            plan = explain(name, query)
+        except Exception as e:
+            found[name] = [f"unable to explain: {str(e).splitlines()[0] if str(e) else type(e).__name__}"]
+            print(f"'{name}': {found[name][0]}")
+            continue
+        plan.update({'fingerprint': query_metrics.fingerprint(query), 'taken': time.ctime()})
+
+        plan_path: Path = path/f"{name}.json"
+        last: Dict[str, object] = dict()
+        try:
+            with open(plan_path, 'r') as plan_file:
+                last = json.load(plan_file)
+        except (OSError, ValueError):
+            print(f"No stored plan for '{name}' yet")
+
+        problems = regressions(plan, last) if last else list()
+        if problems:
+            found[name] = problems
+            if last.get('fingerprint') != plan['fingerprint']:
+                problems.append("the query text changed since the last stored plan")
+        changed: str = ' (plan changed)' if last and last.get('plan') != plan['plan'] else ''
+        print(f"'{name}': cost {plan['cost']:g}, {len(plan['full_scans'])} full scan(s), {plan['product_joins']} product join(s){changed} "
+              f"in {time.time()-t:.2f} secs{''.join(f'\n    REGRESSION: {problem}' for problem in problems)}")
+
+        if save and problems and not accept:
+            print(f"    Keeping the last good plan of '{name}' as its baseline, run with --accept to store this one instead")
+        elif save:
+            plan_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(plan_path, 'w') as plan_file:
+                json.dump({**plan, 'previous': {key: last[key] for key in ['cost', 'full_scans', 'product_joins', 'taken'] if key in last}}, plan_file, indent=1)
+            if problems: #accepted, no longer a regression
+                print(f"    Accepted the new plan of '{name}' as its baseline")
+                del found[name]
+
+    print(f"{len(found)} saved quer(ies) with plan regressions or errors" if found else "No plan regressions found")
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Explains every saved query and flags plan regressions against the last stored plans.")
+    parser.add_argument('--query', type=str, nargs='*', default=None, help="only these saved queries (e.g FTA/CUSMA_40 oic_task)")
+    parser.add_argument('--database', type=str, nargs='*', default=None, choices=['classify', 'misa', 'wfm'], help="only the queries running on these databases")
+    parser.add_argument('--no-save', action='store_true', help="compare without storing the new plans")
+    parser.add_argument('--accept', action='store_true', help="store the new plans even when they regressed, making them the new baseline")
+    args = parser.parse_args()
+    sys.exit(1 if capture(args.query, args.database, not args.no_save, args.accept) else 0)
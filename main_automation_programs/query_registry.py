@@ -0,0 +1,280 @@
+"""
+Registry of the saved queries (support-files/queries), read and checked once per run.
+
+bind() turns a query's date placeholders into bind parameters (':starting' for Oracle, '?' for Teradata), so the statement text stays the same and its cached plan is reused.
+limit() has the database return only a query's first rows when its comments say so ('-- row_limit: 150', and '-- row_order: Awb_Nbr, ...' to sort by a full row key).
+project() only fetches the columns of a query's workbook layout (see query_schemas.layouts). To check every saved query, run:
+python main_automation_programs/query_registry.py
+"""
+
+from pathlib import Path
+from string import Formatter
+from datetime import date, datetime
+from typing import Dict, List, Literal, Tuple
+import threading
+import re
+
+fragments: List[str] = ['awbs', 'awbs_to_search'] #placeholders filled with SQL text, never bound
+date_formats: List[str] = ['%Y-%m-%d', '%d-%b-%y', '%d-%b-%Y', '%Y-%m-%d %H:%M:%S'] #formats used for dates by the jobs
+
+_lock = threading.Lock()
+_queries: Dict[str, str] = dict() #maps a saved query's name (path in the queries folder, without extension, e.g 'FTA/CUSMA_40') to its text
+_problems: Dict[str, str] = dict() #maps a saved query's name to what is wrong with it, if anything
+
+_paramstyle = Literal['named', 'qmark']
+_dialect = Literal['teradata', 'oracle']
+
+def queries_path() -> Path:
+    """
+    Returns the folder the saved queries are kept in.
+    """
+    return Path('main_automation_programs')/'support-files'/'queries'
+
+def query_name(query_path: str | Path) -> str:
+    """
+    Returns the registry name for the given saved query path (e.g 'main_automation_programs\\support-files\\queries\\FTA\\CUSMA_40.sql' -> 'FTA/CUSMA_40').
+    """
+    parts: List[str] = re.split(r"[\\/]", str(query_path)) #saved query paths are written with either separator
+    if 'queries' in parts:
+        parts = parts[len(parts) - parts[::-1].index('queries'):] #keeping what comes after the (last) queries folder
+    return '/'.join(parts).removesuffix('.sql')
+
+def placeholders(query: str) -> List[str]:
+    """
+    Returns the names of the str.format placeholders in the given query, in order of appearance.
+    Raises a ValueError if the query's braces are not balanced. ODBC escapes (e.g '{fn teradata_try_fastexport}') are not placeholders.
+    """
+    query = re.sub(r"\{fn [^}]*\}", '', query)
+    return [name for _, name, _, _ in Formatter().parse(query) if name]
+
+def _pattern(names: str) -> str:
+    """
+    Returns the regex matching the given placeholder names (alternatives, e.g 'starting|ending') when they stand alone as a value:
+    {name}, '{name}' or DATE {name} (comment lines may stand between DATE and the placeholder). Placeholders glued to other text (e.g '{name}%' or {name}_01) do not match.
+    """
+    return rf"(\bDATE(?:\s|--[^\n]*\n)+)?(?:'\{{({names})\}}'|(?<!['\w%])\{{({names})\}}(?!['\w%]))"
+
+def validate(query: str) -> str:
+    """
+    Returns what is wrong with the given query template, or an empty string if it can be bound.
+    Placeholders other than awb filters must stand alone as a value: {name}, '{name}' or DATE {name}.
+    """
+    try:
+        names = placeholders(query)
+    except ValueError as e:
+        return f"unbalanced braces ({e})"
+
+    for name in set(names) - set(fragments):
+        bindable = len(re.findall(_pattern(re.escape(name)), query, flags=re.IGNORECASE))
+        if bindable != len(re.findall(rf"\{{{name}\}}", query)):
+            return f"placeholder '{{{name}}}' is part of a larger literal and cannot be bound"
+
+    return ''
+
+def load(reload: bool = False) -> Dict[str, str]:
+    """
+    Reads and checks every saved query once (later calls reuse them, unless reload is True). Returns a dict mapping each query's name to its text.
+    Problems are printed, and raised when the faulty query is used (see get).
+    """
+    with _lock:
+        if _queries and not reload:
+            return _queries
+
+        _queries.clear()
+        _problems.clear()
+        for file in sorted(queries_path().rglob('*.sql')):
+            name = query_name(file.relative_to(queries_path()).as_posix())
+            _queries[name] = file.read_text()
+            problem = validate(_queries[name])
+            if problem:
+                _problems[name] = problem
+                print(f"Saved query '{name}' has a problem: {problem}")
+
+    return _queries
+
+def get(query_path: str | Path) -> str | None:
+    """
+    Returns the text of the given saved query from the registry, or None if it is not a saved query (e.g a custom path).
+    Raises a ValueError if the query failed its check.
+    """
+    name = query_name(query_path)
+    queries = load()
+    if name not in queries:
+        return None
+    if name in _problems:
+        raise ValueError(f"Saved query '{name}' cannot be used: {_problems[name]}")
+    return queries[name]
+
+def bind_value(value: object) -> object:
+    """
+    Returns the given value as it should be bound: dates given as strings (quoted or not, e.g "'2025-02-01'" or '01-Apr-25') become dates.
+    """
+    if isinstance(value, datetime):
+        return value.date() if value == datetime.combine(value.date(), datetime.min.time()) else value
+    if not isinstance(value, str):
+        return value
+
+    text = value.strip().strip("'")
+    for date_format in date_formats:
+        try:
+            parsed = datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        return parsed.date() if date_format != '%Y-%m-%d %H:%M:%S' else parsed
+
+    return text
+
+def bind(query: str, paramstyle: _paramstyle, **values) -> Tuple[str, Dict[str, object] | List[object]]:
+    """
+    Replaces the given placeholders of the query by bind parameters, and returns the new query along with its params.\n
+    paramstyle: 'named' for Oracle (':starting', params as a dict), 'qmark' for Teradata ('?', params as a list).\n
+    values: value of each placeholder, e.g starting="'2025-02-01'". Raises a ValueError if a placeholder cannot be bound (see validate).
+    """
+    values = {name: bind_value(value) for name, value in values.items()}
+    if not values:
+        return query, dict() if paramstyle == 'named' else list()
+
+    params: Dict[str, object] | List[object] = dict() if paramstyle == 'named' else list()
+    comments: List[Tuple[int, int]] = [comment.span() for comment in re.finditer(r"--[^\n]*", query)]
+    def marker_for(name: str) -> str:
+        if paramstyle == 'named':
+            params[name] = values[name]
+            return f":{name}"
+        params.append(values[name])
+        return '?'
+    def marker(match: re.Match) -> str:
+        name = match.group(2) or match.group(3)
+        if match.group(1) and any(start <= match.start() < end for start, end in comments): #'DATE' is only a word in a comment (e.g '--change date'), keeping it
+            return match.group(1) + marker_for(name)
+        if match.group(1) and not isinstance(values[name], date):
+            raise ValueError(f"'{name}' is used as a DATE in the query, but '{values[name]}' is not a date")
+        return marker_for(name)
+
+    names = '|'.join(re.escape(name) for name in values)
+    bound = re.sub(_pattern(names), marker, query, flags=re.IGNORECASE)
+    leftover = [name for name in values if f"{{{name}}}" in bound]
+    if leftover:
+        raise ValueError(f"Placeholders {leftover} are part of larger literals and cannot be bound")
+
+    return bound, params
+
+def row_limit(query: str) -> Tuple[int | None, str]:
+    """
+    Returns the row limit set in the query's comments (e.g '-- row_limit: 150'), or None if there is none, along with the order to keep ('-- row_order: ...', defaults to '1').
+    """
+    found = re.search(r"--\s*row_limit\s*[:=]\s*(\d+)", query, flags=re.IGNORECASE)
+    order = re.search(r"--\s*row_order\s*[:=]\s*([^\n#]+)", query, flags=re.IGNORECASE)
+    return int(found.group(1)) if found else None, order.group(1).strip() if order else '1'
+
+def limit(query: str, dialect: _dialect, rows: int | None = None, order: str | None = None) -> str:
+    """
+    Wraps the given query so the database only returns its first rows, in a set order.\n
+    dialect: 'teradata' (SELECT TOP n) or 'oracle' (FETCH FIRST n ROWS ONLY).\n
+    rows, order: default to the query's row_limit and row_order comments. Returns the query as is when there is no limit.
+    """
+    limit_rows, limit_order = row_limit(query)
+    rows = limit_rows if rows is None else rows
+    order = limit_order if order is None else order
+    if rows is None:
+        return query
+
+    query = query.rstrip().rstrip(';')
+    if dialect == 'teradata':
+        return f"SELECT TOP {rows} * FROM (\n{query}\n) q ORDER BY {order}"
+    return f"SELECT * FROM (\n{query}\n) q ORDER BY {order} FETCH FIRST {rows} ROWS ONLY"
+
+def columns(query: str) -> List[str] | None:
+    """
+    Returns the names of the columns the given query selects (its outermost select list), in order: their alias, or the column name itself (e.g 'AL5.CASUAL' -> 'CASUAL').
+    Returns None when they cannot be told from the text (e.g 'SELECT *' or an expression without an alias).
+    """
+    text = re.sub(r"--[^\n]*|/\*.*?\*/", ' ', query, flags=re.DOTALL) #comments
+    text = re.sub(r"'(?:[^']|'')*'", "''", text) #string literals, so their commas and parentheses do not count
+
+    depth: int = 0
+    start: int | None = None
+    items: List[str] = list()
+    for token in re.finditer(r"\(|\)|,|\bSELECT\b|\bFROM\b", text, flags=re.IGNORECASE):
+        word = token.group(0).upper()
+        if word == '(':
+            depth += 1
+        elif word == ')':
+            depth -= 1
+        elif depth == 0 and word == 'SELECT' and start is None:
+            start = token.end()
+        elif depth == 0 and start is not None and word in (',', 'FROM'):
+            items.append(text[start:token.start()])
+            start = token.end()
+            if word == 'FROM':
+                break
+    else:
+        return None
+
+    names: List[str] = list()
+    for position, item in enumerate(items):
+        item = item.strip()
+        if position == 0:
+            item = re.sub(r"^(?:DISTINCT\s+|TOP\s+\d+\s+)+", '', item, flags=re.IGNORECASE)
+        name = re.search(r"(?:^|[\s.)])(?:AS\s+)?\"?(\w+)\"?$", item, flags=re.IGNORECASE)
+        if not name or (not re.search(r"\bAS\s+\"?\w+\"?$", item, flags=re.IGNORECASE) and not re.fullmatch(r"[\w.\"]+", item)):
+            return None #expression without an alias, or '*'
+        names.append(name.group(1))
+    return names
+
+def project(query: str, layout: List[str]) -> str:
+    """
+    Wraps the given query so only the layout's columns come back, in the layout's order (missing ones as NULL), matched regardless of case.
+    Returns the query as is when its select list cannot be read.
+    """
+    selected = columns(query)
+    if selected is None:
+        print("Unable to read the query's select list, fetching all of its columns")
+        return query
+
+    available: Dict[str, str] = {col.lower(): col for col in selected}
+    select = ',\n'.join(f'q."{available[col.lower()]}" AS "{col}"' if col.lower() in available else f'CAST(NULL AS VARCHAR(1)) AS "{col}"'
+                         for col in layout_columns(layout))
+    return f"SELECT\n{select}\nFROM (\n{query.rstrip().rstrip(';')}\n) q"
+
+def layout_columns(layout: List[str]) -> List[str]:
+    """
+    Returns the given layout's columns without repeats (e.g STATE_CD is listed twice in the FTA layouts), in order.
+    """
+    return list(dict.fromkeys(layout))
+
+def check_layout(query: str, layout: List[str]) -> str:
+    """
+    Returns how the given query's select list differs from its layout (columns padded with empty values, columns selected for nothing), or an empty string if they match.
+    """
+    selected = columns(query)
+    if selected is None:
+        return "select list cannot be read, all of its columns are fetched"
+
+    wanted = {col.lower() for col in layout}
+    padded = [col for col in layout_columns(layout) if col.lower() not in {name.lower() for name in selected}]
+    unused = [col for col in selected if col.lower() not in wanted]
+    notes: List[str] = list()
+    if padded:
+        notes.append(f"not selected, left empty: {', '.join(padded)}")
+    if unused:
+        notes.append(f"selected but not in the layout, not fetched: {', '.join(unused)}")
+    return '; '.join(notes)
+
+def check() -> Dict[str, str]:
+    """
+    Checks every saved query, printing and returning a dict mapping each faulty query's name to its problem.
+    Queries with a workbook layout (see query_schemas.layouts) also get their select list compared with it; differences are printed, they are not problems.
+    """
+    from query_schemas import layout_for
+
+    queries = load(reload=True)
+    for name, query in queries.items():
+        layout = layout_for(name)
+        if layout:
+            notes = check_layout(query, layout)
+            print(f"Saved query '{name}' {'matches its layout' if not notes else f'differs from its layout, {notes}'}")
+    print(f"Checked {len(queries)} saved queries, {len(_problems)} with problems")
+    return dict(_problems)
+
+if __name__ == "__main__":
+    check()
@@ -0,0 +1,330 @@
+"""
+Column types for the results of the saved queries (support-files/queries), applied while the results are built instead of with astype afterwards.
+
+Each .sql file (or folder, like FTA) maps its columns to 'awb' (Int64, non numbers become <NA>), 'int', 'float', 'category', 'date' or 'text' (Arrow strings).
+Get a query's schema with schema_for(query_path) and pass it to execute_query (schema=...). Queries pasted into workbook layouts also list their sheet's columns (see layouts).
+"""
+
+import pandas as pd
+import numpy as np
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Sequence
+import re
+
+schemas: Dict[str, Dict[str, str]] = {
+    'gail_report_classify': {
+        'awb_nbr': 'awb',
+        'importernme': 'text',
+        'entry_dt': 'date',
+        'billacc': 'int',
+        'cad_val': 'float',
+        'brokr_id': 'category',
+        'duty_bill_to_cd': 'category',
+        'clr_loc': 'category',
+        'pcs': 'int',
+        'shipment_desc': 'text',
+        'ccompany': 'text',
+        'ccontact': 'text',
+        'coe': 'category',
+        'shippernme': 'text',
+        'last_modified_tmstp': 'date'
+    },
+    'oic_task': {
+        'awb_nbr': 'awb',
+        'importernme': 'text',
+        'entry_dt': 'date',
+        'billacc': 'int',
+        'cad_val': 'float',
+        'brokr_id': 'category',
+        'duty_bill_to_cd': 'category',
+        'clr_loc': 'category',
+        'pcs': 'int',
+        'shipment_desc': 'text',
+        'ccompany': 'text',
+        'ccontact': 'text',
+        'coe': 'category',
+        'shippernme': 'text'
+    },
+    'gail_report_cad_check': {
+        'awb_nbr': 'awb'
+    },
+    'classify_COE_Bill-to-acc': {
+        'awb_nbr': 'awb',
+        'coe': 'category'
+    },
+    'CA_Delivery': {
+        'shp_trk_nbr': 'awb'
+    },
+    'Find_CRN': {
+        'AWB_NBR': 'awb',
+        'TRACKING_NBR': 'awb'
+    },
+    'FTA': { #shared by all FTA queries, each only has some of these cols
+        'AWB_NBR': 'awb',
+        'COUNTRY_CD': 'category',
+        'MANUF_ORIGIN_COUNTRY_CD': 'category',
+        'ORDER_IN_COUNCIL_DOC_NBR': 'category',
+        'TARIFF_ANNEX_CD': 'category',
+        'TARIFF_TREATMENT_CD': 'category',
+        'COMMODITY_DESC': 'text',
+        'cad_value_amt': 'float',
+        'TOTAL_VALUE_DUTY_AMT': 'float',
+        'DUTY_VALUE': 'float',
+        'DUTY_AMT': 'float',
+        'PROVINCIAL_SALES_TAX_AMT': 'float',
+        'SALES_TAX_AMT': 'float',
+        'SPCL_IMPT_MEAS_ACT_TAX_AMT': 'float',
+        'oga_shipment_flg': 'category',
+        'rod_flg': 'category',
+        'csa_flg': 'category',
+        'DATE_DT': 'date',
+        'REL_DATE': 'date',
+        'STATE_CD': 'category',
+        'CLEARANCE_PORT_CD': 'category',
+        'CASUAL': 'category',
+        'COMPANY_NM': 'text',
+        'CITY_NM': 'text'
+    },
+    'quality_audits': {
+        'Awb_Nbr': 'awb',
+        'Value_Flg': 'category',
+        'COO': 'category',
+        'COE': 'category',
+        'Importer_Nm': 'text',
+        'Clr_Loc': 'category',
+        'Entry_Dt': 'date',
+        'Release_Dt': 'date',
+        'Rod_Flg': 'category',
+        'Customs_Value_In_CAD': 'float'
+    },
+    'wfm_reserve': { #awbs are left as they are, the reserve file is written out as received
+        'bill_to_acc': 'int',
+        'pcs': 'int',
+        'assigned_to': 'int',
+        'reason_cd': 'int',
+        'shipper_acct': 'int',
+        'entry_dt': 'date',
+        'crt_dt': 'date',
+        'assign_dt': 'date',
+        'updt_dt': 'date'
+    }
+}
+schemas['gail_report_classify_single_pass'] = schemas['gail_report_classify'] #same columns, see standin_db.compare
+schemas['fta_single_scan'] = schemas['FTA'] #cols of every FTA query, plus their IN_<sheet> tags (left as ints)
+
+#Columns each workbook sheet needs, in order, by saved query name (path in the queries folder, e.g 'FTA/CUSMA_40')
+#Columns the query does not select come back empty, columns it selects but are not listed are not fetched
+layouts: Dict[str, List[str]] = {
+    'FTA/CUSMA_40': [
+        'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
+        'ORDER_IN_COUNCIL_DOC_NBR',
+        'TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
+        'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
+        'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
+        'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
+        'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
+        'TOTAL_VALUE_DUTY_AMT',# used to be -> '(((SALES_TAX_AMT+PROVINCIAL_SALES_TAX_AMT)+SPCL_IMPT_MEAS_ACT_TAX_AMT)+DUTY_AMT)' MIGH NEED TO CHANGE, review calculations of tax,
+        'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
+        'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM',
+        'CONTACT_NM', # We don't do this one anymore
+        'CITY_NM',
+        'STATE_CD', 'STATE_PROVINCE_NM',
+        'POSTAL_CD',
+        'REFERENCE_NOTES_DESC'
+        ],
+
+    'FTA/0017_non_CUSMA': [
+        'AWB_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'SHIPMENT_VALUE_FLG',
+        'MANUF_ORIGIN_COUNTRY_CD', #this one is different from CUSMA_40; replaced OIC with COM
+        'TARIFF_ANNEX_CD', 'COMMODITY_LINE_NBR',
+        'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
+        'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
+        'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
+        'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
+        'TOTAL_VALUE_DUTY_AMT',
+        'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
+        'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
+        'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
+        'REFERENCE_NOTES_DESC'
+        ],
+
+    'FTA/CETA_CAS': [
+        'AWB_NBR', 'COMMODITY_LINE_NBR', 'EMPLOYEE_NBR', 'COUNTRY_CD', 'MANUF_ORIGIN_COUNTRY_CD', 'TARIFF_TREATMENT_CD',
+        'SHIPMENT_VALUE_FLG', 'COMMODITY_DESC', 'HARMONIZED_TARIFF_NBR', 'cad_value_amt',
+        'DUTY_VALUE', 'CANADIAN_ENTRY_NBR', 'oga_shipment_flg',
+        'DATE_DT', 'REL_DATE', 'DUTY_BILL_TO_ACCT_NBR', 'STATE_CD',
+        'CLEARANCE_PORT_CD', 'CASUAL_IMPORTER_CD',
+        'TOTAL_VALUE_DUTY_AMT',
+        'DUTY_AMT', 'PROVINCIAL_SALES_TAX_AMT', 'SALES_TAX_AMT',
+        'SPCL_IMPT_MEAS_ACT_TAX_AMT', 'rod_flg', 'COMPANY_NM', 'CONTACT_NM',
+        'CITY_NM', 'STATE_CD', 'STATE_PROVINCE_NM', 'POSTAL_CD',
+        'REFERENCE_NOTES_DESC', 'DUTY_BILL_TO_ACCT_NBR'
+    ],
+
+    'quality_audits/2c': [
+        'Awb_Nbr',
+        'N_of_Lines',
+        'Value_Flg',
+        'Tariff_Cd',
+        'COO',
+        'COE',
+        'Importer_Nm',
+        'Customs_Value_Amt',
+        'Currency_Cd',
+        'Duty_Bill_To_Acct_Nbr',
+        'Clr_Loc',
+        'Entry_Dt',
+        'Release_Dt',
+        'Rod_Flg',
+        'Employee',
+        'Duty_Amt',
+        'Status',
+        'Tariff_Annex_Cd',
+        'PST',
+        'GST',
+        'Exchange_Rate',
+        'Customs_Value_In_CAD'
+        ],
+
+    'quality_audits/7': [
+        'Awb_Nbr',
+        'N_of_Lines',
+        'Duty_Bill_To_Acct_Nbr',
+        'Value_Flg',
+        # 'Tariff_Cd',
+        'COE',
+        'COO',
+        'Importer_Nm',
+        'Canadian_Entry_Nbr',
+        'Business_Nbr',
+        # 'Customs_Value_Amt',
+        # 'Currency_Cd',
+        # 'Clr_Loc',
+        'Entry_Dt',
+        'Release_Dt',
+        'Rod_Flg',
+        'Customs_Value_In_CAD',
+        'Employee',
+        'Tariff_Annex_Cd',
+        # 'Status',
+        'PST',
+        'GST',
+        'CustomsAmt_BKR_CAD',
+        'OIC',
+        'SIMA'
+        # 'Exchange_Rate',
+        ]
+}
+layouts['FTA/0017_150+'] = layouts['FTA/CUSMA_40'] #identical to CUSMA_40
+layouts['FTA/ROW_20'] = layouts['FTA/CUSMA_40'] #identical to CUSMA_40
+layouts['FTA/CUKTA_CAS'] = layouts['FTA/CUSMA_40'] #identical to CUSMA_40
+layouts['FTA/CUKTA_NR'] = layouts['FTA/CUSMA_40'] #No reference on header, but I am assuming it should be identical to CUSMA_40
+layouts['FTA/CETA_NR'] = layouts['FTA/CETA_CAS'] #identical to CETA_CAS
+layouts['FTA/CPTPP_CAS'] = layouts['FTA/CETA_CAS'] #identical to CETA_CAS
+
+def schema_for(query_path: str | Path) -> Dict[str, str]:
+    """
+    Returns the column types for the given saved query, looked up by file name (e.g 'oic_task'), then by folder (e.g 'FTA').
+    Returns an empty schema (nothing typed) for queries that are not registered.
+    """
+    parts: List[str] = re.split(r"[\\/]", str(query_path)) #saved query paths are written with either separator
+    name: str = parts[-1].removesuffix('.sql')
+    if name in schemas:
+        return schemas[name]
+    if len(parts) > 1 and parts[-2] in schemas:
+        return schemas[parts[-2]]
+
+    print(f"No schema registered for query '{name}', results will not be typed")
+    return dict()
+
+def layout_for(query_path: str | Path) -> List[str] | None:
+    """
+    Returns the columns the given saved query's sheet needs, in order (see layouts), looked up by folder and file name (e.g 'FTA/CUSMA_40').
+    Returns None for queries without a layout (all their columns are fetched).
+    """
+    parts: List[str] = re.split(r"[\\/]", str(query_path))
+    name: str = '/'.join(parts[-2:]).removesuffix('.sql')
+    return layouts.get(name, layouts.get(parts[-1].removesuffix('.sql')))
+
+def matching(cols: Sequence[str], schema: Dict[str, str] | None) -> Dict[str, str]:
+    """
+    Maps each of the given column names to its type in the schema, regardless of case. Columns not in the schema are left out.
+    """
+    if not schema:
+        return dict()
+    lowered: Dict[str, str] = {col.lower(): kind for col, kind in schema.items()}
+    return {col: lowered[str(col).lower()] for col in cols if str(col).lower() in lowered}
+
+def text_dtype() -> str:
+    """
+    Returns the dtype to use for free text: Arrow strings when pyarrow is installed, pandas strings otherwise.
+    """
+    try:
+        import pyarrow #only needed for Arrow strings
+    except ImportError:
+        return 'string'
+    return 'string[pyarrow]'
+
+def convert(values: Sequence, kind: str) -> pd.api.extensions.ExtensionArray | pd.Index:
+    """
+    Builds a column of the given type (see module docstring) from the given values (fetched values, or an existing column).
+    """
+    if kind in ('awb', 'int', 'float'):
+        numbers = pd.to_numeric(pd.Series(values, dtype=object, copy=False), errors='coerce', dtype_backend='numpy_nullable')
+        return numbers.astype('Float64' if kind == 'float' else 'Int64').array
+    elif kind == 'category':
+        return pd.Categorical(values)
+    elif kind == 'date':
+        return pd.to_datetime(pd.Series(values, dtype=object, copy=False), errors='coerce').array
+    elif kind == 'text':
+        return pd.array(np.asarray(values, dtype=object), dtype=text_dtype())
+
+    raise ValueError(f"Unknown column type '{kind}'")
+
+def untyped(values: Sequence) -> pd.Series:
+    """
+    Builds a column without a type in the schema, inferring its dtype as pd.DataFrame.from_records(coerce_float=True) would (decimals become floats).
+    """
+    column = pd.Series(values, dtype=object, copy=False)
+    if isinstance(next((value for value in values if value is not None), None), Decimal): #Teradata/Oracle NUMBER cols
+        return pd.to_numeric(column, errors='coerce')
+    return column.infer_objects()
+
+def build(rows: Sequence[Sequence], cols: List[str], schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Builds the dataframe for the given fetched rows, as pd.DataFrame.from_records would, building the schema's columns with their type directly.
+    """
+    kinds = matching(cols, schema)
+    columns = list(zip(*rows)) if len(rows) else [()]*len(cols) #one tuple of values per col
+    data = pd.DataFrame({position: convert(values, kinds[col]) if col in kinds else untyped(values)
+                         for position, (col, values) in enumerate(zip(cols, columns))}) #keyed by position, queries may repeat a col name
+    data.columns = cols
+    return data
+
+def apply(data: pd.DataFrame, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Types the given (already built) dataframe's columns according to the schema, one column at a time. Returns the same dataframe.
+    """
+    for col, kind in matching(list(data.columns), schema).items():
+        data[col] = convert(data[col], kind)
+    return data
+
+def build_arrow(table, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Converts the given Arrow table into an Arrow-backed dataframe (pd.ArrowDtype columns), typing the schema's columns while still in Arrow.
+    Categories are dictionary encoded, and come back as pandas categoricals. Columns that cannot be converted (e.g awbs containing 'OLD') are left as they are.
+    """
+    import pyarrow as pa #only needed for the arrow fetch paths
+    import pyarrow.compute as pc
+
+    arrow_types = {'awb': pa.int64(), 'int': pa.int64(), 'float': pa.float64(), 'date': pa.timestamp('ns'), 'text': pa.string()}
+    for col, kind in matching(table.column_names, schema).items():
+        try:
+            column = table[col].dictionary_encode() if kind == 'category' else pc.cast(table[col], arrow_types[kind])
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            print(f"Failed to convert '{col}' col to {kind}, returning default fetch for it. Exception: {e}")
+            continue
+        table = table.set_column(table.column_names.index(col), col, column)
+
+    return table.to_pandas(types_mapper=lambda arrow_type: None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type))
@@ -6,15 +6,17 @@ Use this program to refresh the SELCT Reclass productivity report.
 """
 
 #Libraries
-import teradatasql
 import pandas as pd
 import datetime
-from sqlalchemy import create_engine
 from typing import List, Literal
 from sqlalchemy.exc import OperationalError
+import teradatasql
 import numpy as np
 import time
 from tools import get_query, get_envvar
+from query_registry import bind
+from teradata_sessions import get_manager
+import db_retry
 from csv import QUOTE_STRINGS
 
 _MODES = Literal['csv', 'excel']
@@ -29,7 +31,8 @@ def get_intercept_data(
     query_host: str = "edwmiscop1.prod.fedex.com",
     username: str = get_envvar('misa-username'),
     save_dataframe_as: _MODES = 'csv',
-    spooling_delay: int = 5
+    spooling_delay: int = 5,
+    fastexport: bool = False
     ) -> pd.DataFrame | None:
     """
     Gets Intercept data from MISA database.
@@ -40,6 +43,8 @@ def get_intercept_data(
 
     The 'spooling_delay' variable can be used to wait out the executions, so that time is given for spool to clear.
     The 'save_dataframe_as' variable can be used to specify if you want to save the resulting dataframe as an excel file or a csv file.
+    The 'fastexport' variable unloads each date window with Teradata FastExport (see teradata_sessions.read_fastexport). Off by default, set it to True to try it.
+    Dropped connections retry the same window (see db_retry); auth and syntax errors stop the pull, after saving the rows fetched so far.
     """
 
     #Settings for query
@@ -52,6 +57,8 @@ def get_intercept_data(
 
     #Getting query data
     dataframe: pd.DataFrame = pd.DataFrame()
+    sessions = get_manager(query_host, username, password) #one session is kept open for every date window (spool errors do not drop it)
+    circuit = db_retry.breaker('misa') #shared with misa_db, stops the pull when MISA clearly is not coming back
 
     start: datetime.datetime = first_day #initialize first interval to begin with the first day
     end: datetime.datetime = datetime.datetime(1900, 1, 1) #initializing last day for interval
@@ -71,18 +78,38 @@ def get_intercept_data(
             starting: str = f"'{start.strftime("%Y-%m-%d")}'"
             ending: str = f"'{end.strftime("%Y-%m-%d")}'"
             try:
-                with teradatasql.connect(host=query_host, user=username, password=password) as connection:
-                    engine = create_engine('teradatasql://', creator=lambda: connection) #using sqlalchemy for better compatibility
-                    print(f"Fetching dates {starting} to {ending}")
-                    curr_qry: str = query.format(start_date = starting, end_date = ending)
-                    print(f'Current query: {curr_qry.replace('\n', ' ')}')
-                    data = pd.read_sql_query(sql=curr_qry, con=engine,
-                                                dtype={
-                                                    'AWB_NBR': np.int64,
-                                                    'EMPLOYEE_NBR': np.int64
-                                                }
-                                            )
-            except OperationalError as e:
+                circuit.check()
+                print(f"Fetching dates {starting} to {ending}")
+                curr_qry, params = bind(query, 'qmark', start_date = starting, end_date = ending) #same statement for every window, only the bound dates change
+                print(f'Current query: {curr_qry.replace('\n', ' ')}')
+                fetch_start: float = time.time()
+                read = sessions.read_fastexport if fastexport else sessions.read_sql
+                data = read(curr_qry, params=params,
+                            dtype={
+                                'AWB_NBR': np.int64,
+                                'EMPLOYEE_NBR': np.int64
+                            }
+                        )
+                print(f"Fetched {data.shape[0]} rows at {data.shape[0]/max(time.time()-fetch_start, 0.001):.0f} rows/sec")
+            except Exception as e:
+                kind: str = db_retry.classify(e)
+                database_error: bool = isinstance(e, (OperationalError, teradatasql.OperationalError)) #raw FastExport errors are not wrapped by sqlalchemy
+                if kind == 'network' and not circuit.is_open():
+                    circuit.failure(kind, e)
+                    if circuit.is_open():
+                        save_partial(save_dataframe_as, dataframe, first_day, last_day, kind)
+                        raise
+                    wait: float = db_retry.backoff(circuit.consecutive)
+                    print(f"Lost connection while fetching {starting} to {ending}, retrying the same window in {wait:.1f} secs. {type(e)}")
+                    time.sleep(wait)
+                    continue
+                if kind not in ('spool', 'other') or not database_error: #auth/syntax errors, open breaker or python errors: retrying would only hammer MISA
+                    circuit.failure(kind, e)
+                    print(f"Unable to fetch dates {starting} to {ending}, stopping ({kind} error). {type(e)}, {e}")
+                    save_partial(save_dataframe_as, dataframe, first_day, last_day, kind)
+                    raise
+
+                #spool errors (and unknown database errors, most likely spool as well) are not counted by the breaker, the day shift shrinks instead
                 print(f"Unable to fetch with given day shift (most likely ran out of spooling space)\nReducing day shift by half and refetching. {type(e)}")
                 # print(e)
                 if curr_shift == 0: #when unable to fetch again with shift already at zero, skip current day. Also skip if time difference is zero (might alredy be doing feb 14 - feb 14, for example, but time shift is over 0)
@@ -91,10 +118,9 @@ def get_intercept_data(
                     # start = min(start, last_day) #checking we are not going over last day
                     break #breaking out of inner while loop to reset day shift
                 curr_shift = int(curr_shift/2) #reducing day shift by half
-            except Exception as e:
-                print(f"Unexpected exception, {type(e)}, {e}")
             else:
                 successful_fetch = True
+                circuit.success()
 
             #Modifying start date after successful fetch
             if successful_fetch:
@@ -128,6 +154,18 @@ def get_intercept_data(
 
     #Print any remaining rows, in case the last rows were not exported
     if not exported_during_last_iter: print_rows(save_dataframe_as, dataframe, first_day, last_day)
+    sessions.report()
+
+def save_partial(save_dataframe_as: str, dataframe: pd.DataFrame, first_day: datetime.datetime, last_day: datetime.datetime, kind: str) -> None:
+    """
+    Saves the rows fetched so far (not yet exported) before the pull stops on the given kind of error, so finished windows are not lost.
+    """
+    if dataframe.empty:
+        return None
+
+    print(f"Stopping on a{'n' if kind[0] in 'aeiou' else ''} {kind} error, saving the {dataframe.shape[0]} rows fetched so far")
+    print_rows(save_dataframe_as, dataframe, first_day, last_day)
+    return None
 
 def print_rows(save_dataframe_as: str, dataframe: pd.DataFrame, first_day: datetime.datetime, last_day: datetime.datetime) -> None:
     secs_now: float = time.time()
@@ -0,0 +1,83 @@
+"""
+Incremental (watermark based) extraction of query results, used by the Gail report.
+
+The first run saves the full results locally along with a watermark (the latest modification timestamp). Later runs of the same query only fetch rows modified since then, and merge them in by key.
+Snapshots are kept under 'snapshots_path' (.env variable).
+"""
+
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+from typing import Callable, Dict, Tuple
+import hashlib
+import json
+import time
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+from standin_db import backend
+
+def snapshot_dir() -> Path:
+    """
+    Returns the folder snapshots are kept in, creating it if needed.
+    """
+    from tools import get_setting
+
+    path = Path(get_setting('snapshots_path', str(Path('main_automation_programs')/'support-files'/'snapshots')))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def delta_query(query: str, watermark_col: str, watermark: datetime, params: Dict[str, object] | None = None) -> Tuple[str, Dict[str, object]]:
+    """
+    Wraps the given (Oracle) query so that only rows modified after the given watermark are returned. Returns the query along with its params.
+    The watermark is bound (':watermark') along with the query's own params, so every delta run sends the same statement.
+    """
+    return f"SELECT * FROM (\n{query}\n) delta WHERE delta.{watermark_col} > :watermark", {**(params or {}), 'watermark': watermark}
+
+def incremental(name: str, query: str, fetch: Callable[[str, Dict[str, object]], pd.DataFrame], key_col: str, watermark_col: str,
+                full_refresh: bool = False, overlap_secs: float = 60*60, params: Dict[str, object] | None = None) -> pd.DataFrame:
+    """
+    Returns the complete results for the given query, only fetching the rows modified since the last run when a snapshot exists.\n
+    name: name to save the snapshot under (e.g 'gail_classify').\n
+    fetch: runs a query with the given bind params (e.g classify_db.execute_query).\n
+    key_col, watermark_col: column identifying a row (e.g 'awb_nbr') and modification timestamp column.\n
+    overlap_secs: the delta starts this long before the watermark, so late commits are not missed.\n
+    Rows that stopped matching the query are only removed by a full_refresh.
+    """
+    path = snapshot_dir()
+    data_path: Path = path/f'{name}.parquet'
+    meta_path: Path = path/f'{name}.json'
+    params = params or {}
+    query_hash: str = hashlib.sha256(f"{backend()}:{query}:{json.dumps(params, sort_keys=True, default=str)}".encode('utf-8')).hexdigest() #stand-in and production snapshots never mix
+
+    meta: Dict[str, str] = dict()
+    try:
+        with open(meta_path, 'r') as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        print(f"No snapshot found for '{name}'")
+
+    t = time.time()
+    if full_refresh or meta.get('query') != query_hash or not data_path.exists():
+        print(f"Running full extraction for '{name}'")
+        data: pd.DataFrame = fetch(query, params)
+    else:
+        watermark: pd.Timestamp = pd.Timestamp(meta['watermark']) - pd.Timedelta(seconds=overlap_secs)
+        print(f"Fetching '{name}' rows modified after {watermark} (snapshot from {meta['taken']})")
+        delta: pd.DataFrame = fetch(*delta_query(query, watermark_col, watermark.to_pydatetime(), params))
+        snapshot: pd.DataFrame = pd.read_parquet(data_path)
+        data = pd.concat([snapshot[~snapshot[key_col].isin(delta[key_col])], delta], ignore_index=True) #replacing changed rows
+        print(f"Merged {delta.shape[0]} changed rows into snapshot of {snapshot.shape[0]} rows")
+
+    #Saving new snapshot and watermark
+    if data.shape[0] != 0:
+        data.to_parquet(data_path, compression='zstd')
+        with open(meta_path, 'w') as meta_file:
+            json.dump({
+                'query': query_hash,
+                'watermark': str(pd.to_datetime(data[watermark_col]).max()),
+                'taken': time.ctime()
+            }, meta_file, indent=1)
+    print(f"Time taken for incremental '{name}' extraction: {time.time()-t} secs")
+
+    return data
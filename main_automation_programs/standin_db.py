@@ -0,0 +1,641 @@
+"""
+Local DuckDB stand-in for the Classify, MISA and WFM databases, to run (and time) whole jobs offline. Needs duckdb.
+
+It holds synthetic copies of every table the saved queries use, under the same names, generated with:
+python main_automation_programs/standin_db.py generate --shipments 10000000
+Add db_backend = 'standin' to your .env file to send queries to it; the standin_ .env variables mimic the real servers' speed (see README).
+To check that a rewritten query returns the same rows as the original: python main_automation_programs/standin_db.py compare <original.sql> <rewrite.sql>
+"""
+
+import pandas as pd
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+from datetime import date, timedelta
+import argparse
+import threading
+import math
+import time
+import re
+import sys, os
+sys.path.append(os.getcwd())
+sys.path.append(f"{os.getcwd()}/main_automation_programs")
+import query_schemas
+
+_lock = threading.Lock()
+_connection = None #shared duckdb connection, each query runs on its own cursor
+_connected: set = set() #databases that already paid their connect time
+
+oracle_databases: List[str] = ['classify', 'wfm'] #oracle returns (unquoted) column names in uppercase, which sqlalchemy lowercases
+
+#Values used by the generated data; taken from the filters of the saved queries, so they return rows
+countries: List[str] = ['US', 'MX', 'PR', 'CA', 'GB', 'DE', 'FR', 'IT', 'ES', 'NL', 'BE', 'AT', 'PL', 'SE', 'IE', 'PT', 'DK', 'FI', 'CZ', 'HU',
+                        'RO', 'GR', 'SK', 'SI', 'HR', 'BG', 'LT', 'LV', 'EE', 'LU', 'MT', 'CY', 'MC', 'SM', 'AD', 'AU', 'JP', 'NZ', 'PE', 'SG',
+                        'VN', 'CN', 'HK', 'IN', 'KR', 'TW', 'BR', 'CH', 'TR', 'IL']
+brokers: List[str] = ['FEC', 'FON', 'FEX', 'ACU', 'AIC', 'AJZ', 'ARG', 'ARW', 'CPI', 'EVZ', 'FLA', 'HYP', 'HYC', 'FDS', 'MMX', 'PMC', 'TES', 'GGG', 'LIV', 'UPS']
+locations: List[str] = ['YYZ', 'YUL', 'YVR', 'YYC', 'YEG', 'YWG', 'YOW', 'YHZ', 'YQB', 'YXE', 'YQR', 'YXU', 'YKF', 'YQM', 'YSJ', 'YYJ']
+intercept_codes: List[str] = ['AEC', 'ATF', 'AGI', 'CIT', 'DIP', 'HCA', 'KPC', 'PSN', 'NRC', 'SMN', 'TCA', 'CSA', 'DES', 'DESC', 'ILG', 'OXC', 'VAL',
+                              'WGT', 'VER', 'REF', 'QST', 'FRD', 'PRO', 'ADP', 'ADE', 'C20', 'XMT', 'IPD', 'MMM', 'NWD', 'ODA', 'HVC', 'TPL', 'ZZZ']
+descriptions: List[str] = ['books', 'wine', 'gift', 'paper', 'cotton shirt', 'auto parts', 'phone case', 'shoes', 'vitamins', 'toy', 'jewelry', 'documents']
+
+def pick(values: list, seed: int) -> str:
+    """
+    Returns a SQL expression picking one of the given values for each generated row (i), spread evenly but not in order.
+    """
+    literals = ', '.join('NULL' if value is None else f"'{value}'" for value in values)
+    return f"([{literals}])[1 + (hash(i, {seed}) % {len(values)})::INTEGER]"
+
+def num(low: float, high: float, seed: int) -> str:
+    """
+    Returns a SQL expression for an amount between low and high, for each generated row (i).
+    """
+    return f"round({low} + (hash(i, {seed}) % 100000) / 100000.0 * {high - low}, 2)::DECIMAL(18, 2)"
+
+def day(seed: int | None = None, offset: str = '0') -> str:
+    """
+    Returns a SQL expression for a date in the generated window (a random one, or the one at the given offset when no seed is given).
+    """
+    days = f"(hash(i, {seed}) % {{days}})::INTEGER" if seed is not None else offset
+    return f"(DATE '{{start}}' + {days})"
+
+def tables(shipments: int) -> Dict[str, Tuple[int, Dict[str, str]]]:
+    """
+    Returns the stand-in tables: maps a table name to its row count and its columns (name mapped to the SQL generating it from the row number, i).
+    Row i of every table (or i//k for tables with k rows per shipment) is the same shipment, so joins match like in production.
+    """
+    n = shipments
+    awb = "(700000000000 + {oid})"
+    return {
+        #Classify (Oracle)
+        'classify.shipment': (n, {
+            'local_shipment_oid_nbr': 'i',
+            'awb_nbr': awb.format(oid='i'),
+            'transaction_nbr': "'1' || lpad((i % 1000000000)::VARCHAR, 13, '0')",
+            'duty_bill_to_cd': pick(['R', 'S', 'T'], 1),
+            'entry_dt': f"{day(2)}::TIMESTAMP", #oracle dates come back as datetimes
+            'last_modified_tmstp': f"{day(2)} + to_seconds((hash(i, 3) % 864000)::BIGINT)",
+            'origin_loc_cntry_cd': pick(countries, 4),
+            'manuf_orig_cntry_cd': pick(countries, 5),
+            'export_country_cd': pick(countries, 6),
+            'piece_qty': '1 + (hash(i, 7) % 5)::INTEGER',
+            'rod_flg': pick(['Y', 'N'], 8),
+            'ship_dt': f"{day(2)}::TIMESTAMP",
+            'shipment_desc': pick(descriptions, 9),
+            'final_import_clearance_loc_cd': pick(locations, 10),
+            'eci_flg': pick(['Y', 'N'], 11),
+            'local_customs_value_amt': num(1, 3000, 12),
+            'duty_bill_to_acct_nbr': '(100000000 + hash(i, 13) % 900000000)::BIGINT',
+        }),
+        'classify.shipment_party': (n*6, { #a broker, importer, shipper and consignee party per shipment, plus two more of any type (several parties of a type, or notify parties)
+            'local_shipment_oid_nbr': 'i // 6',
+            'shipment_party_type_cd': f"CASE WHEN i % 6 < 4 THEN (['B', 'I', 'S', 'C'])[1 + (i % 6)::INTEGER] ELSE {pick(['B', 'I', 'S', 'C', 'N', 'N'], 20)} END",
+            'broker_id_cd': pick(brokers, 14),
+            'company_nm': "'COMPANY ' || (hash(i, 15) % 50000)::VARCHAR",
+            'contact_nm': "'CONTACT ' || (hash(i, 16) % 50000)::VARCHAR",
+            'customer_acct_nbr': '(100000000 + hash(i, 17) % 900000000)::BIGINT',
+        }),
+        'classify.shipment_process_control': (n, {
+            'local_shipment_oid_nbr': 'i',
+            'process_control_type_desc': pick(['ENTRYS', 'ENTRYS', 'ENTRYS', 'RELEASE'], 18),
+            'process_control_data_desc': pick(['LVS', 'LVS', 'HVS', 'OIC'], 19),
+        }),
+        'classify.dt_shipment_header': (n//2, { #every other shipment has a CAD
+            'local_shipment_oid_nbr': 'i*2',
+        }),
+
+        #MISA (Teradata)
+        'MISA_PROD_VIEW_DB.TIME_DIM': (-1, { #one row per day of the window
+            'TIME_WNBR': 'i',
+            'DATE_DT': day(offset='i::INTEGER'),
+        }),
+        'MISA_PROD_VIEW_DB.COUNTRY_DIM': (len(countries), {
+            'PM_PRIMARYKEY': 'i',
+            'COUNTRY_CD': f"({countries})[1 + i::INTEGER]",
+        }),
+        'MISA_PROD_VIEW_DB.LOCATION_DIM': (len(locations), {
+            'PM_PRIMARYKEY': 'i',
+            'LOCATION_CD': f"({locations})[1 + i::INTEGER]",
+        }),
+        'MISA_PROD_VIEW_DB.COMMODITY_DIM': (5000, {
+            'PM_PRIMARYKEY': 'i',
+            'HARMONIZED_TARIFF_NBR': "lpad((hash(i, 20) % 10000000000)::VARCHAR, 10, '0')",
+        }),
+        'MISA_PROD_VIEW_DB.CLASSIFY_SHIPMENT_FACT': (n, {
+            'local_shipment_oid_nbr': 'i',
+            'tracking_id_nbr': awb.format(oid='i'),
+            'transaction_nbr': "'1' || lpad((i % 1000000000)::VARCHAR, 13, '0')",
+            'oga_shipment_flg': pick(['Y', 'N'], 21),
+            'rod_flg': pick(['Y', 'N'], 8),
+            'csa_flg': pick(['Y', 'N'], 22),
+            'duty_bill_to_cd': pick(['R', 'S', 'T'], 1),
+            'export_country_wnbr': f"(hash(i, 6) % {len(countries)})::BIGINT",
+            'origin_loc_cntry_wnbr': f"(hash(i, 4) % {len(countries)})::BIGINT",
+            'final_import_clrnc_loc_wnbr': f"(hash(i, 10) % {len(locations)})::BIGINT",
+            'input_dt_wnbr': '(hash(i, 2) % {days})::BIGINT',
+            'pm_current_flag': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CLASSIFY_DT_SHPMT_HDR_FACT': (n, {
+            'LOCAL_SHIPMENT_OID_NBR': 'i',
+            'TRANSACTION_NBR': "'1' || lpad((hash(i, 23) % 1000000000)::VARCHAR, 13, '0')",
+            'CREATION_EMP_NBR': '(100000 + hash(i, 24) % 500)::BIGINT',
+            'LAST_MODIFIED_EID': '(100000 + hash(i, 25) % 500)::BIGINT',
+            'OFFICE_NBR': "lpad((hash(i, 26) % 500)::VARCHAR, 4, '0')",
+            'CASUAL': pick(['Y', 'N'], 27),
+            'DUTY_VALUE': num(1, 2000, 28),
+            'TOTAL_DUE': num(0, 500, 29),
+            'STATUS': pick(['ACCEPTED BY CUSTOMS', 'COMPLETED', 'STAGED FOR CONSOLIDATION', 'REJECTED'], 30),
+            'RELEASE_DATE_WNBR': '(least(hash(i, 2) % {days} + hash(i, 31) % 3, {days} - 1))::BIGINT',
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CLASSIFY_DT_COMMODITY_RECAP': (n*2, { #two commodity lines per shipment
+            'LOCAL_SHIPMENT_OID_NBR': 'i // 2',
+            'COMMODITY_SEQUENCE_NBR': '1 + i % 2',
+            'COMMODITY_WNBR': '(hash(i, 32) % 5000)::BIGINT',
+            'COMMODITY_DESC': pick(descriptions, 33),
+            'COM': pick(countries, 34),
+            'TARIFF_CODE': pick([None, '1', '2', '3'], 35),
+            'TARIFF_TREATMENT_CD': pick(['02', '04', '05', '09', '31', '34'], 36),
+            'OIC_DOCUMENT': pick([None, None, '85-2955-2', '85-2955-3'], 37),
+            'TOTAL_UNIT_CAD_AMT': num(1, 300, 38),
+            'CUSTOMS_DUTY': num(0, 50, 39),
+            'GST_AMT': num(0, 30, 40),
+            'PST_AMT': num(0, 30, 41),
+            'HST_AMT': num(0, 30, 42),
+            'QST_AMT': num(0, 30, 43),
+            'SIMA_CHARGES': num(0, 5, 44),
+            'SURTAX_AMT': num(0, 5, 45),
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CLASSIFY_DT_SHIPMENT_PARTY': (n*2, { #one importer and one shipper per shipment
+            'LOCAL_SHIPMENT_OID_NBR': 'i // 2',
+            'CUSTOMER_TYPE': "(['I', 'S'])[1 + (i % 2)::INTEGER]",
+            'NME': "'COMPANY ' || (hash(i, 15) % 50000)::VARCHAR",
+            'DUTY_BILL_TO_ACCT_NBR': '(100000000 + hash(i, 17) % 900000000)::BIGINT',
+            'ADDRESS': "(hash(i, 46) % 9999)::VARCHAR || ' MAIN ST'",
+            'CITY': pick(['TORONTO', 'MONTREAL', 'VANCOUVER', 'CALGARY', 'OTTAWA'], 47),
+            'STATE': pick(['ON', 'QC', 'BC', 'AB'], 48),
+            'POSTAL': pick(['M5V1J1', 'H3B2Y5', 'V6B1A1', 'T2P1J9'], 49),
+            'COUNTRY': "'CA'",
+        }),
+        'MISA_PROD_VIEW_DB.CLASSIFY_SHPMT_PRCS_CTRL': (n, {
+            'local_shipment_oid_nbr': 'i',
+            'process_control_type_desc': pick(['ENTRYS', 'ENTRYS', 'ENTRYS', 'RELEASE'], 18),
+            'process_control_data_desc': pick(['LVS', 'LVS', 'HVS', 'OIC'], 19),
+        }),
+        'MISA_PROD_VIEW_DB.AIRBILL_DIM': (n, {
+            'PM_PRIMARYKEY': 'i',
+            'AWB_NBR': awb.format(oid='i'),
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CARRIER_PIECE_FACT': (max(1, n//10), { #child (CRN) tracking numbers for a tenth of the shipments
+            'AIRBILL_WNBR': f'(hash(i, 50) % {n})::BIGINT',
+            'TRACKING_NBR': '(800000000000 + i)',
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CARRIER_SHIPMENT_FACT': (n, {
+            'AIRBILL_WNBR': 'i',
+            'CUSTOMS_VALUE_AMT': num(1, 3000, 12),
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CCII_CLEARANCE_ACTIVITY_FACT': (n, {
+            'AIRBILL_WNBR': 'i',
+            'CREATED_EMPL_WNBR': '(hash(i, 51) % 500)::BIGINT',
+            'ACTIVITY_DATA_DESC': pick(['INTERCEPT ADDED', 'INTERCEPT CLEARED', 'NOTE ADDED', 'STATUS CHANGE'], 52),
+            'ACTIVITY_TMSTP': f"{day(2)} + to_seconds((hash(i, 53) % 86400)::BIGINT)",
+            'ACTIVITY_DT_WNBR': '(hash(i, 2) % {days})::BIGINT', #same day as ACTIVITY_TMSTP
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.EMPLOYEE_DIM': (500, {
+            'PM_PRIMARYKEY': 'i',
+            'EMPLOYEE_NBR': '(100000 + i)',
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CCII_INTERCEPT_FACT': (max(1, n//3), {
+            'AIRBILL_WNBR': f'(hash(i, 54) % {n})::BIGINT',
+            'INTERCEPT_CODE_WNBR': f'(hash(i, 55) % {len(intercept_codes)})::BIGINT',
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CCII_INTERCEPT_CODE_DIM': (len(intercept_codes), {
+            'PM_PRIMARYKEY': 'i',
+            'INTERCEPT_CD': f"({intercept_codes})[1 + i::INTEGER]",
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'MISA_PROD_VIEW_DB.CCII_SHIPMENT_CORE_CLRNC_FACT': (n, {
+            'AIRBILL_WNBR': 'i',
+            'ENTRY_CATEGORY_TYPE_CD': pick(['HVS', 'LVS', 'OIC', 'CLVS'], 19),
+            'PM_CURRENT_FLAG': '1',
+        }),
+        'UI_ISH_PROD_DB.employee': (500, {
+            'emp_nbr': '(100000 + i)',
+            'job_cd': pick(['NC97C', 'NC97C', 'NC12A'], 56),
+        }),
+        'SCAN_PROD_VIEW_DB.fx_package_event_history_all': (n*3, { #three scans per shipment
+            'shp_trk_nbr': awb.format(oid='i // 3'),
+            'scan_type_cd': pick(['11', '19', '20', '30', '31', '33', '42', '79', '07', '08'], 57),
+            'loc_arpt_cd': pick(locations + ['MEM', 'IND', 'OAK'], 58),
+            'evnt_crt_tmstp': f"{day(2)} + to_seconds((hash(i, 59) % 864000)::BIGINT)",
+        }),
+
+        #WFM (Oracle)
+        'WFM_RESERVE': (max(1, n//10), {
+            'awb': awb.format(oid='i*10'),
+            'bill_to_acc': '(100000000 + hash(i, 17) % 900000000)::BIGINT',
+            'pcs': '1 + (hash(i, 7) % 5)::INTEGER',
+            'transaction_nbr': "'1' || lpad((i % 1000000000)::VARCHAR, 13, '0')",
+            'assigned_to': '(100000 + hash(i, 24) % 500)::BIGINT',
+            'reason_cd': '(hash(i, 60) % 40)::INTEGER',
+            'shipper_acct': '(100000000 + hash(i, 61) % 900000000)::BIGINT',
+            'entry_dt': f"{day(2)}::TIMESTAMP",
+            'crt_dt': f"{day(2)} + to_seconds((hash(i, 62) % 86400)::BIGINT)",
+            'assign_dt': f"{day(2)} + to_seconds((hash(i, 63) % 172800)::BIGINT)",
+            'updt_dt': f"{day(2)} + to_seconds((hash(i, 64) % 259200)::BIGINT)",
+        }),
+    }
+
+def backend() -> str:
+    """
+    Returns where queries are sent: 'standin' or 'production' ('db_backend' .env variable, defaults to 'production').
+    """
+    from tools import get_setting
+
+    return 'standin' if get_setting('db_backend', 'production').strip().lower() == 'standin' else 'production'
+
+def enabled() -> bool:
+    """
+    Returns True when queries should go to the stand-in instead of the real servers ('db_backend' .env variable set to 'standin').
+    """
+    return backend() == 'standin'
+
+def standin_path() -> Path:
+    """
+    Returns the path of the stand-in database file.
+    """
+    from tools import get_setting
+
+    return Path(get_setting('standin_path', str(Path('main_automation_programs')/'support-files'/'standin'/'standin.duckdb')))
+
+def connect():
+    """
+    Returns the shared (read only) connection to the stand-in. Run queries on connect().cursor(), so each thread gets its own.
+    """
+    global _connection
+    import duckdb #only needed for the stand-in
+
+    with _lock:
+        if _connection is None:
+            path = standin_path()
+            if not path.exists():
+                raise FileNotFoundError(f"No stand-in database found at '{path}'. Run 'python main_automation_programs/standin_db.py generate' first.")
+            _connection = duckdb.connect(str(path), read_only=True)
+
+    return _connection
+
+def translate(query: str, params: Dict[str, object] | List[object] | None = None) -> str:
+    """
+    Rewrites the Oracle/Teradata specific bits of the saved queries that DuckDB does not understand
+    (date literals, ODBC escapes, REGEXP_LIKE, NUMBER casts, 'SELECT TOP n' and ':name' binds).
+    """
+    def iso_date(match: re.Match) -> str:
+        return f"'{pd.to_datetime(match.group(1), format='%d-%b-%y').strftime('%Y-%m-%d')}'"
+
+    query = re.sub(r"'(\d{1,2}-[A-Za-z]{3}-\d{2})'", iso_date, query)
+    query = re.sub(r"\{fn [^}]*\}", '', query)
+    query = re.sub(r"\bREGEXP_LIKE\s*\(", 'regexp_matches(', query, flags=re.IGNORECASE)
+    query = re.sub(r"\bCAST\s*\(([^()]+?)\s+AS\s+NUMBER\s*\(\s*\d+\s*\)\s+DEFAULT\s+NULL\s+ON\s+CONVERSION\s+ERROR\s*\)", r'TRY_CAST(\1 AS BIGINT)', query, flags=re.IGNORECASE)
+    query = re.sub(r"\bAS\s+NUMBER\s*\(\s*\d+\s*\)", 'AS BIGINT', query, flags=re.IGNORECASE)
+    top = re.match(r"\s*SELECT\s+TOP\s+(\d+)\s", query, flags=re.IGNORECASE)
+    if top:
+        query = f"SELECT {query[top.end():]}\nLIMIT {top.group(1)}"
+    if isinstance(params, dict) and params:
+        names = '|'.join(re.escape(name) for name in params)
+        query = re.sub(rf"(?<![:\w]):({names})\b", r"$\1", query)
+    return query
+
+def _wait(database: str, phase: str, rows: int = 0, arraysize: int | None = None) -> None:
+    """
+    Sleeps as long as the real server would take for the given phase ('connect', 'execute' or 'fetch' of the given number of rows).
+    """
+    from tools import get_setting
+
+    setting = lambda var_name, default: get_setting([f'{var_name}_{database}', var_name], default) #a database specific value (e.g 'standin_latency_ms_misa') wins over the general one
+    if phase == 'connect':
+        with _lock:
+            if database in _connected:
+                return None
+            _connected.add(database)
+        time.sleep(setting('standin_connect_ms', 0.0)/1000)
+    elif phase == 'execute':
+        time.sleep(setting('standin_latency_ms', 0.0)/1000)
+    elif phase == 'fetch':
+        arraysize = arraysize or setting('standin_arraysize', 100)
+        rows_per_sec: float = setting('standin_rows_per_sec', 0.0)
+        roundtrips = math.ceil(rows/arraysize) if rows else 1
+        time.sleep(roundtrips*setting('standin_roundtrip_ms', 0.0)/1000 + (rows/rows_per_sec if rows_per_sec > 0 else 0))
+
+    return None
+
+def _tuned_arraysize(database: str, query: str) -> int | None:
+    """
+    Returns the arraysize the real pools would fetch the given query with (see fetch_tuning), for Classify and WFM queries.
+    Returns None (standin_arraysize or oracledb's default) for MISA, or when standin_arraysize is set.
+    """
+    from tools import get_setting
+
+    if database not in oracle_databases or get_setting([f'standin_arraysize_{database}', 'standin_arraysize'], 0):
+        return None
+    from fetch_tuning import tune #imported here, fetch_tuning needs query_metrics, which needs this module
+    return tune(query)['arraysize']
+
+def _columns(database: str, cols: List[str]) -> List[str]:
+    """
+    Returns the given column names the way the real database's driver would.
+    """
+    return [col.lower() for col in cols] if database in oracle_databases else cols
+
+def read_sql(database: str, query: str, timings: Dict[str, float] | None = None, arrow: bool = False, arraysize: int | None = None,
+             schema: Dict[str, str] | None = None, params: Dict[str, object] | List[object] | None = None) -> pd.DataFrame:
+    """
+    Runs the given query on the stand-in, as if it was sent to the given database ('classify', 'misa' or 'wfm'), and returns its results.\n
+    arrow: returns Arrow-backed columns, like oracle_pool.read_arrow.\n
+    timings, schema, params: see query_metrics.read_timed.
+    """
+    from query_metrics import add_time #imported here, query_metrics needs this module
+
+    timings = dict() if timings is None else timings
+    arraysize = arraysize or _tuned_arraysize(database, query)
+
+    t = time.time()
+    _wait(database, 'connect')
+    cursor = connect().cursor()
+    add_time(timings, 'connect', t)
+    try:
+        t = time.time()
+        _wait(database, 'execute')
+        result = cursor.execute(translate(query, params), params or None)
+        add_time(timings, 'execute', t)
+
+        t = time.time()
+        table = result.fetch_arrow_table()
+        _wait(database, 'fetch', table.num_rows, arraysize)
+        add_time(timings, 'fetch', t)
+    finally:
+        cursor.close()
+
+    t = time.time()
+    table = table.rename_columns(_columns(database, table.column_names))
+    data = query_schemas.build_arrow(table, schema) if arrow else query_schemas.apply(table.to_pandas(), schema)
+    add_time(timings, 'build', t)
+    return data
+
+def describe(database: str, query: str, params: Dict[str, object] | List[object] | None = None) -> List[str]:
+    """
+    Returns the names of the given query's columns, without fetching any rows, like oracle_pool.describe.
+    """
+    cursor = connect().cursor()
+    try:
+        cursor.execute(f"SELECT * FROM (\n{translate(query, params)}\n) WHERE 1 = 0", params or None)
+        return [col[0] for col in cursor.description]
+    finally:
+        cursor.close()
+
+def iter_batches(database: str, query: str, batch_rows: int = 50000, schema: Dict[str, str] | None = None,
+                 params: Dict[str, object] | List[object] | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Runs the given query on the stand-in and yields its results as dataframes of at most batch_rows rows, like oracle_pool.iter_batches.
+    """
+    _wait(database, 'connect')
+    cursor = connect().cursor()
+    try:
+        _wait(database, 'execute')
+        cursor.execute(translate(query, params), params or None)
+        cols = _columns(database, [col[0] for col in cursor.description])
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            _wait(database, 'fetch', len(rows), batch_rows)
+            yield query_schemas.build(rows, cols, schema)
+    finally:
+        cursor.close()
+
+    return None
+
+def read_with_lookup(database: str, query: str, values: list, table: str, timings: Dict[str, float] | None = None,
+                     schema: Dict[str, str] | None = None, params: Dict[str, object] | List[object] | None = None) -> pd.DataFrame:
+    """
+    Loads the given values into a temporary lookup table (one 'val' column) on the stand-in, then runs the query, like oracle_pool.read_with_lookup.
+    Values keep their type (Oracle converts the lookup table's strings when comparing them to numbers, DuckDB does not).
+    """
+    from query_metrics import add_time #imported here, query_metrics needs this module
+
+    timings = dict() if timings is None else timings
+    lookup = pd.DataFrame({'val': list(values)})
+
+    t = time.time()
+    _wait(database, 'connect')
+    cursor = connect().cursor()
+    add_time(timings, 'connect', t)
+    try:
+        t = time.time()
+        _wait(database, 'execute') #loading the values
+        cursor.register('lookup_values', lookup)
+        cursor.execute(f"CREATE OR REPLACE TEMP TABLE {table} AS SELECT val FROM lookup_values")
+        _wait(database, 'execute')
+        result = cursor.execute(translate(query, params), params or None)
+        add_time(timings, 'execute', t)
+
+        t = time.time()
+        data = result.fetch_df()
+        _wait(database, 'fetch', data.shape[0], _tuned_arraysize(database, query))
+        add_time(timings, 'fetch', t)
+    finally:
+        cursor.close()
+
+    data.columns = _columns(database, list(data.columns))
+    return query_schemas.apply(data, schema)
+
+def read_with_volatile(database: str, query: str, table: str, stage: str, timings: Dict[str, float] | None = None,
+                       schema: Dict[str, str] | None = None, params: Dict[str, object] | List[object] | None = None) -> pd.DataFrame:
+    """
+    Runs the stage query into a temporary table on the stand-in, then runs the query (reading from the table), like teradata_sessions.SessionManager.read_with_volatile.
+    params are the stage query's bind parameters.
+    """
+    from query_metrics import add_time #imported here, query_metrics needs this module
+
+    timings = dict() if timings is None else timings
+
+    t = time.time()
+    _wait(database, 'connect')
+    cursor = connect().cursor()
+    add_time(timings, 'connect', t)
+    try:
+        t = time.time()
+        _wait(database, 'execute') #filling the table
+        cursor.execute(f"CREATE OR REPLACE TEMP TABLE {table} AS\n{translate(stage, params)}", params or None)
+        _wait(database, 'execute')
+        result = cursor.execute(translate(query))
+        add_time(timings, 'execute', t)
+
+        t = time.time()
+        table_data = result.fetch_arrow_table()
+        _wait(database, 'fetch', table_data.num_rows)
+        add_time(timings, 'fetch', t)
+    finally:
+        cursor.close()
+
+    t = time.time()
+    table_data = table_data.rename_columns(_columns(database, table_data.column_names))
+    data = query_schemas.apply(table_data.to_pandas(), schema)
+    add_time(timings, 'build', t)
+    return data
+
+def generate(shipments: int = 1000000, start: str | None = None, days: int = 120, path: str | None = None) -> Path:
+    """
+    Creates (or replaces) the stand-in database with the given number of shipments, over the given number of days from start (defaults to covering last month and this month).
+    """
+    import duckdb
+
+    global _connection
+    path = Path(path) if path is not None else standin_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    start = start or (date.today() - timedelta(days=days-5)).strftime('%Y-%m-%d')
+
+    with _lock: #closing the shared read only connection, if any
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+    t = time.time()
+    with duckdb.connect(str(path)) as connection:
+        for table, (rows, cols) in tables(shipments).items():
+            rows = days if rows < 0 else rows
+            if '.' in table:
+                connection.execute(f"CREATE SCHEMA IF NOT EXISTS {table.split('.')[0]}")
+            select = ',\n'.join(f"{expr.format(start=start, days=days)} AS {col}" for col, expr in cols.items())
+            t_table = time.time()
+            connection.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT {select} FROM range({rows}) t(i)")
+            print(f"Generated '{table}' ({rows} rows) in {time.time()-t_table:.2f} secs")
+
+    print(f"Stand-in database with {shipments} shipments from {start} generated at '{path}' in {time.time()-t:.2f} secs")
+    return path
+
+def sample_query(query: str) -> str:
+    """
+    Fills the placeholders of the given saved query with sample values: last month's dates, and awb filters that keep every row.
+    """
+    last_month = (date.today().replace(day=1) - timedelta(days=1))
+    sample: Dict[str, str] = {
+        'starting': last_month.replace(day=1).strftime("'%Y-%m-%d'"), 'ending': last_month.strftime("'%Y-%m-%d'"),
+        'start_date': last_month.replace(day=1).strftime("%Y-%m-%d"), 'end_date': last_month.strftime("%Y-%m-%d"),
+        'awbs': '1=1', 'awbs_to_search': '1=1', 'dates': last_month.strftime("'%Y-%m-%d'"), #awb filters differ per query, only checking the rest
+    }
+
+    placeholders = re.findall(r"\{(\w+)\}", query)
+    values = {name: sample.get(name, 'NULL') for name in placeholders}
+    if 'start_date' in values and f"'{{start_date}}'" not in query: #teradata style (DATE {start_date}), needs quotes
+        values['start_date'], values['end_date'] = f"'{values['start_date']}'", f"'{values['end_date']}'"
+    return translate(query.format(**values)).rstrip().rstrip(';')
+
+def check(queries_path: str = str(Path('main_automation_programs')/'support-files'/'queries')) -> Dict[str, str]:
+    """
+    Checks that every saved query (with sample values) runs on the stand-in. Returns a dict mapping each failing query file to its error.
+    """
+    failed: Dict[str, str] = dict()
+    for file in sorted(Path(queries_path).rglob('*.sql')):
+        try:
+            connect().cursor().execute(f"EXPLAIN {sample_query(file.read_text())}")
+        except Exception as e:
+            failed[str(file)] = str(e).splitlines()[0]
+            print(f"'{file}' does not run on the stand-in: {failed[str(file)]}")
+        else:
+            print(f"'{file}' runs on the stand-in")
+
+    return failed
+
+def explain(query: str) -> List[Dict[str, object]]:
+    """
+    Returns DuckDB's plan for the given (final) query, as a list of operators (root first), each with its depth in the plan, name ('HASH_JOIN', 'SEQ_SCAN', etc.),
+    scanned table (if any) and estimated rows.
+    """
+    import json
+
+    plan = json.loads(connect().cursor().execute(f"EXPLAIN (FORMAT JSON) {query}").fetchall()[0][1])
+    operators: List[Dict[str, object]] = list()
+    nodes: list = [(node, 0) for node in reversed(plan)]
+    while nodes:
+        node, depth = nodes.pop()
+        nodes.extend((child, depth+1) for child in reversed(node.get('children', [])))
+        info = node.get('extra_info', dict())
+        operators.append({
+            'depth': depth,
+            'name': node.get('name', ''),
+            'table': info['Table'].split('.', 1)[-1] if 'Table' in info else '', #dropping the stand-in catalog name
+            'estimated_rows': int(info.get('Estimated Cardinality', 0) or 0)
+        })
+
+    return operators
+
+def plan_cost(query: str) -> Dict[str, object]:
+    """
+    Returns what DuckDB plans to do for the given (final) query: the number of operators, the rows they are estimated to handle in total (the plan's cost),
+    and how many times each table is scanned.
+    """
+    cost: Dict[str, object] = {'operators': 0, 'estimated_rows': 0, 'scans': dict()}
+    for operator in explain(query):
+        cost['operators'] += 1
+        cost['estimated_rows'] += operator['estimated_rows']
+        if operator['table']:
+            cost['scans'][operator['table']] = cost['scans'].get(operator['table'], 0) + 1
+
+    return cost
+
+def compare(query_path: str, other_path: str, database: str = 'classify', runs: int = 3) -> Dict[str, object]:
+    """
+    Runs two versions of a saved query on the stand-in, checking they return the same columns and rows, and reports their best time and plan costs.
+    """
+    report: Dict[str, object] = dict()
+    results: List[pd.DataFrame] = list()
+    for name, path in [('query', query_path), ('other', other_path)]:
+        query = sample_query(Path(path).read_text())
+        times: List[float] = list()
+        for _ in range(max(1, runs)):
+            t = time.time()
+            data = connect().cursor().execute(query).fetch_df()
+            times.append(time.time() - t)
+        data.columns = _columns(database, list(data.columns))
+        results.append(data)
+        report[name] = {'path': str(path), 'rows': data.shape[0], 'best_secs': round(min(times), 4), **plan_cost(query)}
+
+    first, second = results
+    report['same_columns'] = list(first.columns) == list(second.columns)
+    report['identical'] = report['same_columns'] and first.shape == second.shape and first.sort_values(list(first.columns)).reset_index(drop=True).equals(
+        second.sort_values(list(second.columns)).reset_index(drop=True))
+
+    for name in ['query', 'other']:
+        print(f"{report[name]['path']}: {report[name]['rows']} rows in {report[name]['best_secs']} secs (best of {runs}), "
+              f"plan of {report[name]['operators']} operators handling ~{report[name]['estimated_rows']} rows, scans: {report[name]['scans']}")
+    print(f"Same columns: {report['same_columns']}, identical results: {report['identical']}, "
+          f"plan cost difference: {report['other']['estimated_rows'] - report['query']['estimated_rows']:+} estimated rows "
+          f"({(report['other']['estimated_rows']/report['query']['estimated_rows'] - 1)*100 if report['query']['estimated_rows'] else 0:+.0f}%)")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates or checks the local stand-in database.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser('generate', help="creates the stand-in database with synthetic data")
+    generate_parser.add_argument('--shipments', type=int, default=1000000, help="number of shipments to generate")
+    generate_parser.add_argument('--start', type=str, default=None, help="first day of the generated window (YYYY-MM-DD)")
+    generate_parser.add_argument('--days', type=int, default=120, help="length of the generated window, in days")
+    subparsers.add_parser('check', help="checks that every saved query runs on the stand-in")
+    compare_parser = subparsers.add_parser('compare', help="checks that two versions of a saved query give the same results, and compares their cost")
+    compare_parser.add_argument('query', type=str, help="path of the first .sql file (e.g the original)")
+    compare_parser.add_argument('other', type=str, help="path of the second .sql file (e.g the rewrite)")
+    compare_parser.add_argument('--database', type=str, default='classify', help="database the queries are for (classify, misa or wfm)")
+    compare_parser.add_argument('--runs', type=int, default=3, help="how many times to run each query (best time is kept)")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(args.shipments, args.start, args.days)
+    elif args.command == 'compare':
+        compare(args.query, args.other, args.database, args.runs)
+    else:
+        check()
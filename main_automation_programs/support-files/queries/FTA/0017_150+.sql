@@ -1,3 +1,5 @@
+-- row_limit: 150 #only the first 150 corrections are kept in the FTA workbook (see fta_corrections)
+-- row_order: AWB_NBR, COMMODITY_LINE_NBR #full row key, so the same rows are kept on every run
 SELECT DISTINCT 
 -- SELECT TOP 100
 AL3.tracking_id_nbr as AWB_NBR, 
@@ -1,3 +1,4 @@
+-- no row_limit: the FTA macro splits these rows between the CUSMA_40 and CUSMA_40_150 sheets, it needs all of them
 SELECT DISTINCT
 -- SELECT TOP 100
 AL3.tracking_id_nbr as AWB_NBR,
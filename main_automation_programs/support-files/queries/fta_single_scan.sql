@@ -0,0 +1,69 @@
+--Single scan of the FTA base join for all nine FTA queries at once (see fta_corrections.run_single_scan)
+--Each IN_<sheet> col is 1 when the row belongs to that sheet's query (FTA/<sheet>.sql), using the exact same predicates. Keep them in sync when an FTA query changes
+--Selects the cols of every FTA query; rows that belong to no sheet are dropped. MISA keeps the rows in a volatile table, and they are split locally
+SELECT DISTINCT tagged.*
+FROM (SELECT
+AL3.tracking_id_nbr as AWB_NBR,
+AL5.CREATION_EMP_NBR as EMPLOYEE_NBR,
+AL3.transaction_nbr as CANADIAN_ENTRY_NBR,
+AL6.TARIFF_CODE as TARIFF_ANNEX_CD,
+AL6.COMMODITY_SEQUENCE_NBR as COMMODITY_LINE_NBR,
+AL6.COMMODITY_DESC,
+AL7.HARMONIZED_TARIFF_NBR,
+AL6.TOTAL_UNIT_CAD_AMT as TOTAL_VALUE_DUTY_AMT,
+AL3.oga_shipment_flg,
+AL1.DATE_DT,
+AL2.DATE_DT as REL_DATE,
+AL3.rod_flg,
+AL5.TOTAL_DUE as cad_value_amt,
+AL6.GST_AMT as SALES_TAX_AMT,
+AL6.PST_AMT as PROVINCIAL_SALES_TAX_AMT,
+AL6.SIMA_CHARGES as SPCL_IMPT_MEAS_ACT_TAX_AMT,
+AL6.CUSTOMS_DUTY as DUTY_AMT,
+AL6.OIC_DOCUMENT as ORDER_IN_COUNCIL_DOC_NBR,
+AL5.OFFICE_NBR as CLEARANCE_PORT_CD,
+AL5.CASUAL,
+AL8.NME as COMPANY_NM,
+AL8.CITY as CITY_NM,
+AL8.STATE as STATE_CD,
+AL6.COM as MANUF_ORIGIN_COUNTRY_CD,
+AL8.POSTAL as POSTAL_CD,
+AL8.DUTY_BILL_TO_ACCT_NBR,
+AL4.COUNTRY_CD as COUNTRY_CD,
+AL3.csa_flg,
+AL6.TARIFF_TREATMENT_CD as TARIFF_TREATMENT_CD,
+AL5.DUTY_VALUE,
+
+--sheet predicates, on top of the shared ones in the WHERE clause below
+CASE WHEN AL4.COUNTRY_CD IN ('MX', 'PR', 'US') AND AL6.OIC_DOCUMENT IS NULL AND AL5.DUTY_VALUE<=150 AND (NOT AL7.HARMONIZED_TARIFF_NBR LIKE '9816%')
+    AND (NOT AL8.NME LIKE 'SELECTBLINDS%') AND (NOT AL5.TRANSACTION_NBR LIKE '17525%') AND AL5.DUTY_VALUE >= AL6.TOTAL_UNIT_CAD_AMT
+    THEN 1 ELSE 0 END AS "IN_CUSMA_40",
+CASE WHEN AL4.COUNTRY_CD IN ('MX', 'PR', 'US') AND AL6.OIC_DOCUMENT IN ('85-2955-2', '85-2955-3') AND AL5.DUTY_VALUE>150
+    AND AL5.DUTY_VALUE >= AL6.TOTAL_UNIT_CAD_AMT AND (NOT AL8.NME LIKE 'SELECTBLINDS%') AND (NOT AL5.TRANSACTION_NBR LIKE '17525%')
+    THEN 1 ELSE 0 END AS "IN_0017_150+",
+CASE WHEN AL4.COUNTRY_CD NOT IN ('MX', 'PR', 'US') AND AL6.OIC_DOCUMENT IN ('85-2955-2', '85-2955-3')
+    AND (NOT AL8.NME LIKE 'SELECTBLINDS%') AND (NOT AL5.TRANSACTION_NBR LIKE '17525%')
+    THEN 1 ELSE 0 END AS "IN_0017_non_CUSMA",
+CASE WHEN AL4.COUNTRY_CD NOT IN ('GB', 'MX', 'PR', 'US') AND AL6.OIC_DOCUMENT IS NULL AND AL5.DUTY_VALUE<=20 AND AL5.DUTY_VALUE >= AL6.TOTAL_UNIT_CAD_AMT
+    THEN 1 ELSE 0 END AS "IN_ROW_20",
+CASE WHEN AL4.COUNTRY_CD IN ('AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI', 'FR', 'GR', 'HR', 'HU', 'IE', 'IT', 'LT', 'LU', 'LV', 'MC', 'MT', 'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK', 'SM', 'AD')
+    AND AL6.COM IN ('AD', 'AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI', 'FR', 'GR', 'HR', 'HU', 'IE', 'IT', 'LT', 'LU', 'LV', 'MC', 'MT', 'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK', 'SM')
+    AND AL5.CASUAL='Y' AND (NOT AL6.TARIFF_TREATMENT_CD='31')
+    THEN 1 ELSE 0 END AS "IN_CETA_CAS",
+CASE WHEN AL6.COM NOT IN ('AD', 'AT', 'BE', 'BG', 'CY', 'CZ', 'DE', 'DK', 'EE', 'ES', 'FI', 'FR', 'GR', 'HR', 'HU', 'IE', 'IT', 'LT', 'LU', 'LV', 'MC', 'MT', 'NL', 'PL', 'PT', 'RO', 'SE', 'SI', 'SK', 'SM')
+    AND AL5.CASUAL='Y' AND AL6.TARIFF_TREATMENT_CD='31'
+    THEN 1 ELSE 0 END AS "IN_CETA_NR",
+CASE WHEN AL4.COUNTRY_CD IN ('AU', 'CA', 'JP', 'MX', 'NZ', 'PE', 'SG', 'VN') AND AL6.COM IN ('AU', 'CA', 'JP', 'MX', 'NZ', 'PE', 'SG', 'VN')
+    AND AL5.CASUAL='Y' AND (AL6.TARIFF_TREATMENT_CD IN ('02', '04', '05'))
+    THEN 1 ELSE 0 END AS "IN_CPTPP_CAS",
+CASE WHEN AL4.COUNTRY_CD='GB' AND AL6.COM='GB' AND AL5.CASUAL='Y' AND (NOT AL6.TARIFF_TREATMENT_CD='34')
+    THEN 1 ELSE 0 END AS "IN_CUKTA_CAS",
+CASE WHEN AL4.COUNTRY_CD='GB' AND (NOT AL6.COM='GB') AND AL6.TARIFF_TREATMENT_CD='34'
+    THEN 1 ELSE 0 END AS "IN_CUKTA_NR"
+
+FROM MISA_PROD_VIEW_DB.TIME_DIM AL1, MISA_PROD_VIEW_DB.TIME_DIM AL2, MISA_PROD_VIEW_DB.CLASSIFY_SHIPMENT_FACT AL3, MISA_PROD_VIEW_DB.COUNTRY_DIM AL4, MISA_PROD_VIEW_DB.CLASSIFY_DT_SHPMT_HDR_FACT AL5, MISA_PROD_VIEW_DB.CLASSIFY_DT_COMMODITY_RECAP AL6, MISA_PROD_VIEW_DB.COMMODITY_DIM AL7, MISA_PROD_VIEW_DB.CLASSIFY_DT_SHIPMENT_PARTY AL8
+WHERE (AL1.TIME_WNBR=AL3.input_dt_wnbr AND AL4.PM_PRIMARYKEY=AL3.export_country_wnbr AND AL5.LOCAL_SHIPMENT_OID_NBR=AL6.LOCAL_SHIPMENT_OID_NBR AND AL6.COMMODITY_WNBR=AL7.PM_PRIMARYKEY AND AL5.RELEASE_DATE_WNBR=AL2.TIME_WNBR AND AL3.local_shipment_oid_nbr=AL5.LOCAL_SHIPMENT_OID_NBR AND AL8.LOCAL_SHIPMENT_OID_NBR=AL5.LOCAL_SHIPMENT_OID_NBR)  AND ((AL3.pm_current_flag=1 AND (NOT (AL6.COMMODITY_DESC LIKE '%alcohol%' OR AL6.COMMODITY_DESC LIKE '%books%' OR AL6.COMMODITY_DESC LIKE '%cigar%' OR AL6.COMMODITY_DESC LIKE '%gift%' OR AL6.COMMODITY_DESC LIKE '%newsprint%' OR AL6.COMMODITY_DESC LIKE '%paper%' OR AL6.COMMODITY_DESC LIKE '%smokes%' OR AL6.COMMODITY_DESC LIKE '%tonic%' OR AL6.COMMODITY_DESC LIKE '%wine%')) AND AL5.PM_CURRENT_FLAG=1 AND AL6.PM_CURRENT_FLAG=1 AND AL8.CUSTOMER_TYPE='I'
+
+AND AL1.DATE_DT BETWEEN DATE {starting} AND DATE {ending}))) tagged
+WHERE tagged."IN_CUSMA_40" + tagged."IN_0017_150+" + tagged."IN_0017_non_CUSMA" + tagged."IN_ROW_20" + tagged."IN_CETA_CAS"
+    + tagged."IN_CETA_NR" + tagged."IN_CPTPP_CAS" + tagged."IN_CUKTA_CAS" + tagged."IN_CUKTA_NR" > 0
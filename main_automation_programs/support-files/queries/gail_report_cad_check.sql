@@ -0,0 +1,7 @@
+SELECT DISTINCT
+    classify.shipment.awb_nbr
+FROM
+    classify.shipment
+WHERE
+    ({awbs_to_search})
+    AND EXISTS (SELECT 1 FROM classify.dt_shipment_header WHERE classify.dt_shipment_header.local_shipment_oid_nbr = classify.shipment.local_shipment_oid_nbr)
@@ -84,7 +84,8 @@ select distinct /*CSV*/
      CompleteInfo.coe,
      CompleteInfo.tn,
      trim(CompleteInfo.sCompany || ' ' || CompleteInfo.sContact) as shipperNme,
-                CompleteInfo.sAccount
+                CompleteInfo.sAccount,
+     CompleteInfo.last_modified_tmstp --watermark for incremental runs, dropped before export
                 
     
     
@@ -0,0 +1,72 @@
+--Same results as gail_report_classify.sql, reading classify.shipment_party once instead of four times
+--The month's LVS shipments (without a CAD) are found first, then all their parties are read in a single join (materialized), and joined back once per party type
+--Each party row is kept whole, so shipments with several parties of a type come back once per combination, as in the original
+with lvs as
+(SELECT
+    classify.shipment.local_shipment_oid_nbr             AS oid,
+    classify.shipment.awb_nbr,
+    classify.shipment.transaction_nbr                    AS tn,
+    classify.shipment.duty_bill_to_cd,
+    classify.shipment.last_modified_tmstp,
+    classify.shipment.origin_loc_cntry_cd                AS coe,
+    classify.shipment.piece_qty,
+    classify.shipment.shipment_desc,
+    classify.shipment.final_import_clearance_loc_cd      AS clr_loc,
+    classify.shipment.LOCAL_CUSTOMS_VALUE_AMT            as cad_val,
+    classify.shipment.entry_dt
+FROM
+    classify.shipment
+WHERE
+    --CHANGE DATE
+    classify.shipment.entry_dt between {starting} and {ending}
+    --CHANGE DATE
+    AND EXISTS (SELECT 1 FROM CLASSIFY.SHIPMENT_PROCESS_CONTROL
+                WHERE CLASSIFY.SHIPMENT_PROCESS_CONTROL.LOCAL_SHIPMENT_OID_NBR = classify.shipment.local_shipment_oid_nbr
+                    AND CLASSIFY.SHIPMENT_PROCESS_CONTROL.PROCESS_CONTROL_TYPE_DESC = 'ENTRYS'
+                    AND CLASSIFY.SHIPMENT_PROCESS_CONTROL.PROCESS_CONTROL_DATA_DESC in ('LVS'))
+    AND NOT EXISTS (SELECT 1 FROM classify.dt_shipment_header
+                    WHERE classify.dt_shipment_header.local_shipment_oid_nbr = classify.shipment.local_shipment_oid_nbr)), parties as
+(SELECT /*+ MATERIALIZE */
+    classify.shipment_party.local_shipment_oid_nbr       AS oid,
+    classify.shipment_party.shipment_party_type_cd       AS party_type,
+    classify.shipment_party.broker_id_cd                 AS brokr_id,
+    classify.shipment_party.Company_NM                   AS company,
+    classify.shipment_party.Contact_NM                   AS contact,
+    classify.shipment_party.customer_acct_nbr            AS account
+FROM
+    lvs
+    INNER JOIN classify.shipment_party ON lvs.oid = classify.shipment_party.local_shipment_oid_nbr
+WHERE
+    classify.shipment_party.shipment_party_type_cd in ('I', 'S', 'C')
+    --broker, only the brokers the report is for
+    OR (classify.shipment_party.shipment_party_type_cd = 'B'
+        AND classify.shipment_party.broker_id_cd in ('ACU', 'AIC', 'AJZ', 'ARG', 'ARW', 'CPI', 'EVZ', 'FLA', 'HYP', 'HYC', 'FDS', 'MMX', 'PMC', 'TES', 'FEC', 'FON', 'FEX')))
+
+
+select distinct /*CSV*/
+    lvs.awb_nbr,
+
+    trim(importer.company || ' ' || importer.contact) as importerNme,
+    lvs.entry_dt,
+    importer.account as billAcc,
+    lvs.cad_val,
+    broker.brokr_id,
+    lvs.duty_bill_to_cd,
+    lvs.clr_loc,
+    lvs.piece_qty as pcs,
+
+    lvs.shipment_desc,
+
+    consignee.company as cCompany,
+    consignee.contact as cContact,
+    lvs.coe,
+    lvs.tn,
+    trim(shipper.company || ' ' || shipper.contact) as shipperNme,
+    shipper.account as sAccount,
+    lvs.last_modified_tmstp --watermark for incremental runs, dropped before export
+
+    from lvs
+INNER JOIN parties broker ON lvs.oid = broker.oid AND broker.party_type = 'B'
+INNER JOIN parties importer ON lvs.oid = importer.oid AND importer.party_type = 'I'
+INNER JOIN parties shipper ON lvs.oid = shipper.oid AND shipper.party_type = 'S'
+INNER JOIN parties consignee ON lvs.oid = consignee.oid AND consignee.party_type = 'C'
@@ -1,3 +1,5 @@
+-- row_limit: 150 #only the first 150 rows are audited (see weekly_quality_audits)
+-- row_order: Awb_Nbr, Value_Flg, COO, COE, Importer_Nm, Duty_Bill_To_Acct_Nbr, Clr_Loc, Entry_Dt, Release_Dt, Rod_Flg, Employee, Customs_Value_In_CAD #every grouped col, so the same rows are kept on every run
 SELECT 
 AL1.tracking_id_nbr as Awb_Nbr,
 COUNT (AL2.COMMODITY_SEQUENCE_NBR) as N_of_Lines,
@@ -0,0 +1,372 @@
+"""
+Keeps authenticated Teradata (MISA) sessions open for the whole job, instead of logging in again for every query.
+
+Use get_manager() to get the shared manager for a host and user, so every module in the same program reuses the same sessions.
+Call report() at the end of a job to see time spent connecting versus running queries.
+"""
+
+import teradatasql
+import pandas as pd
+from sqlalchemy import create_engine, Engine
+from sqlalchemy.pool import StaticPool
+from query_metrics import read_timed, add_time
+import query_schemas
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Iterator
+import threading
+import atexit
+import time
+import re
+
+#FastExport jobs the server turns down, worth running again as regular SQL: 2633 too many load/unload tasks running now,
+#and driver messages about FastExport or its data sessions. Any other error would fail the same way as regular SQL
+fastexport_rejection: re.Pattern = re.compile(r"\[Error 2633\]|FastExport (?:is not|not) (?:supported|allowed)|data sessions? (?:could not|failed)", re.IGNORECASE)
+
+class SessionManager:
+    """
+    Keeps up to max_sessions authenticated sessions open against the given host.
+    Sessions are checked out with session() (or read_sql()), and new requests wait when all of them are busy.
+    """
+
+    def __init__(self, host: str, user: str, password: str, max_sessions: int = 1):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.max_sessions = max(1, max_sessions)
+        self._idle: List[Tuple[teradatasql.TeradataConnection, Engine]] = list() #sessions ready to be handed out
+        self._opened: int = 0 #sessions currently open, idle or busy
+        self._cond = threading.Condition()
+
+        #Timing stats
+        self.connect_time: float = 0
+        self.connects: int = 0
+        self.query_time: float = 0
+        self.queries: int = 0
+        self.dropped: int = 0 #sessions closed after dropping, replaced on the next checkout
+
+    def _connect(self) -> Tuple[teradatasql.TeradataConnection, Engine]:
+        """
+        Opens (and authenticates) a new session. Returns the connection along with a sqlalchemy engine bound to it.
+        """
+        t = time.time()
+        connection = teradatasql.connect(host=self.host, user=self.user, password=self.password)
+        engine = create_engine('teradatasql://', creator=lambda: connection, poolclass=StaticPool) #using sqlalchemy for better compatibility
+        elapsed = time.time() - t
+        with self._cond:
+            self.connect_time += elapsed
+            self.connects += 1
+        print(f"Opened session on '{self.host}' in {elapsed} secs")
+        return connection, engine
+
+    def _discard(self, connection: teradatasql.TeradataConnection, engine: Engine) -> None:
+        """
+        Closes the given session, ignoring any errors (the session is usually already dead when this is called).
+        """
+        try:
+            engine.dispose()
+            connection.close()
+        except Exception as e:
+            print(f"Ignoring error while closing dropped session: {e}")
+        with self._cond:
+            self._opened -= 1
+            self._cond.notify()
+
+        return None
+
+    @staticmethod
+    def is_alive(connection: teradatasql.TeradataConnection) -> bool:
+        """
+        Checks if the given session is still logged on by running a trivial statement on it.
+        """
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+        except Exception:
+            return False
+
+        return True
+
+    def checkout(self) -> Tuple[teradatasql.TeradataConnection, Engine]:
+        """
+        Returns an idle session (connection, engine), opening a new one when none are idle. Give it back with checkin() once done.
+        """
+        with self._cond:
+            while not self._idle and self._opened >= self.max_sessions: #waiting for a session to be given back
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1 #reserving the slot before connecting, so other threads do not go over max_sessions
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, checked_out: Tuple[teradatasql.TeradataConnection, Engine], alive: bool = True) -> None:
+        """
+        Gives the given session back to the manager. Dead sessions (alive=False) are closed instead of being reused.
+        """
+        if not alive:
+            self._discard(*checked_out)
+            return None
+
+        with self._cond:
+            self._idle.append(checked_out)
+            self._cond.notify()
+
+        return None
+
+    @contextmanager
+    def session(self) -> Iterator[Tuple[teradatasql.TeradataConnection, Engine]]:
+        """
+        Checks out a session (connection, engine) for the duration of the with block.
+        If the block fails and the session turns out to be dead, the session is closed instead of being reused.
+        """
+        checked_out = self.checkout()
+        alive: bool = True
+        try:
+            yield checked_out
+        except Exception:
+            alive = self.is_alive(checked_out[0]) #only throw the session away if it is actually dead (e.g not for spool space errors)
+            raise
+        finally:
+            self.checkin(checked_out, alive)
+
+    def read_sql(self, query: str, dtype: Dict[str, object] | None = None, timings: Dict[str, float] | None = None,
+                 schema: Dict[str, str] | None = None, params: List[object] | None = None) -> pd.DataFrame:
+        """
+        Runs the given query on one of the manager's sessions and returns the results, as pd.read_sql_query would.\n
+        dtype: types to convert the given columns to.\n
+        timings, schema, params: see query_metrics.read_timed.\n
+        A dropped session is closed and the error raised, db_retry runs the query again on a fresh one.
+        """
+        timings = dict() if timings is None else timings
+        t = time.time()
+        connection, engine = checked_out = self.checkout()
+        add_time(timings, 'connect', t)
+        try:
+            t = time.time()
+            data = read_timed(engine, query, timings, schema, params)
+            if dtype is not None:
+                data = data.astype(dtype)
+            elapsed = time.time() - t
+        except Exception as e:
+            alive = self.is_alive(connection)
+            self.checkin(checked_out, alive)
+            if not alive:
+                print(f"Session on '{self.host}' dropped, closed it. Exception: {e}")
+                with self._cond:
+                    self.dropped += 1
+            raise
+
+        self.checkin(checked_out)
+        with self._cond:
+            self.query_time += elapsed
+            self.queries += 1
+        return data
+
+    def iter_batches(self, query: str, batch_rows: int = 50000, schema: Dict[str, str] | None = None, params: List[object] | None = None) -> Iterator[pd.DataFrame]:
+        """
+        Runs the given query on one of the manager's sessions and yields its results as dataframes of at most batch_rows rows, one batch in memory at a time.
+        """
+        with self.session() as (connection, engine):
+            t = time.time()
+            with connection.cursor() as cursor:
+                cursor.execute(query, params) if params else cursor.execute(query)
+                cols = [col[0] for col in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(batch_rows)
+                    if not rows:
+                        break
+                    yield query_schemas.build(rows, cols, schema)
+            with self._cond:
+                self.query_time += time.time() - t
+                self.queries += 1
+
+        return None
+
+    def read_fastexport(self, query: str, dtype: Dict[str, object] | None = None, timings: Dict[str, float] | None = None,
+                        schema: Dict[str, str] | None = None, params: List[object] | None = None, data_sessions: int = 0,
+                        batch_rows: int = 100000) -> pd.DataFrame:
+        """
+        Same as read_sql, but has the driver unload the results with FastExport over data_sessions extra connections (0 lets the driver pick), for big extracts.\n
+        Queries that don't qualify run as regular SQL (a warning is printed). Only FastExport rejections (see fastexport_rejection) fall back to read_sql, other errors are raised.
+        """
+        timings = dict() if timings is None else timings
+        escapes: str = '{fn teradata_try_fastexport}' + (f"{{fn teradata_sessions({data_sessions})}}" if data_sessions > 0 else '')
+        try:
+            t = time.time()
+            with self.session() as (connection, engine):
+                add_time(timings, 'connect', t)
+                with connection.cursor() as cursor:
+                    t = time.time()
+                    cursor.execute(escapes + query, params) if params else cursor.execute(escapes + query)
+                    t = add_time(timings, 'execute', t)
+                    cols = [col[0] for col in cursor.description]
+                    frames: List[pd.DataFrame] = list() #one per batch, only the current batch's rows are held as tuples
+                    while True:
+                        batch = cursor.fetchmany(batch_rows)
+                        if not batch:
+                            break
+                        t = add_time(timings, 'fetch', t)
+                        frames.append(query_schemas.build(batch, cols, schema))
+                        t = add_time(timings, 'build', t)
+                    add_time(timings, 'fetch', t)
+
+                    cursor.execute('{fn teradata_get_warnings}') #tells if the driver fell back to regular SQL
+                    warnings = [str(row[0]) for row in cursor.fetchall()]
+        except teradatasql.Error as e:
+            if not fastexport_rejection.search(str(e)): #spool, syntax, logon errors etc. would fail the same way as regular SQL, left to the caller (see db_retry)
+                raise
+            print(f"FastExport rejected on '{self.host}', running the query as regular SQL instead. Exception: {e}")
+            return self.read_sql(query, dtype=dtype, timings=timings, schema=schema, params=params)
+
+        for warning in warnings:
+            print(f"FastExport warning: {warning}")
+        t = time.time()
+        data = pd.concat(frames, ignore_index=True) if frames else query_schemas.build([], cols, schema) #single concat, as with iter_batches' consumers
+        if len(frames) > 1: #batches have their own categories, which concat turns back into objects
+            query_schemas.apply(data, {col: kind for col, kind in query_schemas.matching(cols, schema).items() if kind == 'category'})
+        if dtype is not None:
+            data = data.astype(dtype)
+        add_time(timings, 'build', t)
+
+        with self._cond:
+            self.query_time += sum(timings.get(phase, 0) for phase in ['execute', 'fetch', 'build'])
+            self.queries += 1
+        return data
+
+    def read_with_lookup(self, query: str, values: list, table: str, col_type: str = 'VARCHAR(40)', batch_rows: int = 10000,
+                         timings: Dict[str, float] | None = None, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+        """
+        Loads the given values into a volatile table (single 'val' column) on one of the manager's sessions, then runs the query on that same session.\n
+        The query should filter on the table instead of literal IN lists, e.g 'WHERE AL1.shp_trk_nbr IN (SELECT val FROM {table})'.
+        """
+        timings = dict() if timings is None else timings
+        t = time.time()
+        with self.session() as (connection, engine):
+            t = add_time(timings, 'connect', t)
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute(f"CREATE VOLATILE TABLE {table} (val {col_type}) PRIMARY INDEX (val) ON COMMIT PRESERVE ROWS")
+                except teradatasql.OperationalError as e:
+                    if '3803' not in str(e): #3803: table already exists (left over by an earlier lookup on this session)
+                        raise
+                    cursor.execute(f"DELETE FROM {table}")
+
+                rows = [[str(val)] for val in values]
+                for i in range(0, len(rows), batch_rows):
+                    cursor.executemany(f"INSERT INTO {table} (val) VALUES (?)", rows[i:i+batch_rows])
+                try:
+                    cursor.execute(f"COLLECT STATISTICS ON {table} COLUMN (val)") #lets the optimizer size the join properly
+                except teradatasql.OperationalError as e:
+                    print(f"Unable to collect statistics on '{table}', continuing without them. Exception: {e}")
+            add_time(timings, 'execute', t)
+            print(f"Loaded {len(rows)} values into volatile table '{table}' in {time.time()-t} secs")
+
+            try:
+                data = read_timed(engine, query, timings, schema)
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE {table}")
+
+        with self._cond:
+            self.query_time += sum(timings.get(phase, 0) for phase in ['execute', 'fetch', 'build'])
+            self.queries += 1
+        return data
+
+    def read_with_volatile(self, query: str, table: str, stage: str, definition: str, params: List[object] | None = None,
+                           primary_index: str | None = None, timings: Dict[str, float] | None = None, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+        """
+        Runs the stage query once into a volatile table on one of the manager's sessions, then runs the query (reading from the table) on that same session.\n
+        definition: the stage query with its values written in, to create the empty table (DDL can't take bind parameters).\n
+        primary_index: col to distribute the table's rows on (e.g 'AWB_NBR').
+        """
+        timings = dict() if timings is None else timings
+        t = time.time()
+        with self.session() as (connection, engine):
+            t = add_time(timings, 'connect', t)
+            with connection.cursor() as cursor:
+                index: str = f" PRIMARY INDEX ({primary_index})" if primary_index else ''
+                try:
+                    cursor.execute(f"CREATE VOLATILE TABLE {table} AS (\n{definition}\n) WITH NO DATA{index} ON COMMIT PRESERVE ROWS")
+                except teradatasql.OperationalError as e:
+                    if '3803' not in str(e): #3803: table already exists (left over by an earlier run on this session)
+                        raise
+                    cursor.execute(f"DELETE FROM {table}")
+
+                cursor.execute(f"INSERT INTO {table}\n{stage}", params or None)
+                rows: int = cursor.rowcount
+            add_time(timings, 'execute', t)
+            print(f"Staged {rows} rows into volatile table '{table}' in {time.time()-t} secs")
+
+            try:
+                data = read_timed(engine, query, timings, schema)
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP TABLE {table}")
+
+        with self._cond:
+            self.query_time += sum(timings.get(phase, 0) for phase in ['execute', 'fetch', 'build'])
+            self.queries += 1
+        return data
+
+    def report(self) -> str:
+        """
+        Prints and returns a summary of the time spent connecting versus running queries.
+        """
+        summary = (f"'{self.host}' sessions: {self.connects} connect(s) in {self.connect_time:.2f} secs "
+                   f"({self.dropped} dropped), {self.queries} quer(ies) in {self.query_time:.2f} secs")
+        print(summary)
+        return summary
+
+    def close(self) -> None:
+        """
+        Closes all idle sessions.
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = list()
+        for connection, engine in idle:
+            self._discard(connection, engine)
+
+        return None
+
+_managers: Dict[Tuple[str, str], SessionManager] = dict() #maps a (host, user) pair to its shared manager
+_managers_lock = threading.Lock()
+
+def get_manager(host: str, user: str, password: str, max_sessions: int = 1) -> SessionManager:
+    """
+    Returns the shared session manager for the given host and user, creating it on first use (or again if the password changed).
+    """
+    with _managers_lock:
+        manager = _managers.get((host, user))
+        if manager is None or manager.password != password:
+            if manager is not None:
+                manager.close()
+            manager = SessionManager(host, user, password, max_sessions)
+            _managers[(host, user)] = manager
+        elif max_sessions > manager.max_sessions:
+            with manager._cond:
+                manager.max_sessions = max_sessions
+                manager._cond.notify_all()
+
+    return manager
+
+@atexit.register
+def close_all() -> None:
+    """
+    Closes every shared session and prints their timing reports. Runs automatically when the program exits.
+    """
+    with _managers_lock:
+        for manager in _managers.values():
+            if manager.connects:
+                manager.report()
+            manager.close()
+        _managers.clear()
+
+    return None
@@ -15,7 +15,9 @@ from zipfile import ZIP_DEFLATED
 import pandas as pd, numpy as np
 from pandas import DataFrame
 import classify_db
-from typing import Dict, Set
+import query_registry
+from typing import Dict, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
 #Selenium imports
 from selenium import webdriver
@@ -59,6 +61,23 @@ def get_envvar(var_name: str, envfile_path: str = dotenv.find_dotenv()) -> str:
 
     return os.environ[var_name]
 
+def get_setting(var_name: str | List[str], default: str | int | float) -> str | int | float:
+    """
+    Returns the value for the given env var name, converted to the type of the given default (e.g int or float).\n
+    Given a list of names, the first one that is set wins (e.g ['standin_latency_ms_misa', 'standin_latency_ms']).\n
+    If none of the vars exist (or the value can't be converted), it returns the default.
+    """
+
+    for name in [var_name] if isinstance(var_name, str) else var_name:
+        try:
+            return type(default)(get_envvar(name))
+        except KeyError:
+            continue
+        except ValueError:
+            return default
+
+    return default
+
 def get_chromedriver(env_path: str = '') -> str:
     """
     Will get saved path for manual chromedriver initalization.\n
@@ -269,9 +288,14 @@ def list_to_str(list: list) -> str:
 def get_query(query_path: str) -> str:
     """
     Reads query as a string from given .sql file.
+    Saved queries (support-files/queries) come from the query registry, which reads and checks them once per run (see query_registry).
     """
+    query: str | None = query_registry.get(query_path)
+    if query is not None:
+        return query
+
     with open(query_path, 'r') as sql_file:
-        query: str = sql_file.read()
+        query = sql_file.read()
 
     return query
 
@@ -459,37 +483,99 @@ def sql_able_list(vals: list, logic: str, variable: str, connector: _connector =
         final_sql += temp
     return final_sql
 
-def get_classify(awbs: list, query: str) -> pd.DataFrame:
+def get_classify(awbs: list, query: str, temp_table_threshold: int = 65000, max_workers: int = 4, chunksize: int = 65000,
+                 min_chunksize: int = 5000, target_chunk_secs: float = 30, schema: Dict[str, str] | None = None) -> pd.DataFrame:
     """
     Returns data for given awbs if found in Classify.\n
-    Returns data with awb number as index in dataframe.
+    Returns data with awb number as index in dataframe.\n
+    temp_table_threshold: above this many awbs, they are looked up through a temp table (see classify_db.lookup_query), falling back to IN lists if it fails.\n
+    max_workers, chunksize, min_chunksize, target_chunk_secs: see get_classify_chunks.
     """
-    classify_data: pd.DataFrame = pd.DataFrame()
-    chunksize = 65000
-    chunks = []
-    for i in range(0, len(awbs), chunksize):
-        chunks.append(awbs[i:i+chunksize])
 
-    #concating chunks
-    n_chunks = len(chunks)
-    for chunk in chunks:
-        print(f"Classify data chunks left: {n_chunks}")
-        classify_query = query.format(
-            awbs_to_search = sql_able_list(vals=chunk, logic='IN', variable='AWB_NBR', connector='OR'))
-        dataframe = classify_db.execute_query(query= classify_query)
-
-        if classify_data.shape[0] == 0:
-            classify_data = dataframe
+    if len(awbs) > temp_table_threshold:
+        try:
+            classify_data = classify_db.lookup_query(query, awbs, schema=schema)
+        except Exception as e:
+            print(f"Temp table lookup failed, falling back to IN lists. Exception: {e}")
         else:
-            classify_data = pd.concat([classify_data, dataframe], ignore_index=True)
-        n_chunks -= 1
-    
+            #dropping dups, changing index, returning
+            classify_data = classify_data.drop_duplicates(subset=['awb_nbr'])
+            return classify_data.set_index('awb_nbr', drop=True)
+
+    classify_data = get_classify_chunks(awbs, query, max_workers, chunksize, min_chunksize, target_chunk_secs, schema)
+
     #dropping dups
     classify_data = classify_data.drop_duplicates(subset=['awb_nbr'])
 
     #changing index, returning
     return classify_data.set_index('awb_nbr', drop=True)
 
+def get_classify_chunks(awbs: list, query: str, max_workers: int = 4, chunksize: int = 65000, min_chunksize: int = 5000, target_chunk_secs: float = 30,
+                        schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Fetches Classify data for the given awbs in chunks of IN lists, running up to max_workers chunks at the same time.\n
+    chunksize: size of the first (and largest) chunks; later chunks are sized to take about target_chunk_secs each, down to min_chunksize.
+    """
+    results: Dict[int, pd.DataFrame] = dict() #maps a chunk's starting position in awbs to its results
+    curr_size: int = chunksize
+    position: int = 0
+
+    def fetch_chunk(chunk: list) -> Tuple[pd.DataFrame, float]:
+        t = time.time()
+        classify_query = query.format(
+            awbs_to_search = sql_able_list(vals=chunk, logic='IN', variable='AWB_NBR', connector='OR'))
+        return classify_db.execute_query(query= classify_query, schema=schema), time.time()-t
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        running: Dict[Future, Tuple[int, int]] = dict() #maps a running chunk to its starting position and size
+        while position < len(awbs) or running:
+            #Keeping up to max_workers chunks running
+            while position < len(awbs) and len(running) < max(1, max_workers):
+                chunk = awbs[position:position+curr_size]
+                running[executor.submit(fetch_chunk, chunk)] = (position, len(chunk))
+                position += len(chunk)
+            print(f"Classify awbs left to send: {len(awbs) - position}, chunks running: {len(running)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, size = running.pop(future)
+                results[start], secs = future.result()
+
+                #Adapting chunk size to the latency seen for this chunk (secs per awb)
+                if secs > 0:
+                    curr_size = int(min(chunksize, max(min_chunksize, size*target_chunk_secs/secs)))
+                print(f"Chunk of {size} awbs took {secs} secs, next chunks will hold {curr_size} awbs")
+
+    if not results:
+        return pd.DataFrame(columns=['awb_nbr'])
+
+    return pd.concat([results[start] for start in sorted(results)], ignore_index=True) #single concat, in the original order
+
+def get_misa(awbs: list, query: str, variable: str, pw: str, lookup_threshold: int = 1000, placeholder: str = 'awbs',
+             cache_ttl: float = 0, force_refresh: bool = False, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Returns the MISA results of the given query for the given awbs, filtered on the given variable (e.g 'AL1.shp_trk_nbr') at the query's placeholder (e.g '{awbs}').\n
+    lookup_threshold: above this many awbs, they are looked up through a volatile table (see misa_db.lookup_query), falling back to IN lists if it fails.
+    """
+    import misa_db #only loaded when MISA is used
+
+    if len(awbs) > lookup_threshold:
+        try:
+            return misa_db.lookup_query(query, awbs, pw, variable=variable, placeholder=placeholder, cache_ttl=cache_ttl, force_refresh=force_refresh, schema=schema)
+        except Exception as e:
+            print(f"Volatile table lookup failed, falling back to IN lists. Exception: {e}")
+
+    misa_query = query.format(**{placeholder: sql_able_list(awbs, logic='IN', variable=variable)})
+    return misa_db.execute_query(misa_query, pw=pw, date_query=False, cache_ttl=cache_ttl, force_refresh=force_refresh, schema=schema)
+
+def excel_values(dataframe: pd.DataFrame) -> List[list]:
+    """
+    Returns the given dataframe's rows as lists of plain python values, ready to be pasted into a sheet with xlwings.\n
+    Typed cols (categories, nullable ints, Arrow strings, see query_schemas) are given back as plain values, and any missing value (NaN, NaT, <NA>) as an empty cell.
+    """
+    values: DataFrame = dataframe.astype(object)
+    return values.where(dataframe.notna(), None).values.tolist()
+
 def find_OLD(dataframe: pd.DataFrame, awb_position: int = 1) -> List[int]:
     """
     From given dataframe, finds index of awbs that cannot be casted to int (usually because they contain 'OLD'). Returns list of indices.\n
@@ -14,7 +14,8 @@ from pathlib import Path
 import os
 from pandas import DataFrame
 from misa_db import execute_query
-from tools import get_query, get_password, send_email
+from tools import get_query, get_password, send_email, excel_values
+from query_schemas import schema_for, layout_for, layouts
 import numpy as np
 import shutil
 import xlwings as xw
@@ -48,73 +49,20 @@ def fix_headers(data: DataFrame, index: str) -> DataFrame:
     Drops all unnecessary columns, for each dataframe.
 
     Adds any necessary, empty, new columns to match fixed cols requirements.
+
+    The columns of each audit are kept in query_schemas.layouts.
     """
 
-    #Dict showing the correct order for headers
-    fixed_cols: Dict[str, List[str]] = {
-        '2c': [
-            'Awb_Nbr',
-            'N_of_Lines',
-            'Value_Flg',
-            'Tariff_Cd',
-            'COO',
-            'COE',
-            'Importer_Nm',
-            'Customs_Value_Amt',
-            'Currency_Cd',
-            'Duty_Bill_To_Acct_Nbr',
-            'Clr_Loc',
-            'Entry_Dt',
-            'Release_Dt',
-            'Rod_Flg',
-            'Employee',
-            'Duty_Amt',
-            'Status',
-            'Tariff_Annex_Cd',
-            'PST',
-            'GST',
-            'Exchange_Rate',
-            'Customs_Value_In_CAD'
-            ],
-
-        '7': [
-            'Awb_Nbr',
-            'N_of_Lines',
-            'Duty_Bill_To_Acct_Nbr',
-            'Value_Flg',
-            # 'Tariff_Cd',
-            'COE',
-            'COO',
-            'Importer_Nm',
-            'Canadian_Entry_Nbr',
-            'Business_Nbr',
-            # 'Customs_Value_Amt',
-            # 'Currency_Cd',
-            # 'Clr_Loc',
-            'Entry_Dt',
-            'Release_Dt',
-            'Rod_Flg',
-            'Customs_Value_In_CAD',
-            'Employee',
-            'Tariff_Annex_Cd',
-            # 'Status', 
-            'PST',
-            'GST',
-            'CustomsAmt_BKR_CAD',
-            'OIC',
-            'SIMA'
-            # 'Exchange_Rate',
-            ]
-    }
+    fixed_cols: List[str] = layouts[f'quality_audits/{index}'] #correct order for headers
+    if list(data.columns) == fixed_cols:
+        return data #already fetched in the final layout
 
     #Adding any applicable missing columns (adds with all empty numpy NaN values.)
-    new_data: DataFrame = data.copy(deep=True)
-    for header in fixed_cols[index]:
+    for header in fixed_cols:
         if header not in data.columns: #checking if header is missing from existing data
             data[header] = nan
-    
-    new_data = data[fixed_cols[index]]
-    return new_data #only return cols in the given list, in the given order; gets list from fixed_cols dictionary
+
+    return data[fixed_cols] #only return cols in the given list, in the given order
 
 def run_audits(audits_query_path: Path = Path(r"main_automation_programs\support-files\queries\quality_audits"),
                general_audits_path: Path = Path(r"main_automation_programs\reports\audits\quality-audits")) -> None:
@@ -158,10 +106,12 @@ def run_audits(audits_query_path: Path = Path(r"main_automation_programs\support
         audit_results: DataFrame = execute_query(query= get_query((audits_query_path/query_file).as_posix()),
                                                  pw= get_password(),
                                                  starting=starting,
-                                                 ending=ending
+                                                 ending=ending,
+                                                 schema=schema_for(audits_query_path/query_file),
+                                                 columns=layout_for(audits_query_path/query_file) #only the template's columns, in order
                                                 )
         print(f"Query for '{audit_name}' fetched successfully.\n")
-        audit_results = audit_results[:150] #keeping first 150 rows only
+        audit_results = audit_results[:150] #keeping first 150 rows only (already cut by MISA, see the row_limit comment in the audit queries)
         print(audit_results)
 
         #skipping if empty results
@@ -194,7 +144,7 @@ def run_audits(audits_query_path: Path = Path(r"main_automation_programs\support
                     sheet_name = sheet #finding correct sheet name to paste in
 
             curr_sheet: xw.Sheet = audit_wb.sheets[sheet_name] #creating new sheet object for current sheet
-            values = audit_results.values.tolist()
+            values = excel_values(audit_results) #typed cols (categories, nullable ints, dates) as plain values
             curr_sheet.range('A2').value =  values #pasting values into sheet
 
             #saving and closing
@@ -4,15 +4,17 @@ Used for queying the WFM database from python (CTA AIR database).
 Please note that you might need to change the credentials below if they ever get updated (you will probably receive an email warning you that the credentials are changing)
 """
 
-import oracledb as odb
 import pandas as pd
-from sqlalchemy import create_engine
 import numpy as np
 import time
-from typing import List
+from typing import Dict, List, Iterator
 import sys, os
 sys.path.append(os.getcwd())
 sys.path.append(f"{os.getcwd()}/main_automation_programs")
+from oracle_pool import get_engine, read_arrow, iter_batches
+import query_metrics
+import standin_db
+import db_retry
 
 un = 'CTA_AIR_RO_APP'
 pw = 'pQMh1Kx_AaXeMtKbvbmzUUUYkB_b87'
@@ -20,23 +22,56 @@ cs = 'CTA_PROD_FXE_CAN_DBA_SVC.prod.iaas.fedex.com'
 hostname = 'P100375-scan.prod.iaas.fedex.com'
 port = 1526
 
-def execute_query(query: str) -> pd.DataFrame:
-
-    #Initializing oracledb
-    from tools import get_envvar
-    odb.init_oracle_client(lib_dir=get_envvar('oracle_install_path'))
+def execute_query(query: str, arrow: bool = False, schema: Dict[str, str] | None = None) -> pd.DataFrame:
+    """
+    Executes given query in WFM.\n
+    arrow: fetches straight into an Arrow-backed dataframe instead of going through pd.read_sql.\n
+    schema: column types to build the results with (see query_schemas.schema_for). Without one, date cols are parsed and awbs converted to ints afterwards.
+    """
 
     t = time.time()
-    params = odb.ConnectParams(host=hostname, port=port, service_name=cs)
-    con = odb.connect(user=un, password=pw, params=params)
-    print(f"Db version: {con.version}")
-    engine = create_engine('oracle+oracledb://', creator=lambda: con) #using sqlalchemy for better compatibility
     print(f"Fetching '{cs}' with query '{query[:min(len(query), 200)]}' (complete query may not be shown)")
-    try: #reading with ideal reserve settings
-        data = pd.read_sql(sql=query, con=engine, parse_dates=['entry_dt', 'crt_dt', 'assign_dt','updt_dt'],
-                           dtype={'awb': np.int64})
+    timings: Dict[str, float] = dict() #filled in while fetching, see query_metrics
+    def fetch() -> pd.DataFrame:
+        if standin_db.enabled(): #local stand-in, see standin_db
+            return standin_db.read_sql('wfm', query, timings, arrow=arrow, schema=schema)
+        if arrow:
+            return read_arrow('wfm', query, user=un, password=pw, host=hostname, port=port, service_name=cs, casts={} if schema else {'awb': 'int64'}, timings=timings, schema=schema)
+        engine = get_engine('wfm', user=un, password=pw, host=hostname, port=port, service_name=cs) #borrows a warm session from the shared wfm pool
+        return query_metrics.read_timed(engine, query, timings, schema)
+
+    data = db_retry.call('wfm', fetch) #transient errors are retried with a backoff, see db_retry
+    if standin_db.enabled() or arrow or schema: #already typed while built
+        print(f'Time taken to fetch query: {time.time()-t} secs')
+        query_metrics.record('wfm', query, data, timings, time.time()-t, arrow=arrow)
+        return data
+    try: #converting with ideal reserve settings
+        typed = data.copy()
+        for col in ['entry_dt', 'crt_dt', 'assign_dt','updt_dt']:
+            typed[col] = pd.to_datetime(typed[col])
+        data = typed.astype({'awb': np.int64})
     except:
         print(f'Unable to read dataframe with settings, reading basic instead')
-        data = pd.read_sql(sql=query, con=engine)
     print(f'Time taken to fetch query: {time.time()-t} secs')
-    return data
\ No newline at end of file
+    query_metrics.record('wfm', query, data, timings, time.time()-t, arrow=arrow)
+    return data
+
+def iter_query(query: str, batch_rows: int = 50000, schema: Dict[str, str] | None = None) -> Iterator[pd.DataFrame]:
+    """
+    Streaming version of execute_query: yields the results in dataframes of at most batch_rows rows, as they arrive from WFM.
+    """
+
+    t = time.time()
+    print(f"Streaming '{cs}' in batches of {batch_rows} rows with query '{query[:min(len(query), 200)]}' (complete query may not be shown)")
+    rows: int = 0
+    if standin_db.enabled():
+        batches = standin_db.iter_batches('wfm', query, batch_rows=batch_rows, schema=schema)
+    else:
+        batches = iter_batches('wfm', query, user=un, password=pw, host=hostname, port=port, service_name=cs, batch_rows=batch_rows, schema=schema)
+    for batch in batches:
+        for col in ['entry_dt', 'crt_dt', 'assign_dt','updt_dt']:
+            if not schema and col in batch.columns:
+                batch[col] = pd.to_datetime(batch[col])
+        rows += batch.shape[0]
+        yield batch
+    print(f'Time taken to stream query: {time.time()-t} secs ({rows} rows)')
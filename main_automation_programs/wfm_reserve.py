@@ -8,9 +8,10 @@ import pandas as pd
 import numpy as np
 from typing import List
 from tools import send_email, get_envvar, get_query
+from query_schemas import schema_for
 from smtplib import SMTPSenderRefused
 
-def main(query_path: str = r'main_automation_programs\support-files\queries\wfm_reserve.sql', email_to: List[str] = [get_envvar('fedex-email')]) -> None:
+def main(query_path: str = r'main_automation_programs\support-files\queries\wfm_reserve.sql', email_to: List[str] = [get_envvar('fedex-email')], batch_rows: int = 50000) -> None:
     """
     Gets today's wfm reserve file from oracle db.
 
@@ -20,24 +21,32 @@ def main(query_path: str = r'main_automation_programs\support-files\queries\wfm_
 
     query_path: path to look for wfm query (in .sql format)
     email: email addresses to send results to, as list of strings
+    batch_rows: how many rows to fetch and write to the .csv file at a time
     """
 
     path = Path(os.path.expanduser('~')) / 'Downloads'
     tday = datetime.date.today().strftime("%d%b%y")
     path /= f'WFM_Reserve {tday}.csv'
     print(f"Downloading to '{path}'")
-    wfm_data = wfm_db.execute_query(query=get_query(query_path)) #getting query results
-    wfm_data.columns = [x.upper() for x in wfm_data.columns]#changing col names
-
     #Defining cols we would like to force as ints, iterating
     to_int: List[str] = ['BILL_TO_ACC', 'PCS', 'TRANSACTION_NBR', 'ASSIGNED_TO', 'REASON_CD', 'SHIPPER_ACCT']
 
-    # Fixing to ints
-    for header in to_int:
-        wfm_data = int_data(wfm_data, header)
+    #Streaming query results, each batch is fixed and written to the .csv file as it arrives (the whole reserve is never held in memory)
+    rows: int = 0
+    for wfm_data in wfm_db.iter_query(query=get_query(query_path), batch_rows=batch_rows, schema=schema_for(query_path)):
+        wfm_data.columns = [x.upper() for x in wfm_data.columns]#changing col names
+
+        # Fixing to ints
+        for header in to_int:
+            wfm_data = int_data(wfm_data, header)
+
+        wfm_data.to_csv(path_or_buf=str(path), mode='w' if rows == 0 else 'a', header=rows == 0, #only writing headers for first batch
+                        index=False, quoting=csv.QUOTE_STRINGS, date_format=r"%d-%b-%Y %H.%M.%S.%f")
+        rows += wfm_data.shape[0]
+        print(f"reserve rows written: {rows}")
 
-    print(f"reserve df:\n{wfm_data}")
-    wfm_data.to_csv(path_or_buf=str(path),index=False, quoting=csv.QUOTE_STRINGS, date_format=r"%d-%b-%Y %H.%M.%S.%f")
+    if rows == 0: #no batches, creating empty file so there is still something to send
+        open(path, mode='w').close()
     
     # Email reserve out
     if len(email_to) != 0: